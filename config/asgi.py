@@ -5,12 +5,23 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
+
+Servidor local asíncrono (pip install uvicorn):
+    TIENDA_VISTAS_ASYNC=True DJANGO_SETTINGS_MODULE=config.settings.base uvicorn config.asgi:application --reload
+En producción, con varios procesos:
+    uvicorn config.asgi:application --workers 4
+o con daphne: daphne config.asgi:application
 """
 
 import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django-base-pro.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.production')
+# Servido por ASGI, las páginas de lectura usan las vistas asíncronas de tienda/vistas_async.py
+os.environ.setdefault('TIENDA_VISTAS_ASYNC', 'True')
+# Con ASGI cada petición abre la conexión en un hilo propio: las persistentes se quedarían abiertas
+# en hilos que ya no se usan. Para reutilizarlas, un pool externo (pgbouncer).
+os.environ.setdefault('CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
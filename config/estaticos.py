@@ -0,0 +1,31 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+# Ficheros de texto que merece la pena comprimir; las imágenes y fuentes ya van comprimidas
+EXTENSIONES_COMPRIMIBLES = ('.css', '.js', '.svg', '.json', '.txt', '.xml', '.html', '.map')
+
+
+class ManifestComprimidoStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage que, al terminar collectstatic, deja junto a cada fichero de
+    texto con hash su versión .gz, para que el servidor web no tenga que comprimir en cada petición."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        procesados = set()
+        for original, procesado, cambiado in super().post_process(paths, dry_run, **options):
+            if procesado and not isinstance(cambiado, Exception):
+                procesados.add(procesado)
+            yield original, procesado, cambiado
+        if not dry_run:
+            for nombre in sorted(procesados):
+                if nombre.endswith(EXTENSIONES_COMPRIMIBLES):
+                    self.comprimir(nombre)
+
+    def comprimir(self, nombre):
+        with self.open(nombre) as fichero:
+            contenido = fichero.read()
+        # mtime=0: el mismo contenido produce el mismo .gz en cada despliegue
+        comprimido = gzip.compress(contenido, compresslevel=9, mtime=0)
+        if len(comprimido) < len(contenido):
+            with open(self.path(nombre) + '.gz', 'wb') as salida:
+                salida.write(comprimido)
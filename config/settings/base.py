@@ -57,12 +57,18 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Perfilado de consultas por petición; sólo se carga con TIENDA_PERFILAR_CONSULTAS=True
+    'tienda.middleware.PerfilConsultasMiddleware',
+    # Lecturas en la réplica y cookie tras escribir; sólo se carga con DATABASE_REPLICA_URL
+    'tienda.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # Es importante el orden para que las traducciones esten preparadas
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.cliente, cargado de forma perezosa una vez por petición
+    'tienda.middleware.ClienteMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -100,6 +106,78 @@ DATABASES = {
     }
 }
 
+# Réplica de sólo lectura opcional para catálogo, búsqueda, informes y exportación (ver
+# tienda/replicas.py), p. ej. DATABASE_REPLICA_URL=postgres://lector@replica/tienda. En local
+# puede probarse con otro fichero SQLite: DATABASE_REPLICA_URL=sqlite:////tmp/replica.sqlite3
+# (copia de db.sqlite3; la "replicación" es volver a copiarlo).
+if env('DATABASE_REPLICA_URL', default=None):
+    DATABASES['replica'] = env.db_url('DATABASE_REPLICA_URL')
+    # En los tests la réplica es la propia base de datos de pruebas
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+TIENDA_REPLICA = 'replica' if 'replica' in DATABASES else None
+# Segundos que las lecturas de un usuario siguen yendo a la primaria después de que escriba
+TIENDA_REPLICA_PEGAJOSA = env.int('TIENDA_REPLICA_PEGAJOSA', default=5)
+DATABASE_ROUTERS = ['tienda.replicas.RouterReplica']
+
+# Caché del catálogo (tienda/cache_catalogo.py). Por defecto en memoria del proceso;
+# con varios procesos puede compartirse en disco, p. ej. CACHE_URL=filecache:///var/tmp/tienda
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+TIENDA_CACHE_SEGUNDOS = env.int('TIENDA_CACHE_SEGUNDOS', default=300)
+
+# Sesiones en la base de datos. Con una caché compartida por todos los procesos (CACHE_URL que no
+# sea la memoria local) se leen de la caché y se escriben también en la base de datos (cached_db):
+# la lectura de cada petición deja de ir a la base de datos. Con la memoria de cada proceso eso no
+# vale, porque los demás procesos no verían los cambios de la sesión (el carrito); la alternativa
+# sin caché es SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies, que guarda la
+# sesión en la propia cookie firmada.
+TIENDA_CACHE_COMPARTIDA = CACHES['default']['BACKEND'] not in ('django.core.cache.backends.locmem.LocMemCache',
+                                                               'django.core.cache.backends.dummy.DummyCache')
+SESSION_ENGINE = env('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db' if TIENDA_CACHE_COMPARTIDA
+                     else 'django.contrib.sessions.backends.db')
+
+TIENDA_PERFILAR_CONSULTAS = env.bool('TIENDA_PERFILAR_CONSULTAS', default=False)
+
+# Vistas asíncronas para catálogo, búsqueda, ficha de producto e informes (tienda/vistas_async.py).
+# config/asgi.py lo activa por defecto; con WSGI se usan las síncronas.
+TIENDA_VISTAS_ASYNC = env.bool('TIENDA_VISTAS_ASYNC', default=False)
+
+# Cola de tareas en segundo plano en la base de datos (tienda/cola.py), que ejecuta
+# manage.py procesar_tareas: intentos por tarea, espera base del primer reintento (se
+# duplica en cada fallo) y segundos que un trabajador retiene una tarea antes de que otro
+# la dé por abandonada y la recupere.
+TIENDA_TAREAS_INTENTOS = env.int('TIENDA_TAREAS_INTENTOS', default=5)
+TIENDA_TAREAS_ESPERA = env.int('TIENDA_TAREAS_ESPERA', default=10)
+TIENDA_TAREAS_PLAZO = env.int('TIENDA_TAREAS_PLAZO', default=300)
+# Unidades a partir de las que una compra avisa a los administradores de stock bajo
+TIENDA_STOCK_BAJO = env.int('TIENDA_STOCK_BAJO', default=5)
+
+# Productos como mucho en el índice de sugerencias del buscador que guarda cada proceso
+# (tienda/autocompletar.py); unos 500 bytes por producto (ver manage.py bench_busqueda)
+TIENDA_AUTOCOMPLETAR_MAXIMO = env.int('TIENDA_AUTOCOMPLETAR_MAXIMO', default=100_000)
+
+# Minutos que el carrito retiene las unidades añadidas (ver tienda/reservas.py)
+TIENDA_RESERVA_MINUTOS = env.int('TIENDA_RESERVA_MINUTOS', default=15)
+
+# Correo (confirmaciones de compra y avisos); en desarrollo se escribe en la consola
+EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='tienda@localhost')
+ADMINS = [('Tienda', correo) for correo in env.list('TIENDA_ADMINS', default=[])]
+
+# Una línea JSON por petición perfilada (ver tienda/middleware.py) y por tarea ejecutada (tienda/cola.py)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'tienda.consultas': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'tienda.tareas': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
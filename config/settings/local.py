@@ -3,13 +3,12 @@ from .base import *
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': env('POSTGRES_DB'),
-        'USER': env('POSTGRES_USER'),
-        'PASSWORD': env('POSTGRES_PASSWORD'),
-        'HOST': env('POSTGRES_HOST'),
-        'PORT': env('POSTGRES_PORT'),
-    }
+# Sólo se sustituye la primaria: la réplica, si la hay, se define en base.py
+DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.postgresql',
+    'NAME': env('POSTGRES_DB'),
+    'USER': env('POSTGRES_USER'),
+    'PASSWORD': env('POSTGRES_PASSWORD'),
+    'HOST': env('POSTGRES_HOST'),
+    'PORT': env('POSTGRES_PORT'),
 }
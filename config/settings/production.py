@@ -0,0 +1,38 @@
+from .base import *
+
+# Perfil de despliegue. Parte de base.py y cambia lo que afecta al rendimiento con tráfico real.
+# Variables obligatorias: SECRET_KEY, DATABASE_URL y ALLOWED_HOSTS. Antes de arrancar:
+#   manage.py migrate && manage.py collectstatic --noinput
+# Comparación con base.py sobre los mismos datos: manage.py bench_rps (ver su ayuda).
+
+DEBUG = False
+ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=[])
+
+# Database
+# Conexiones persistentes: cada proceso reutiliza la suya durante CONN_MAX_AGE segundos en vez
+# de abrir una por petición, y se comprueba que sigue viva antes de usarla tras una petición.
+DATABASES['default'] = env.db('DATABASE_URL')
+for alias in DATABASES:
+    DATABASES[alias]['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=600)
+    DATABASES[alias]['CONN_HEALTH_CHECKS'] = True
+
+# Caché: la de base.py, en memoria de cada proceso salvo que CACHE_URL diga otra cosa. La caché en
+# disco (filecache) daba un 4 % menos de peticiones por segundo en bench_rps; con varios procesos,
+# un servidor compartido, p. ej. CACHE_URL=redis://host:6379/1 (requiere el paquete redis), que también pasa las sesiones a
+# cached_db. Las plantillas ya se compilan una vez por proceso: con DEBUG = False Django usa el
+# cargador en caché sin configurarlo.
+
+# Estáticos con el hash del contenido en el nombre (se pueden cachear sin caducidad) y una copia
+# .gz junto a cada fichero de texto para que el servidor web la sirva tal cual (nginx: gzip_static on)
+STATIC_ROOT = env('STATIC_ROOT', default=str(PROJECT_ROOT_DIR / 'staticfiles'))
+STATICFILES_STORAGE = 'config.estaticos.ManifestComprimidoStorage'
+
+# Sesiones: sólo se guardan cuando cambian (el motor lo elige base.py según la caché)
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_COOKIE_SECURE = env.bool('COOKIES_SEGURAS', default=True)
+CSRF_COOKIE_SECURE = SESSION_COOKIE_SECURE
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+# El orden de MIDDLEWARE de base.py ya es el adecuado: seguridad primero, sesión antes que idioma
+# y autenticación, y los middleware opcionales (perfilado, réplica) se retiran solos al arrancar
+# si no están activos, así que no añaden nada a cada petición.
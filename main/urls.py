@@ -1,12 +1,20 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
 
+from tienda import urls as urls_tienda
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    #ruta para establecer idioma
-    path('i18n/', include('django.conf.urls.i18n')),
-    path('', TemplateView.as_view(template_name='main/index.html'), name='welcome'),
-    path('tienda/', include('tienda.urls'))
-]
+
+def patrones(asincronas=False):
+    return [
+        path('admin/', admin.site.urls),
+        #ruta para establecer idioma
+        path('i18n/', include('django.conf.urls.i18n')),
+        path('', TemplateView.as_view(template_name='main/index.html'), name='welcome'),
+        path('tienda/', include(urls_tienda.patrones(asincronas)))
+    ]
+
+
+# Con TIENDA_VISTAS_ASYNC (servidor ASGI, ver config/asgi.py) las páginas de lectura son asíncronas
+urlpatterns = patrones(settings.TIENDA_VISTAS_ASYNC)
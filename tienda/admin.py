@@ -1,10 +1,230 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .busqueda import obtener_backend
+from .cola import reintentar
+from .form import PostProducto
 from .models import *
+from .valoraciones import aplicar_valoracion
+
+# Por debajo de este número de filas estimadas se cuenta de verdad
+UMBRAL_ESTIMACION = 10_000
+
+
+def estimar_filas(modelo, using):
+    """Número aproximado de filas de la tabla según las estadísticas del motor, sin recorrerla:
+    ``pg_class.reltuples`` en PostgreSQL y ``sqlite_stat1`` en SQLite (requiere ANALYZE).
+    None si el motor no tiene estadísticas de la tabla."""
+    conexion = connections[using]
+    if conexion.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif conexion.vendor == 'sqlite':
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+    else:
+        return None
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(sql, [modelo._meta.db_table])
+            fila = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if fila is None:
+        return None
+    filas = int(str(fila[0]).split()[0])
+    return filas if filas >= 0 else None
+
+
+def buscar_por_numero(queryset, texto, *campos):
+    """Búsqueda exacta por identificador en columnas indexadas; nada si el texto no es un número."""
+    texto = texto.strip()
+    if not texto:
+        return queryset
+    if not texto.isdigit():
+        return queryset.none()
+    filtro = Q()
+    for campo in campos:
+        filtro |= Q(**{campo: int(texto)})
+    return queryset.filter(filtro)
+
+
+class ConteoEstimadoPaginator(Paginator):
+    """Paginador del admin que, en los listados sin filtrar de tablas grandes, usa la estimación
+    de filas del motor en vez de un COUNT(*) que recorre toda la tabla."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimacion = estimar_filas(queryset.model, queryset.db)
+            if estimacion is not None and estimacion >= UMBRAL_ESTIMACION:
+                return estimacion
+        return super().count
+
+
+class ListadoGrandeAdmin(admin.ModelAdmin):
+    paginator = ConteoEstimadoPaginator
+    # Sin el "N resultados (M en total)" que añade un segundo COUNT(*) al buscar o filtrar
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(Marca)
+class MarcaAdmin(admin.ModelAdmin):
+    list_display = ['nombre']
+    search_fields = ['^nombre']
+    ordering = ['nombre']
+
+
+@admin.register(Producto)
+class ProductoAdmin(ListadoGrandeAdmin):
+    list_display = ['nombre', 'marca', 'modelo', 'precio', 'unidades', 'vip', 'valoracion_media']
+    list_select_related = ['marca']
+    list_filter = ['vip']
+    autocomplete_fields = ['marca']
+    # La búsqueda va al índice de texto de busqueda.py (sobre nombre, modelo y marca)
+    search_fields = ['nombre']
+    ordering = ['nombre', 'id']
+    readonly_fields = ['num_valoraciones', 'valoracion_media', 'estrellas_1', 'estrellas_2', 'estrellas_3',
+                       'estrellas_4', 'estrellas_5']
+    # Como en la vista de edición: se escribe el stock total y se guarda sin las unidades reservadas
+    form = PostProducto
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=obtener_backend(queryset.db).buscar(search_term)), False
+
+
+@admin.register(Cliente)
+class ClienteAdmin(ListadoGrandeAdmin):
+    list_display = ['user', 'saldo', 'vip']
+    list_select_related = ['user']
+    list_filter = ['vip']
+    autocomplete_fields = ['user']
+    # Prefijo del nombre de usuario, que tiene índice único
+    search_fields = ['^user__username']
+
+
+@admin.register(Pedido)
+class PedidoAdmin(ListadoGrandeAdmin):
+    list_display = ['id', 'fecha', 'cliente', 'importe']
+    list_select_related = ['cliente__user']
+    raw_id_fields = ['cliente']
+    search_fields = ['id']
+    date_hierarchy = 'fecha'
+    ordering = ['-fecha']
+
+    def get_search_results(self, request, queryset, search_term):
+        return buscar_por_numero(queryset, search_term, 'pk'), False
+
+
+@admin.register(Compra)
+class CompraAdmin(ListadoGrandeAdmin):
+    list_display = ['id', 'fecha', 'producto', 'cliente', 'unidades', 'importe', 'pedido_id']
+    # Producto.__str__ usa la marca y el cliente se muestra por su usuario
+    list_select_related = ['producto__marca', 'user__user']
+    raw_id_fields = ['producto', 'user', 'pedido']
+    search_fields = ['id', 'pedido']
+    date_hierarchy = 'fecha'
+    ordering = ['-fecha']
+
+    def get_search_results(self, request, queryset, search_term):
+        return buscar_por_numero(queryset, search_term, 'pk', 'pedido_id'), False
+
+    @admin.display(ordering='user', description='cliente')
+    def cliente(self, compra):
+        return compra.user.user.username
+
+    # Las compras son el histórico del que salen stock, saldo y agregados de ventas: se pueden
+    # añadir a mano (sumándolas a los agregados) pero no cambiar ni borrar
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.readonly_fields
+        return [campo.name for campo in self.model._meta.concrete_fields]
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Comentario)
+class ComentarioAdmin(ListadoGrandeAdmin):
+    list_display = ['id', 'producto', 'valoracion', 'comentario']
+    list_select_related = ['producto__marca']
+    list_filter = ['valoracion']
+    autocomplete_fields = ['producto']
+    ordering = ['-id']
+
+    # Como en las vistas de comentarios, el resumen de valoraciones del producto se ajusta
+    # en la misma transacción (la del admin) en que se guarda o se borra el comentario
+    def save_model(self, request, obj, form, change):
+        producto, valoracion = (form.initial.get('producto'), form.initial.get('valoracion')) if change \
+            else (None, None)
+        super().save_model(request, obj, form, change)
+        using = obj._state.db
+        if producto == obj.producto_id:
+            aplicar_valoracion(obj.producto_id, anterior=valoracion, nueva=obj.valoracion, using=using)
+        else:
+            if producto is not None:
+                aplicar_valoracion(producto, anterior=valoracion, using=using)
+            aplicar_valoracion(obj.producto_id, nueva=obj.valoracion, using=using)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        aplicar_valoracion(obj.producto_id, anterior=obj.valoracion, using=obj._state.db)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic(using=queryset.db):
+            borrados = list(queryset.values_list('producto_id', 'valoracion'))
+            super().delete_queryset(request, queryset)
+            for producto_id, valoracion in borrados:
+                aplicar_valoracion(producto_id, anterior=valoracion, using=queryset.db)
+
+
+@admin.register(Direccion)
+class DireccionAdmin(admin.ModelAdmin):
+    list_display = ['user', 'direccion_envio']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+
+
+@admin.register(Tarjeta)
+class TarjetaAdmin(admin.ModelAdmin):
+    list_display = ['user', 'tipo_tarjeta', 'nombre_tarjeta', 'caducidad_tarjeta']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+
+
+@admin.register(Tarea)
+class TareaAdmin(ListadoGrandeAdmin):
+    list_display = ['id', 'nombre', 'estado', 'intentos', 'creada', 'disponible', 'terminada', 'trabajador']
+    list_filter = ['estado', 'nombre']
+    readonly_fields = ['creada', 'iniciada', 'terminada', 'trabajador', 'error']
+    ordering = ['-id']
+    actions = ['volver_a_intentar']
+
+    @admin.action(description='Volver a intentar las tareas fallidas seleccionadas')
+    def volver_a_intentar(self, request, queryset):
+        self.message_user(request, f'{reintentar(queryset)} tareas vuelven a la cola')
+
+
+@admin.register(Reserva)
+class ReservaAdmin(ListadoGrandeAdmin):
+    list_display = ['id', 'titular', 'producto', 'unidades', 'caduca']
+    list_select_related = ['producto__marca']
+    ordering = ['caduca']
+
+    # Borrar una reserva a mano no devolvería sus unidades: lo hace liberar_reservas al caducar
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
-# Register your models here.
-admin.site.register(Marca)
-admin.site.register(Producto)
-admin.site.register(Cliente)
-admin.site.register(Compra)
-admin.site.register(Direccion)
-admin.site.register(Tarjeta)
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,189 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import Compra, Producto, VentasCliente, VentasPeriodo, VentasProducto
+
+LOTE = 500
+CENTIMO = Decimal('0.01')
+CAMPOS = ('unidades', 'importe', 'compras')
+CLAVE_PERIODO = ['periodo', 'dimension', 'clave', 'inicio']
+# Campo de Compra que da la clave de cada dimensión de VentasPeriodo
+DIMENSIONES = {'producto': 'producto_id', 'marca': 'producto__marca_id', 'cliente': 'user_id', 'total': None}
+
+
+def upsert_incremental(modelo, claves, filas, using=DEFAULT_DB_ALIAS):
+    """Suma ``filas`` ({clave: {campo: valor}}) a la tabla de ``modelo``.
+
+    Un único INSERT ... ON CONFLICT DO UPDATE por lote, de modo que sumar N
+    compras cuesta lo mismo que sumar una y dos transacciones concurrentes
+    nunca se pisan (la suma la hace la base de datos, no Python).
+    """
+    if not filas:
+        return
+    opts = modelo._meta
+    quote_name = connections[using].ops.quote_name
+    tabla = quote_name(opts.db_table)
+    columnas_clave = [quote_name(opts.get_field(clave).column) for clave in claves]
+    campos = list(next(iter(filas.values())))
+    columnas_valor = [quote_name(opts.get_field(campo).column) for campo in campos]
+    columnas = ', '.join(columnas_clave + columnas_valor)
+    actualizar = ', '.join(f'{columna} = {tabla}.{columna} + EXCLUDED.{columna}' for columna in columnas_valor)
+    marcador = '(' + ', '.join(['%s'] * (len(columnas_clave) + len(columnas_valor))) + ')'
+    filas = list(filas.items())
+    with connections[using].cursor() as cursor:
+        for inicio in range(0, len(filas), LOTE):
+            lote = filas[inicio:inicio + LOTE]
+            parametros = []
+            for clave, valores in lote:
+                parametros.extend(clave if isinstance(clave, tuple) else (clave,))
+                parametros.extend(valores[campo] for campo in campos)
+            cursor.execute(
+                f'INSERT INTO {tabla} ({columnas}) VALUES {", ".join([marcador] * len(lote))} '
+                f'ON CONFLICT ({", ".join(columnas_clave)}) DO UPDATE SET {actualizar}',
+                parametros,
+            )
+
+
+def restar(modelo, claves, filas, using=DEFAULT_DB_ALIAS):
+    """Resta ``filas`` ({clave: {campo: valor}}) de filas ya existentes de ``modelo``.
+
+    Con UPDATE y no con upsert_incremental: SQLite comprueba las restricciones CHECK de los
+    campos positivos sobre la fila del INSERT antes de resolver el conflicto, y una fila con
+    valores negativos no pasaría aunque acabara siendo un UPDATE.
+    """
+    if not filas:
+        return
+    opts = modelo._meta
+    quote_name = connections[using].ops.quote_name
+    tabla = quote_name(opts.db_table)
+    campos = list(next(iter(filas.values())))
+    asignaciones = ', '.join(f'{columna} = {columna} - %s'
+                             for columna in (quote_name(opts.get_field(campo).column) for campo in campos))
+    condicion = ' AND '.join(f'{quote_name(opts.get_field(clave).column)} = %s' for clave in claves)
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {tabla} SET {asignaciones} WHERE {condicion}',
+            [[valores[campo] for campo in campos] + list(clave if isinstance(clave, tuple) else (clave,))
+             for clave, valores in filas.items()],
+        )
+
+
+def _acumular(compras):
+    por_producto = defaultdict(lambda: {'unidades': 0, 'importe': Decimal(0), 'compras': 0})
+    por_cliente = defaultdict(lambda: {'unidades': 0, 'importe': Decimal(0), 'compras': 0})
+    for compra in compras:
+        for acumulado in (por_producto[compra.producto_id], por_cliente[compra.user_id]):
+            acumulado['unidades'] += compra.unidades
+            acumulado['importe'] += Decimal(compra.importe)
+            acumulado['compras'] += 1
+    return por_producto, por_cliente
+
+
+def inicio_mes(dia):
+    return dia.replace(day=1)
+
+
+def _acumular_periodos(compras, marcas):
+    # Cada compra suma en su día y en su mes (hora local) en las cuatro dimensiones
+    filas = defaultdict(lambda: {'unidades': 0, 'importe': Decimal(0), 'compras': 0})
+    for compra in compras:
+        dia = timezone.localdate(compra.fecha)
+        claves = {'producto': compra.producto_id, 'marca': marcas[compra.producto_id], 'cliente': compra.user_id,
+                  'total': 0}
+        for periodo, inicio in ((VentasPeriodo.DIA, dia), (VentasPeriodo.MES, inicio_mes(dia))):
+            for dimension, clave in claves.items():
+                acumulado = filas[periodo, dimension, clave, inicio]
+                acumulado['unidades'] += compra.unidades
+                acumulado['importe'] += Decimal(compra.importe)
+                acumulado['compras'] += 1
+    return filas
+
+
+def _marcas(compras, using):
+    return dict(Producto.objects.using(using).filter(pk__in={compra.producto_id for compra in compras})
+                .values_list('pk', 'marca_id'))
+
+
+def registrar_ventas(compras, using=DEFAULT_DB_ALIAS, marcas=None):
+    """Suma las compras a los agregados. Debe llamarse dentro de la transacción que las guarda.
+    ``marcas`` ({producto_id: marca_id}) evita la consulta si quien llama ya las ha leído."""
+    por_producto, por_cliente = _acumular(compras)
+    upsert_incremental(VentasProducto, ['producto'], por_producto, using)
+    upsert_incremental(VentasCliente, ['cliente'], por_cliente, using)
+    upsert_incremental(VentasPeriodo, CLAVE_PERIODO, _acumular_periodos(compras, marcas or _marcas(compras, using)),
+                       using)
+
+
+def anular_ventas(compras, using=DEFAULT_DB_ALIAS, marcas=None):
+    """Resta de los agregados compras que se borran o se van a modificar (ver signals.py).
+    Las compras tienen que haberse sumado antes con registrar_ventas; puede ser un queryset."""
+    compras = list(compras)
+    por_producto, por_cliente = _acumular(compras)
+    restar(VentasProducto, ['producto'], por_producto, using)
+    restar(VentasCliente, ['cliente'], por_cliente, using)
+    restar(VentasPeriodo, CLAVE_PERIODO, _acumular_periodos(compras, marcas or _marcas(compras, using)), using)
+
+
+def _redondear(fila):
+    # SQLite suma los decimales en coma flotante: 1017791.75 puede volver como 1017791.74999999
+    fila['importe'] = Decimal(fila['importe']).quantize(CENTIMO)
+    return fila
+
+
+def calcular_desde_compras(using=DEFAULT_DB_ALIAS):
+    """Recalcula los agregados recorriendo todo el histórico de Compra."""
+    compras = Compra.objects.using(using)
+    totales = dict(unidades=Sum('unidades'), importe=Sum('importe'), compras=Count('pk'))
+    productos = {fila.pop('producto'): _redondear(fila)
+                 for fila in compras.values('producto').annotate(**totales).order_by()}
+    clientes = {fila.pop('user'): _redondear(fila) for fila in compras.values('user').annotate(**totales).order_by()}
+    return productos, clientes
+
+
+def leer_agregados(using=DEFAULT_DB_ALIAS):
+    productos = {fila.pop('producto'): fila for fila in VentasProducto.objects.using(using).values('producto', *CAMPOS)}
+    clientes = {fila.pop('cliente'): fila for fila in VentasCliente.objects.using(using).values('cliente', *CAMPOS)}
+    return productos, clientes
+
+
+def calcular_periodos_desde_compras(using=DEFAULT_DB_ALIAS, desde=None):
+    """VentasPeriodo calculado con GROUP BY sobre Compra ({(periodo, dimension, clave, inicio): totales}).
+    Con ``desde`` sólo los días desde esa fecha y los meses desde el que la contiene."""
+    compras = Compra.objects.using(using)
+    if desde is not None:
+        inicio = timezone.make_aware(datetime.datetime.combine(inicio_mes(desde), datetime.time()))
+        compras = compras.filter(fecha__gte=inicio)
+    totales = dict(unidades=Sum('unidades'), importe=Sum('importe'), compras=Count('pk'))
+    # Truncado en la zona horaria actual, igual que timezone.localdate al registrar cada compra
+    truncados = ((VentasPeriodo.DIA, TruncDate('fecha')),
+                 (VentasPeriodo.MES, TruncMonth('fecha', output_field=DateField())))
+    filas = {}
+    for periodo, truncado in truncados:
+        for dimension, campo in DIMENSIONES.items():
+            agrupado = compras.annotate(inicio=truncado).values('inicio', *([campo] if campo else [])) \
+                .annotate(**totales).order_by()
+            for fila in agrupado:
+                if periodo == VentasPeriodo.DIA and desde is not None and fila['inicio'] < desde:
+                    continue
+                clave = fila.pop(campo) if campo else 0
+                filas[periodo, dimension, clave, fila.pop('inicio')] = _redondear(fila)
+    return filas
+
+
+def periodos_desde(using=DEFAULT_DB_ALIAS, desde=None):
+    """Filas de VentasPeriodo que cubre calcular_periodos_desde_compras con el mismo ``desde``."""
+    filas = VentasPeriodo.objects.using(using)
+    if desde is not None:
+        filas = filas.filter(inicio__gte=inicio_mes(desde)).exclude(periodo=VentasPeriodo.DIA, inicio__lt=desde)
+    return filas
+
+
+def leer_periodos(using=DEFAULT_DB_ALIAS, desde=None):
+    return {tuple(fila.pop(campo) for campo in CLAVE_PERIODO): fila
+            for fila in periodos_desde(using, desde).values(*CLAVE_PERIODO, *CAMPOS)}
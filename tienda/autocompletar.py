@@ -0,0 +1,206 @@
+import bisect
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+
+from . import cache_catalogo
+from .models import Producto, VersionCatalogo
+from .replicas import en_primaria
+
+# Sugerencias mientras se escribe en el buscador, servidas desde un índice de prefijos en la
+# memoria de cada proceso: las palabras de nombre, modelo y marca de cada producto en una lista
+# ordenada (con los ids en un array paralelo), donde las palabras que empiezan por un prefijo
+# son un rango contiguo que se encuentra con bisect. Responder no consulta la base de datos.
+# El índice se construye en la primera petición del proceso y, cuando cambia la versión del
+# catálogo (cache_catalogo), se ponen al día sólo los productos y marcas cuya versión
+# persistente (versiones.py) ha cambiado desde la última vez. Como el resto de la caché del
+# catálogo, con varios procesos la versión se comparte sólo si la caché es compartida.
+
+LIMITE = 10
+LIMITE_MAXIMO = 25
+# Entradas recorridas como mucho por consulta si las otras palabras descartan casi todo
+VENTANA = 2000
+# Cambios registrados en una transacción que aún no se había confirmado al poner al día
+MARGEN = timedelta(seconds=60)
+# Con más productos que poner al día (los cambiados y los de las marcas cambiadas) se
+# reconstruye: cada inserción desplaza las listas enteras y, sea cual sea el tamaño del
+# catálogo, a partir de unos cientos sale más caro que reconstruir
+MAX_CAMBIOS = 500
+
+_PALABRA = re.compile(r'\w+')
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, como el tokenizador de FTS5: "Cámara" encuentra "camara"."""
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(caracter for caracter in texto if not unicodedata.combining(caracter))
+
+
+def palabras(*textos):
+    # Internadas: cada palabra se guarda una vez aunque aparezca en miles de productos
+    return tuple(dict.fromkeys(sys.intern(palabra) for texto in textos
+                               for palabra in _PALABRA.findall(normalizar(texto))))
+
+
+class IndicePrefijos:
+    """Índice de un proceso. Los accesos van con un cerrojo: las consultas duran microsegundos y
+    las actualizaciones insertan en las mismas listas que se están leyendo."""
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        # Ordenadas por (palabra, id)
+        self.palabras = []
+        self.ids = array('q')
+        # {id: (nombre, marca, palabras)}
+        self.productos = {}
+        self.version = None
+        self.sincronizado = None
+        self.cerrojo = threading.Lock()
+
+    def cargar(self, filas):
+        self.productos = {}
+        for pk, nombre, modelo, marca in filas:
+            self.productos[pk] = (nombre, sys.intern(marca), palabras(nombre, modelo, marca))
+        entradas = sorted((palabra, pk) for pk, (_, _, claves) in self.productos.items() for palabra in claves)
+        self.palabras = [palabra for palabra, _ in entradas]
+        self.ids = array('q', (pk for _, pk in entradas))
+
+    def _posicion(self, palabra, pk):
+        inicio = bisect.bisect_left(self.palabras, palabra)
+        fin = bisect.bisect_right(self.palabras, palabra, inicio)
+        return bisect.bisect_left(self.ids, pk, inicio, fin), fin
+
+    def quitar(self, pk):
+        datos = self.productos.pop(pk, None)
+        if datos is None:
+            return
+        for palabra in datos[2]:
+            posicion, fin = self._posicion(palabra, pk)
+            if posicion < fin and self.ids[posicion] == pk:
+                del self.palabras[posicion]
+                del self.ids[posicion]
+
+    def poner(self, pk, nombre, modelo, marca):
+        claves = palabras(nombre, modelo, marca)
+        # Los cambios de stock o valoraciones también cambian la versión del producto
+        if self.productos.get(pk) == (nombre, marca, claves):
+            return
+        self.quitar(pk)
+        # Memoria acotada: por encima del máximo los productos nuevos no se sugieren
+        if len(self.productos) >= self.maximo:
+            return
+        self.productos[pk] = (nombre, sys.intern(marca), claves)
+        for palabra in claves:
+            posicion, _ = self._posicion(palabra, pk)
+            self.palabras.insert(posicion, palabra)
+            self.ids.insert(posicion, pk)
+
+    def sugerir(self, texto, limite=LIMITE):
+        """Productos con una palabra que empieza por cada palabra del texto. Se recorre el rango
+        de la más larga (la más selectiva) y el resto se comprueba sobre las palabras del
+        producto. Salen primero los que tienen esa palabra completa y después por orden de la
+        palabra, así que basta con recorrer hasta tener ``limite``."""
+        consulta = palabras(texto)
+        if not consulta:
+            return []
+        guia = max(consulta, key=len)
+        resto = [palabra for palabra in consulta if palabra != guia]
+        encontrados = {}
+        inicio = bisect.bisect_left(self.palabras, guia)
+        for posicion in range(inicio, min(inicio + VENTANA, len(self.palabras))):
+            if not self.palabras[posicion].startswith(guia):
+                break
+            pk = self.ids[posicion]
+            if pk in encontrados:
+                continue
+            nombre, marca, claves = self.productos[pk]
+            if all(any(clave.startswith(prefijo) for clave in claves) for prefijo in resto):
+                encontrados[pk] = {'id': pk, 'nombre': nombre, 'marca': marca}
+                if len(encontrados) == limite:
+                    break
+        return list(encontrados.values())
+
+
+_indices = {}
+_cerrojo = threading.Lock()
+
+
+def _filas(queryset):
+    return queryset.values_list('pk', 'nombre', 'modelo', 'marca__nombre')
+
+
+def construir(indice, version, using):
+    indice.version, indice.sincronizado = version, timezone.now()
+    # Si no caben todos, los más valorados
+    productos = Producto.objects.using(using).order_by('-num_valoraciones', 'pk')
+    indice.cargar(_filas(productos)[:indice.maximo].iterator(chunk_size=5000))
+
+
+def actualizar(indice, version, using):
+    """Vuelve a leer los productos (y los de las marcas) con cambios desde la última vez."""
+    desde, ahora = indice.sincronizado - MARGEN, timezone.now()
+    productos, marcas = set(), set()
+    for clave in VersionCatalogo.objects.using(using).filter(actualizado__gte=desde) \
+            .values_list('clave', flat=True).iterator():
+        tipo, _, pk = clave.partition(':')
+        if tipo == 'producto':
+            productos.add(int(pk))
+        elif tipo == 'marca':
+            marcas.add(int(pk))
+    if len(productos) > MAX_CAMBIOS:
+        construir(indice, version, using)
+        return
+    # Renombrar una marca cambia todos sus productos: se leen como mucho MAX_CAMBIOS + 1 filas
+    # para saber si sale más a cuenta reconstruir
+    filas = list(_filas(Producto.objects.using(using).filter(Q(pk__in=productos) | Q(marca_id__in=marcas))
+                        .order_by())[:MAX_CAMBIOS + 1])
+    if len(filas) > MAX_CAMBIOS:
+        construir(indice, version, using)
+        return
+    for pk in productos - {fila[0] for fila in filas}:
+        # Borrado
+        indice.quitar(pk)
+    for fila in filas:
+        indice.poner(*fila)
+    indice.version, indice.sincronizado = version, ahora
+
+
+def obtener_indice(using=DEFAULT_DB_ALIAS):
+    """Índice del proceso, al día con la versión del catálogo. Con la versión sin cambios sólo
+    cuesta una lectura de la caché."""
+    version = cache_catalogo.version_catalogo()
+    indice = _indices.get(using)
+    if indice is not None and indice.version == version:
+        return indice
+    with _cerrojo:
+        indice = _indices.get(using)
+        if indice is None:
+            indice = IndicePrefijos(settings.TIENDA_AUTOCOMPLETAR_MAXIMO)
+        if indice.version != version:
+            # Leído de la primaria: con una réplica retrasada se daría por visto un cambio sin leerlo
+            with en_primaria(), indice.cerrojo:
+                if indice.sincronizado is None:
+                    construir(indice, version, using)
+                else:
+                    actualizar(indice, version, using)
+        _indices[using] = indice
+    return indice
+
+
+def sugerir(texto, limite=LIMITE, using=DEFAULT_DB_ALIAS):
+    indice = obtener_indice(using)
+    with indice.cerrojo:
+        return indice.sugerir(texto, limite)
+
+
+def reiniciar():
+    with _cerrojo:
+        _indices.clear()
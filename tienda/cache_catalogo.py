@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import versiones
+from .replicas import en_primaria
+
+# Caché del catálogo con invalidación por versiones. Cada entrada lleva en su
+# clave la versión de lo que contiene (todo el catálogo, un producto o una
+# marca); invalidar es incrementar la versión, así las entradas antiguas dejan
+# de leerse y caducan solas. Sólo usa get/set/add/incr, de modo que funciona con
+# las cachés en memoria local y en fichero, que no necesitan ningún servicio.
+
+PREFIJO = 'tienda'
+VERSION_CATALOGO = f'{PREFIJO}:version:catalogo'
+
+_estadisticas = Counter()
+_cerrojo = threading.Lock()
+
+
+def tiempo():
+    return getattr(settings, 'TIENDA_CACHE_SEGUNDOS', 300)
+
+
+def _clave_version(tipo, pk):
+    return f'{PREFIJO}:version:{tipo}:{pk}'
+
+
+def _version_inicial():
+    # Si se pierde un contador no puede volver a un valor ya usado por entradas antiguas
+    return time.time_ns() // 1000
+
+
+def _versiones(claves):
+    versiones = cache.get_many(claves)
+    for clave in claves:
+        if clave not in versiones:
+            cache.add(clave, _version_inicial(), None)
+            versiones[clave] = cache.get(clave)
+    return [versiones[clave] for clave in claves]
+
+
+async def _aversiones(claves):
+    versiones = await cache.aget_many(claves)
+    for clave in claves:
+        if clave not in versiones:
+            await cache.aadd(clave, _version_inicial(), None)
+            versiones[clave] = await cache.aget(clave)
+    return [versiones[clave] for clave in claves]
+
+
+def _incrementar(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, _version_inicial(), None)
+
+
+def version_catalogo():
+    return _versiones([VERSION_CATALOGO])[0]
+
+
+def version_producto(pk):
+    return _versiones([_clave_version('producto', pk)])[0]
+
+
+def version_marca(pk):
+    return _versiones([_clave_version('marca', pk)])[0]
+
+
+async def aversion_catalogo():
+    return (await _aversiones([VERSION_CATALOGO]))[0]
+
+
+async def aversion_producto(pk):
+    return (await _aversiones([_clave_version('producto', pk)]))[0]
+
+
+async def aversion_marca(pk):
+    return (await _aversiones([_clave_version('marca', pk)]))[0]
+
+
+# Cada invalidación incrementa también la versión persistente (versiones.py) en la transacción
+# en curso; la de la caché se incrementa al confirmarla.
+def invalidar_catalogo():
+    versiones.registrar_cambios([versiones.CATALOGO])
+    transaction.on_commit(lambda: _incrementar(VERSION_CATALOGO))
+
+
+def invalidar_producto(pk):
+    invalidar_productos([pk])
+
+
+def invalidar_productos(pks):
+    """Como invalidar_producto para varios productos, con una sola escritura."""
+    pks = list(pks)
+    versiones.registrar_cambios([versiones.clave_producto(pk) for pk in pks])
+    transaction.on_commit(lambda: [_incrementar(_clave_version('producto', pk)) for pk in pks])
+
+
+def invalidar_marca(pk):
+    versiones.registrar_cambios([versiones.clave_marca(pk)])
+    transaction.on_commit(lambda: _incrementar(_clave_version('marca', pk)))
+
+
+def clave(espacio, *partes):
+    resumen = hashlib.md5(repr(partes).encode()).hexdigest()
+    return f'{PREFIJO}:{espacio}:{resumen}'
+
+
+def _contar(espacio, resultado):
+    with _cerrojo:
+        _estadisticas[espacio, resultado] += 1
+
+
+def obtener(espacio, clave_entrada, calcular, valida=None):
+    """Devuelve la entrada cacheada o la calcula y la guarda, contando aciertos y fallos."""
+    valor = cache.get(clave_entrada)
+    if valor is not None and (valida is None or valida(valor)):
+        _contar(espacio, 'aciertos')
+        return valor
+    _contar(espacio, 'fallos')
+    # Se calcula en la primaria: con la réplica retrasada quedaría guardado con la versión nueva
+    with en_primaria():
+        valor = calcular()
+    cache.set(clave_entrada, valor, tiempo())
+    return valor
+
+
+async def aobtener(espacio, clave_entrada, calcular, valida=None):
+    """Versión asíncrona de obtener, con los métodos asíncronos de la caché; ``calcular`` y
+    ``valida`` son funciones asíncronas."""
+    valor = await cache.aget(clave_entrada)
+    if valor is not None and (valida is None or await valida(valor)):
+        _contar(espacio, 'aciertos')
+        return valor
+    _contar(espacio, 'fallos')
+    with en_primaria():
+        valor = await calcular()
+    await cache.aset(clave_entrada, valor, tiempo())
+    return valor
+
+
+def estadisticas():
+    """Aciertos y fallos por espacio desde que arrancó este proceso."""
+    with _cerrojo:
+        datos = dict(_estadisticas)
+    resultado = {}
+    for espacio in sorted({espacio for espacio, _ in datos}):
+        aciertos, fallos = datos.get((espacio, 'aciertos'), 0), datos.get((espacio, 'fallos'), 0)
+        resultado[espacio] = {'aciertos': aciertos, 'fallos': fallos,
+                              'ratio': round(aciertos / (aciertos + fallos), 3) if aciertos + fallos else None}
+    return resultado
+
+
+def reiniciar_estadisticas():
+    with _cerrojo:
+        _estadisticas.clear()
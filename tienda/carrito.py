@@ -0,0 +1,78 @@
+import json
+
+from .models import Producto
+
+CLAVE_SESION = 'carrito'
+
+
+class Carrito:
+    """Carrito guardado en la sesión como un mapa compacto {id de producto: unidades}.
+
+    La sesión ya se serializa una vez, así que el carrito se guarda como dict y
+    no como una cadena JSON dentro de otra. Añadir un producto que ya está en el
+    carrito suma las unidades a su línea en lugar de crear otra.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.lineas = self._cargar(session.get(CLAVE_SESION))
+
+    @staticmethod
+    def _cargar(valor):
+        # Formato antiguo: cadena JSON con una lista de {'producto_id': ..., 'unidades': ...}
+        if isinstance(valor, str):
+            try:
+                valor = json.loads(valor)
+            except ValueError:
+                valor = None
+        lineas = {}
+        if isinstance(valor, list):
+            for item in valor:
+                clave = str(item['producto_id'])
+                lineas[clave] = lineas.get(clave, 0) + int(item['unidades'])
+        elif isinstance(valor, dict):
+            lineas = {str(clave): int(unidades) for clave, unidades in valor.items()}
+        return lineas
+
+    def __len__(self):
+        return len(self.lineas)
+
+    def __bool__(self):
+        return bool(self.lineas)
+
+    def unidades(self, producto_id):
+        return self.lineas.get(str(producto_id), 0)
+
+    def agregar(self, producto_id, unidades=1):
+        if unidades <= 0:
+            raise ValueError('Las unidades deben ser positivas')
+        clave = str(producto_id)
+        self.lineas[clave] = self.lineas.get(clave, 0) + unidades
+        self.guardar()
+
+    def quitar(self, producto_id):
+        self.lineas.pop(str(producto_id), None)
+        self.guardar()
+
+    def vaciar(self):
+        self.lineas = {}
+        self.guardar()
+
+    def guardar(self):
+        self.session[CLAVE_SESION] = self.lineas
+        self.session.modified = True
+
+    def por_producto(self):
+        return {int(clave): unidades for clave, unidades in self.lineas.items()}
+
+    def items(self):
+        """Líneas con su producto y precio total, cargando todos los productos en una consulta."""
+        productos = Producto.objects.in_bulk(list(self.por_producto()))
+        items = []
+        for producto_id, unidades in self.por_producto().items():
+            producto = productos.get(producto_id)
+            # Un producto borrado desde que se añadió simplemente desaparece del carrito
+            if producto is not None:
+                items.append({'producto': producto, 'unidades': unidades,
+                              'precio_total': unidades * producto.precio})
+        return items
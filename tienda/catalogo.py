@@ -0,0 +1,103 @@
+import base64
+import binascii
+import json
+from typing import NamedTuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .models import Producto
+
+# Paginación por cursor (keyset) del catálogo: en lugar de OFFSET se filtra por
+# (clave de orden, id) > último elemento visto, así que cualquier página cuesta
+# lo mismo que la primera siempre que exista un índice sobre (clave, id).
+ORDENES = {
+    'nombre': ('nombre', False),
+    'precio': ('precio', False),
+    '-precio': ('precio', True),
+    # Por el nombre copiado en el producto: ordenar por marca__nombre obligaría a ordenar el JOIN
+    # completo en cada página
+    'marca': ('marca_nombre', False),
+}
+ORDEN_POR_DEFECTO = 'nombre'
+POR_PAGINA = 24
+
+
+class PaginaCatalogo(NamedTuple):
+    object_list: list
+    orden: str
+    cursor: str
+    siguiente: str
+
+
+def _campo(ruta):
+    modelo = Producto
+    *relaciones, nombre = ruta.split('__')
+    for relacion in relaciones:
+        modelo = modelo._meta.get_field(relacion).related_model
+    return modelo._meta.get_field(nombre)
+
+
+def _valor(producto, ruta):
+    valor = producto
+    for parte in ruta.split('__'):
+        valor = getattr(valor, parte)
+    return valor
+
+
+def codificar_cursor(producto, orden):
+    ruta, _ = ORDENES[orden]
+    # Los valores viajan como texto (Decimal no es serializable en JSON)
+    datos = json.dumps([str(_valor(producto, ruta)), producto.pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(datos).rstrip(b'=').decode()
+
+
+def decodificar_cursor(cursor, orden):
+    """Devuelve (valor, pk) o None si el cursor no es válido."""
+    ruta, _ = ORDENES[orden]
+    try:
+        datos = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valor, pk = json.loads(datos)
+        return _campo(ruta).to_python(valor), int(pk)
+    except (binascii.Error, ValueError, TypeError, ValidationError):
+        return None
+
+
+def filtrar_desde_cursor(queryset, orden, cursor):
+    ruta, descendente = ORDENES[orden]
+    posicion = decodificar_cursor(cursor, orden) if cursor else None
+    if posicion is not None:
+        valor, pk = posicion
+        mayor = 'lt' if descendente else 'gt'
+        # La condición redundante "clave >= valor" permite al planificador buscar
+        # directamente en el índice en lugar de recorrerlo desde el principio
+        queryset = queryset.filter(
+            Q(**{f'{ruta}__{mayor}e': valor}),
+            Q(**{f'{ruta}__{mayor}': valor}) | Q(**{f'pk__{mayor}': pk}),
+        )
+    signo = '-' if descendente else ''
+    return queryset.order_by(f'{signo}{ruta}', f'{signo}pk')
+
+
+def _pagina(productos, orden, cursor, por_pagina):
+    siguiente = None
+    if len(productos) > por_pagina:
+        productos = productos[:por_pagina]
+        siguiente = codificar_cursor(productos[-1], orden)
+    return PaginaCatalogo(productos, orden, cursor, siguiente)
+
+
+def paginar_catalogo(queryset, orden=None, cursor=None, por_pagina=POR_PAGINA):
+    if orden not in ORDENES:
+        orden = ORDEN_POR_DEFECTO
+    # Se pide un elemento de más para saber si hay página siguiente sin COUNT(*)
+    productos = list(filtrar_desde_cursor(queryset, orden, cursor)[:por_pagina + 1])
+    return _pagina(productos, orden, cursor, por_pagina)
+
+
+async def apaginar_catalogo(queryset, orden=None, cursor=None, por_pagina=POR_PAGINA):
+    """Versión asíncrona de paginar_catalogo para las vistas de vistas_async.py."""
+    if orden not in ORDENES:
+        orden = ORDEN_POR_DEFECTO
+    productos = [producto async for producto in filtrar_desde_cursor(queryset, orden, cursor)[:por_pagina + 1]]
+    return _pagina(productos, orden, cursor, por_pagina)
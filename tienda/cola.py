@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import Tarea
+
+# Cola de tareas en la base de datos, sin broker. ``encolar`` inserta la tarea en la
+# transacción en curso (outbox transaccional): si la compra se deshace, la tarea tampoco
+# existe, y si se confirma, un trabajador (manage.py procesar_tareas) la ejecutará aunque el
+# proceso web se caiga justo después. La entrega es "al menos una vez": una tarea puede
+# repetirse si el trabajador muere a mitad, así que las funciones deben ser idempotentes.
+
+logger = logging.getLogger('tienda.tareas')
+
+_registro = {}
+
+
+def tarea(nombre=None, intentos=None):
+    """Registra una función como tarea. Recibe los argumentos con nombre con que se encoló,
+    que tienen que poder guardarse en JSON."""
+    def decorador(funcion):
+        _registro[nombre or funcion.__name__] = (funcion, intentos)
+        return funcion
+    return decorador
+
+
+def encolar(nombre, retraso=0, using=DEFAULT_DB_ALIAS, **argumentos):
+    if nombre not in _registro:
+        raise LookupError(f'Tarea desconocida: {nombre}')
+    _, intentos = _registro[nombre]
+    return Tarea.objects.using(using).create(
+        nombre=nombre, argumentos=argumentos, disponible=timezone.now() + timedelta(seconds=retraso),
+        max_intentos=intentos or settings.TIENDA_TAREAS_INTENTOS)
+
+
+def nombre_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'[:60]
+
+
+def reclamar(trabajador, limite, using=DEFAULT_DB_ALIAS):
+    """Marca como en curso hasta ``limite`` tareas disponibles (incluidas las en curso cuyo plazo
+    ha vencido, de un trabajador caído) y las devuelve. Dos trabajadores nunca reclaman la
+    misma: en PostgreSQL con SELECT ... FOR UPDATE SKIP LOCKED y en el resto con un UPDATE
+    condicional sobre el estado leído."""
+    ahora = timezone.now()
+    candidatas = Tarea.objects.using(using).filter(
+        estado__in=[Tarea.PENDIENTE, Tarea.EN_CURSO], disponible__lte=ahora).order_by('disponible')
+    valores = dict(estado=Tarea.EN_CURSO, disponible=ahora + timedelta(seconds=settings.TIENDA_TAREAS_PLAZO),
+                   iniciada=ahora, trabajador=trabajador, intentos=F('intentos') + 1)
+    if connections[using].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=using):
+            ids = list(candidatas.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limite])
+            Tarea.objects.using(using).filter(pk__in=ids).update(**valores)
+    else:
+        ids = [pk for pk, estado, disponible in candidatas.values_list('pk', 'estado', 'disponible')[:limite]
+               if Tarea.objects.using(using).filter(pk=pk, estado=estado, disponible=disponible).update(**valores)]
+    return list(Tarea.objects.using(using).filter(pk__in=ids).order_by('disponible', 'pk'))
+
+
+def espera_reintento(intentos):
+    """Backoff exponencial con variación aleatoria para que los reintentos no lleguen juntos."""
+    espera = min(settings.TIENDA_TAREAS_ESPERA * 2 ** (intentos - 1), 3600)
+    return random.uniform(espera / 2, espera)
+
+
+def ejecutar(tarea_, using=DEFAULT_DB_ALIAS):
+    """Ejecuta una tarea reclamada y guarda el resultado. Sólo escribe si la tarea sigue siendo
+    de este trabajador: si tardó más que el plazo y otro la recuperó, manda el otro."""
+    propia = Tarea.objects.using(using).filter(pk=tarea_.pk, trabajador=tarea_.trabajador, estado=Tarea.EN_CURSO)
+    inicio = time.perf_counter()
+    try:
+        if tarea_.intentos > tarea_.max_intentos:
+            raise RuntimeError('Se agotó el plazo en todos los intentos')
+        funcion, _ = _registro.get(tarea_.nombre, (None, None))
+        if funcion is None:
+            raise LookupError(f'Tarea desconocida: {tarea_.nombre}')
+        funcion(**tarea_.argumentos)
+    except Exception as error:
+        fallida = tarea_.intentos >= tarea_.max_intentos
+        propia.update(
+            estado=Tarea.FALLIDA if fallida else Tarea.PENDIENTE, error=traceback.format_exc(),
+            terminada=timezone.now() if fallida else None,
+            disponible=timezone.now() + timedelta(seconds=0 if fallida else espera_reintento(tarea_.intentos)))
+        resultado = 'fallida' if fallida else 'reintento'
+        logger.warning(json.dumps({'tarea': tarea_.nombre, 'id': tarea_.pk, 'resultado': resultado,
+                                   'intento': tarea_.intentos, 'error': repr(error)}))
+    else:
+        terminada = timezone.now()
+        propia.update(estado=Tarea.HECHA, terminada=terminada, error='')
+        logger.info(json.dumps({
+            'tarea': tarea_.nombre, 'id': tarea_.pk, 'resultado': 'hecha', 'intento': tarea_.intentos,
+            'espera_ms': round((tarea_.iniciada - tarea_.creada).total_seconds() * 1000, 1),
+            'duracion_ms': round((time.perf_counter() - inicio) * 1000, 1),
+        }))
+
+
+def trabajar(parar, hilos=1, lote=None, intervalo=1.0, una_vez=False, using=DEFAULT_DB_ALIAS):
+    """Bucle de un trabajador: reclama lotes y los ejecuta en ``hilos`` hilos hasta que se activa
+    el evento ``parar`` (o, con ``una_vez``, hasta que no quedan tareas disponibles)."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    lote = lote or hilos
+    ejecutadas = 0
+
+    def ejecutar_y_cerrar(tarea_):
+        try:
+            ejecutar(tarea_, using)
+        finally:
+            # Como al terminar una petición: cierra la conexión del hilo si ha caducado o falló
+            close_old_connections()
+
+    with ThreadPoolExecutor(hilos) as grupo:
+        while not parar.is_set():
+            close_old_connections()
+            tareas = reclamar(nombre_trabajador(), lote, using)
+            if not tareas:
+                if una_vez:
+                    break
+                parar.wait(intervalo)
+                continue
+            if hilos == 1:
+                for tarea_ in tareas:
+                    ejecutar(tarea_, using)
+            else:
+                list(grupo.map(ejecutar_y_cerrar, tareas))
+            ejecutadas += len(tareas)
+    return ejecutadas
+
+
+def purgar(dias, using=DEFAULT_DB_ALIAS):
+    """Borra las tareas hechas hace más de ``dias`` días; las fallidas se quedan para revisarlas."""
+    limite = timezone.now() - timedelta(days=dias)
+    borradas, _ = Tarea.objects.using(using).filter(estado=Tarea.HECHA, terminada__lt=limite).delete()
+    return borradas
+
+
+def _percentiles(valores):
+    if not valores:
+        return {'p50_ms': None, 'p95_ms': None}
+    if len(valores) == 1:
+        return {'p50_ms': round(valores[0], 1), 'p95_ms': round(valores[0], 1)}
+    cortes = statistics.quantiles(valores, n=20)
+    return {'p50_ms': round(cortes[9], 1), 'p95_ms': round(cortes[18], 1)}
+
+
+def estadisticas(using=DEFAULT_DB_ALIAS, muestra=1000):
+    """Profundidad de la cola por estado y tarea, antigüedad de la pendiente más antigua y
+    latencia (espera hasta empezar y duración) de las últimas ``muestra`` tareas hechas."""
+    ahora = timezone.now()
+    tareas = Tarea.objects.using(using)
+    profundidad = {}
+    for nombre, estado, n in tareas.values_list('nombre', 'estado').annotate(n=Count('pk')).order_by():
+        profundidad.setdefault(nombre, {})[estado] = n
+    antigua = tareas.filter(estado=Tarea.PENDIENTE, disponible__lte=ahora).aggregate(
+        antigua=Min('disponible'))['antigua']
+    recientes = list(tareas.filter(estado=Tarea.HECHA).order_by('-terminada')
+                     .values_list('creada', 'iniciada', 'terminada')[:muestra])
+    return {
+        'profundidad': profundidad,
+        'pendientes': sum(estados.get(Tarea.PENDIENTE, 0) for estados in profundidad.values()),
+        'fallidas': sum(estados.get(Tarea.FALLIDA, 0) for estados in profundidad.values()),
+        'retraso_s': round((ahora - antigua).total_seconds(), 1) if antigua else 0,
+        'espera': _percentiles([(iniciada - creada).total_seconds() * 1000 for creada, iniciada, _ in recientes]),
+        'duracion': _percentiles([(terminada - iniciada).total_seconds() * 1000
+                                  for _, iniciada, terminada in recientes]),
+        'muestra': len(recientes),
+    }
+
+
+def reintentar(queryset):
+    """Vuelve a poner en cola tareas fallidas (acción del admin)."""
+    return queryset.filter(Q(estado=Tarea.FALLIDA)).update(
+        estado=Tarea.PENDIENTE, intentos=0, disponible=timezone.now(), terminada=None, trabajador='')
@@ -0,0 +1,32 @@
+from .models import Comentario
+
+POR_PAGINA = 10
+
+
+def pagina_comentarios(producto_id, antes=None, por_pagina=POR_PAGINA):
+    """Comentarios de un producto del más reciente al más antiguo, paginados por cursor.
+
+    ``antes`` es el id del último comentario ya mostrado; devuelve la lista de
+    comentarios y el cursor de la página siguiente (o None si no hay más).
+    """
+    return _pagina(list(_consulta(producto_id, antes, por_pagina)), por_pagina)
+
+
+async def apagina_comentarios(producto_id, antes=None, por_pagina=POR_PAGINA):
+    """Versión asíncrona de pagina_comentarios."""
+    return _pagina([comentario async for comentario in _consulta(producto_id, antes, por_pagina)], por_pagina)
+
+
+def _consulta(producto_id, antes, por_pagina):
+    comentarios = Comentario.objects.filter(producto_id=producto_id)
+    if antes is not None:
+        comentarios = comentarios.filter(pk__lt=antes)
+    return comentarios.order_by('-pk')[:por_pagina + 1]
+
+
+def _pagina(comentarios, por_pagina):
+    siguiente = None
+    if len(comentarios) > por_pagina:
+        comentarios = comentarios[:por_pagina]
+        siguiente = comentarios[-1].pk
+    return comentarios, siguiente
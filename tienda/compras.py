@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import cache_catalogo
+from .agregados import registrar_ventas
+from .cola import encolar
+from .models import Cliente, Compra, Pedido, Producto
+
+
+class StockInsuficiente(Exception):
+
+    def __init__(self, mensaje, productos=()):
+        super().__init__(mensaje)
+        self.productos = list(productos)
+
+
+def realizar_compra(cliente, producto_id, unidades, using=DEFAULT_DB_ALIAS):
+    """Compra ``unidades`` de un producto descontando stock y saldo sin condiciones de carrera.
+
+    El stock se descuenta con un UPDATE condicional (``unidades >= n``) en lugar de
+    leerlo, restarlo en Python y guardarlo: si otro comprador se ha llevado las
+    unidades el UPDATE no afecta a ninguna fila y se lanza StockInsuficiente sin
+    haber escrito nada. El saldo se descuenta también con una expresión F().
+    """
+    if unidades <= 0:
+        raise ValueError('Las unidades deben ser positivas')
+    with transaction.atomic(using=using):
+        # La escritura va primero: en SQLite toma el bloqueo de escritura desde el
+        # principio y evita el fallo inmediato al pasar de lectura a escritura.
+        actualizados = Producto.objects.using(using).filter(pk=producto_id, unidades__gte=unidades) \
+            .update(unidades=F('unidades') - unidades)
+        if not actualizados:
+            raise StockInsuficiente(f'No quedan {unidades} unidades del producto {producto_id}')
+        producto = Producto.objects.using(using).only('precio', 'unidades', 'marca').get(pk=producto_id)
+        quedan = producto.unidades
+        # Los agregados de ventas los suma la señal post_save de Compra (signals.py)
+        compra = Compra.objects.using(using).create(producto=producto, user=cliente, unidades=unidades,
+                                                    importe=unidades * producto.precio, fecha=timezone.now())
+        Cliente.objects.using(using).filter(pk=cliente.pk).update(saldo=F('saldo') - compra.importe)
+        # La página del producto muestra el stock; el catálogo sólo cambia si se agota (faceta "con stock")
+        cache_catalogo.invalidar_producto(producto_id)
+        if not quedan:
+            cache_catalogo.invalidar_catalogo()
+        # En la misma transacción: si la compra se deshace, no hay correo ni aviso
+        encolar('confirmar_compra', using=using, compras=[compra.pk])
+        if quedan <= settings.TIENDA_STOCK_BAJO < quedan + unidades:
+            encolar('avisar_stock_bajo', using=using, productos=[producto_id])
+    return compra
+
+
+def realizar_pedido(cliente, lineas, using=DEFAULT_DB_ALIAS, reservadas=None):
+    """Compra varios productos a la vez ({producto_id: unidades}) en una sola transacción.
+
+    El número de consultas no depende del número de líneas: un UPDATE condicional
+    con CASE bloquea y descuenta el stock de todos los productos, una consulta
+    lee sus precios, las líneas se insertan con bulk_create y saldo y agregados
+    se ajustan con sentencias de conjunto.
+
+    ``reservadas`` ({producto_id: unidades}) son unidades ya descontadas del stock por
+    reservas.py: sólo se descuenta la diferencia con el pedido, se devuelve lo reservado de
+    más y, si todo estaba reservado, no se escribe en ningún producto.
+    """
+    lineas = {int(producto_id): int(unidades) for producto_id, unidades in lineas.items()}
+    if not lineas or any(unidades <= 0 for unidades in lineas.values()):
+        raise ValueError('El pedido necesita al menos una línea y unidades positivas')
+    reservadas = reservadas or {}
+    ids = sorted(lineas)
+    ajustes = {pk: lineas.get(pk, 0) - reservadas.get(pk, 0) for pk in set(lineas) | set(reservadas)}
+    ajustes = {pk: ajuste for pk, ajuste in ajustes.items() if ajuste}
+    descuento = Case(*[When(pk=pk, then=Value(ajuste)) for pk, ajuste in ajustes.items()],
+                     output_field=IntegerField())
+    productos = Producto.objects.using(using).filter(pk__in=ids)
+    try:
+        with transaction.atomic(using=using):
+            if ajustes:
+                actualizados = Producto.objects.using(using).filter(pk__in=ajustes, unidades__gte=descuento) \
+                    .update(unidades=F('unidades') - descuento)
+                if actualizados != len(ajustes):
+                    # Algún producto no existe o no tiene stock: se deshace todo el pedido
+                    raise StockInsuficiente('No hay stock suficiente')
+            precios, marcas, agotados, bajos = {}, {}, False, []
+            for pk, precio, quedan, marca_id in productos.values_list('pk', 'precio', 'unidades', 'marca_id'):
+                precios[pk] = precio
+                marcas[pk] = marca_id
+                ajuste = ajustes.get(pk, 0)
+                agotados = agotados or (ajuste > 0 and not quedan)
+                if quedan <= settings.TIENDA_STOCK_BAJO < quedan + ajuste:
+                    bajos.append(pk)
+            if len(precios) != len(ids):
+                # Un producto reservado que se ha borrado desde entonces
+                raise StockInsuficiente('No hay stock suficiente')
+            fecha = timezone.now()
+            compras = [Compra(producto_id=pk, user=cliente, unidades=lineas[pk],
+                              importe=lineas[pk] * precios[pk], fecha=fecha) for pk in ids]
+            pedido = Pedido.objects.using(using).create(cliente=cliente, fecha=fecha,
+                                                        importe=sum(compra.importe for compra in compras))
+            for compra in compras:
+                compra.pedido = pedido
+            # bulk_create no envía post_save: los agregados se suman aquí, de una vez para todo el pedido
+            Compra.objects.using(using).bulk_create(compras)
+            Cliente.objects.using(using).filter(pk=cliente.pk).update(saldo=F('saldo') - pedido.importe)
+            registrar_ventas(compras, using, marcas=marcas)
+            cache_catalogo.invalidar_productos(sorted(ajustes))
+            if agotados:
+                cache_catalogo.invalidar_catalogo()
+            encolar('confirmar_compra', using=using, compras=[compra.pk for compra in compras])
+            if bajos:
+                encolar('avisar_stock_bajo', using=using, productos=bajos)
+    except StockInsuficiente:
+        # Ya deshecha la transacción, se averigua qué productos faltan para informar al cliente
+        disponibles = dict(productos.values_list('pk', 'unidades'))
+        faltan = [pk for pk in ids if pk not in disponibles or disponibles[pk] + reservadas.get(pk, 0) < lineas[pk]]
+        raise StockInsuficiente(f'No hay stock suficiente de los productos {faltan}', faltan) from None
+    return pedido
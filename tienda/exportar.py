@@ -0,0 +1,80 @@
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+
+from .models import Compra
+
+# Exportación en streaming del histórico de compras. Se recorre un cursor del
+# servidor por bloques (QuerySet.iterator) con producto y cliente en la misma
+# consulta, de modo que la memoria usada no depende del número de filas.
+
+TAMANO_BLOQUE = 2000
+
+COLUMNAS = (
+    ('id', 'id'),
+    ('fecha', 'fecha'),
+    ('producto_id', 'producto_id'),
+    ('producto', 'producto__nombre'),
+    ('modelo', 'producto__modelo'),
+    ('cliente_id', 'user_id'),
+    ('cliente', 'user__user__username'),
+    ('unidades', 'unidades'),
+    ('importe', 'importe'),
+    ('iva', 'iva'),
+)
+CABECERA = [nombre for nombre, _ in COLUMNAS]
+
+
+def _inicio_del_dia(fecha):
+    return timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min))
+
+
+def filtrar_compras(desde=None, hasta=None, cliente=None, queryset=None):
+    if queryset is None:
+        queryset = Compra.objects.all()
+    # Rangos sobre la columna (no fecha__date) para poder usar el índice por fecha
+    if desde:
+        queryset = queryset.filter(fecha__gte=_inicio_del_dia(desde))
+    if hasta:
+        queryset = queryset.filter(fecha__lt=_inicio_del_dia(hasta + datetime.timedelta(days=1)))
+    if cliente:
+        queryset = queryset.filter(user__user__username=cliente)
+    return queryset
+
+
+def filas(queryset):
+    campos = [campo for _, campo in COLUMNAS]
+    return queryset.order_by('fecha').values_list(*campos).iterator(chunk_size=TAMANO_BLOQUE)
+
+
+class _Eco:
+    """Pseudo-fichero para csv.writer: devuelve la línea en lugar de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def lineas_csv(queryset):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(CABECERA)
+    for fila in filas(queryset):
+        yield escritor.writerow(fila)
+
+
+def _serializar(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+def lineas_jsonl(queryset):
+    for fila in filas(queryset):
+        yield json.dumps(dict(zip(CABECERA, fila)), default=_serializar, ensure_ascii=False) + '\n'
+
+
+FORMATOS = {
+    'csv': (lineas_csv, 'text/csv'),
+    'jsonl': (lineas_jsonl, 'application/x-ndjson'),
+}
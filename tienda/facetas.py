@@ -0,0 +1,190 @@
+from decimal import Decimal
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+from django.db.models import BooleanField, Case, CharField, Count, Value, When
+
+from . import cache_catalogo
+from .models import Marca
+
+# Filtrado por facetas (marca, rango de precio, VIP y con stock) con recuento
+# por opción. Los recuentos salen de un "cubo": una única consulta agrupada por
+# (marca, rango, vip, con stock) cuyo tamaño depende del número de marcas y no
+# del de productos. A partir de él se calculan en Python los recuentos de todas
+# las facetas para cualquier combinación de filtros, así que el cubo del catálogo
+# completo se cachea con la versión del catálogo y sirve para todas las páginas.
+
+RANGOS_PRECIO = (
+    ('0-50', None, Decimal(50)),
+    ('50-200', Decimal(50), Decimal(200)),
+    ('200-1000', Decimal(200), Decimal(1000)),
+    ('1000+', Decimal(1000), None),
+)
+_RANGOS = {etiqueta: (minimo, maximo) for etiqueta, minimo, maximo in RANGOS_PRECIO}
+
+
+class Filtros(NamedTuple):
+    marcas: tuple = ()
+    precio: str = None
+    vip: bool = False
+    en_stock: bool = False
+
+    def parametros(self):
+        parametros = [('marca', marca) for marca in self.marcas]
+        if self.precio:
+            parametros.append(('precio', self.precio))
+        if self.vip:
+            parametros.append(('vip', 1))
+        if self.en_stock:
+            parametros.append(('en_stock', 1))
+        return parametros
+
+    def querystring(self, **cambios):
+        return urlencode(self._replace(**cambios).parametros())
+
+    def activos(self):
+        return bool(self.marcas or self.precio or self.vip or self.en_stock)
+
+
+def leer_filtros(parametros):
+    """Filtros a partir de request.GET; los valores desconocidos se ignoran."""
+    marcas = sorted({int(valor) for valor in parametros.getlist('marca') if valor.isdigit()})
+    precio = parametros.get('precio')
+    return Filtros(marcas=tuple(marcas), precio=precio if precio in _RANGOS else None,
+                   vip=parametros.get('vip') == '1', en_stock=parametros.get('en_stock') == '1')
+
+
+def aplicar(queryset, filtros):
+    if filtros.marcas:
+        queryset = queryset.filter(marca_id__in=filtros.marcas)
+    if filtros.precio:
+        minimo, maximo = _RANGOS[filtros.precio]
+        if minimo is not None:
+            queryset = queryset.filter(precio__gte=minimo)
+        if maximo is not None:
+            queryset = queryset.filter(precio__lt=maximo)
+    if filtros.vip:
+        queryset = queryset.filter(vip=True)
+    if filtros.en_stock:
+        queryset = queryset.filter(unidades__gt=0)
+    return queryset
+
+
+def _rango(precio):
+    for etiqueta, minimo, maximo in RANGOS_PRECIO:
+        if (minimo is None or precio >= minimo) and (maximo is None or precio < maximo):
+            return etiqueta
+
+
+def _consulta_cubo(queryset):
+    rango = Case(*[When(precio__lt=maximo, then=Value(etiqueta)) for etiqueta, _, maximo in RANGOS_PRECIO[:-1]],
+                 default=Value(RANGOS_PRECIO[-1][0]), output_field=CharField())
+    en_stock = Case(When(unidades__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField())
+    return queryset.order_by().annotate(rango=rango, en_stock=en_stock) \
+        .values_list('marca_id', 'rango', 'vip', 'en_stock').annotate(n=Count('pk'))
+
+
+def cubo(queryset):
+    """Recuento de productos por (marca, rango, vip, en_stock) en una sola consulta agrupada."""
+    return [(marca, rango, bool(vip), bool(en_stock), n) for marca, rango, vip, en_stock, n in _consulta_cubo(queryset)]
+
+
+async def acubo(queryset):
+    return [(marca, rango, bool(vip), bool(en_stock), n)
+            async for marca, rango, vip, en_stock, n in _consulta_cubo(queryset)]
+
+
+def _celda(producto):
+    return producto.marca_id, _rango(producto.precio), producto.vip, producto.unidades > 0
+
+
+def cubo_de(productos):
+    """El mismo cubo calculado sobre una lista de productos ya cargada (p. ej. resultados de búsqueda)."""
+    celdas = {}
+    for producto in productos:
+        celda = _celda(producto)
+        celdas[celda] = celdas.get(celda, 0) + 1
+    return [(*celda, n) for celda, n in celdas.items()]
+
+
+def cubo_catalogo(queryset):
+    clave = cache_catalogo.clave('cubo', cache_catalogo.version_catalogo())
+    return cache_catalogo.obtener('cubo', clave, lambda: cubo(queryset))
+
+
+async def acubo_catalogo(queryset):
+    clave = cache_catalogo.clave('cubo', await cache_catalogo.aversion_catalogo())
+    return await cache_catalogo.aobtener('cubo', clave, lambda: acubo(queryset))
+
+
+def _cumple(celda, filtros, excepto=None):
+    marca, rango, vip, en_stock, _ = celda
+    return ((excepto == 'marca' or not filtros.marcas or marca in filtros.marcas)
+            and (excepto == 'precio' or not filtros.precio or rango == filtros.precio)
+            and (excepto == 'vip' or not filtros.vip or vip)
+            and (excepto == 'en_stock' or not filtros.en_stock or en_stock))
+
+
+def contar(celdas, filtros):
+    """Recuentos por faceta. Cada faceta se cuenta con los demás filtros aplicados pero no
+    con el suyo, para que elegir una marca no oculte cuántos productos tienen las otras."""
+    recuentos = {'marca': {}, 'precio': dict.fromkeys(_RANGOS, 0), 'vip': 0, 'en_stock': 0, 'total': 0}
+    for celda in celdas:
+        marca, rango, vip, en_stock, n = celda
+        if _cumple(celda, filtros, 'marca'):
+            recuentos['marca'][marca] = recuentos['marca'].get(marca, 0) + n
+        if _cumple(celda, filtros, 'precio'):
+            recuentos['precio'][rango] += n
+        if vip and _cumple(celda, filtros, 'vip'):
+            recuentos['vip'] += n
+        if en_stock and _cumple(celda, filtros, 'en_stock'):
+            recuentos['en_stock'] += n
+        if _cumple(celda, filtros):
+            recuentos['total'] += n
+    return recuentos
+
+
+def filtrar_lista(productos, filtros):
+    return [producto for producto in productos if _cumple((*_celda(producto), 1), filtros)]
+
+
+def opciones_marca():
+    """(id, nombre) de todas las marcas, cargado al usarse y cacheado con la versión del catálogo."""
+    clave = cache_catalogo.clave('marcas', cache_catalogo.version_catalogo())
+    return cache_catalogo.obtener('marcas', clave,
+                                  lambda: list(Marca.objects.order_by('nombre').values_list('id', 'nombre')))
+
+
+async def aopciones_marca():
+    clave = cache_catalogo.clave('marcas', await cache_catalogo.aversion_catalogo())
+
+    async def calcular():
+        return [marca async for marca in Marca.objects.order_by('nombre').values_list('id', 'nombre')]
+    return await cache_catalogo.aobtener('marcas', clave, calcular)
+
+
+def facetas(celdas, filtros, opciones=None):
+    """Estructura para la plantilla: cada opción con su recuento y el enlace que la activa o quita.
+    ``opciones`` son las marcas ya cargadas (las vistas asíncronas las leen con aopciones_marca)."""
+    recuentos = contar(celdas, filtros)
+    marcas = []
+    for marca_id, nombre in opciones if opciones is not None else opciones_marca():
+        n = recuentos['marca'].get(marca_id, 0)
+        seleccionada = marca_id in filtros.marcas
+        if n or seleccionada:
+            otras = tuple(m for m in filtros.marcas if m != marca_id)
+            marcas.append({'nombre': nombre, 'n': n, 'seleccionada': seleccionada,
+                           'enlace': filtros.querystring(marcas=otras if seleccionada else otras + (marca_id,))})
+    precios = [{'nombre': etiqueta, 'n': recuentos['precio'][etiqueta], 'seleccionada': filtros.precio == etiqueta,
+                'enlace': filtros.querystring(precio=None if filtros.precio == etiqueta else etiqueta)}
+               for etiqueta, _, _ in RANGOS_PRECIO]
+    return {
+        'marcas': marcas,
+        'precios': precios,
+        'vip': {'n': recuentos['vip'], 'seleccionada': filtros.vip,
+                'enlace': filtros.querystring(vip=not filtros.vip)},
+        'en_stock': {'n': recuentos['en_stock'], 'seleccionada': filtros.en_stock,
+                     'enlace': filtros.querystring(en_stock=not filtros.en_stock)},
+        'total': recuentos['total'],
+        'quitar': filtros.activos(),
+    }
@@ -1,4 +1,5 @@
-from .models import Producto, Compra, Cliente, Tarjeta, Direccion, Comentario
+from . import reservas
+from .models import Producto, Compra, Cliente, Tarjeta, Direccion, Comentario, VentasPeriodo
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
@@ -10,12 +11,31 @@ class PostProducto(forms.ModelForm):
         model = Producto
         fields = ['nombre', 'modelo', 'unidades', 'precio', 'vip', 'marca']
 
+    # Las unidades del formulario son el stock total; Producto.unidades guarda el disponible,
+    # sin las reservadas en carritos (ver reservas.py)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reservadas = 0
+        if self.instance.pk:
+            self.reservadas = reservas.reservadas([self.instance.pk], self.instance._state.db) \
+                .get(self.instance.pk, 0)
+            self.initial['unidades'] = self.instance.unidades + self.reservadas
+
+    def clean_unidades(self):
+        return reservas.disponibles(self.cleaned_data['unidades'], self.reservadas)
+
 
 class CompraForm(forms.ModelForm):
     class Meta:
         model = Compra
         fields = ['unidades']
 
+    def clean_unidades(self):
+        unidades = self.cleaned_data['unidades']
+        if unidades <= 0:
+            raise forms.ValidationError('Las unidades deben ser positivas')
+        return unidades
+
 
 class RegistroForm(UserCreationForm):
     class Meta:
@@ -34,6 +54,12 @@ class ClienteForm(forms.ModelForm):
         model = Cliente
         fields = ['user', 'vip', 'saldo']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # El perfil sólo puede quedar asociado a su propio usuario: no se cargan todos en el desplegable
+        if self.instance.user_id:
+            self.fields['user'].queryset = self.fields['user'].queryset.filter(pk=self.instance.user_id)
+
 
 class DireccionesForm(forms.ModelForm):
     class Meta:
@@ -47,3 +73,33 @@ class TarjetasForm(forms.ModelForm):
         fields = ['nombre_tarjeta', 'tipo_tarjeta', 'titular_tarjeta', 'caducidad_tarjeta']
 
 
+class ExportarComprasForm(forms.Form):
+    FORMATOS = [('csv', 'CSV'), ('jsonl', 'JSONL')]
+
+    formato = forms.ChoiceField(choices=FORMATOS, required=False)
+    desde = forms.DateField(required=False)
+    hasta = forms.DateField(required=False)
+    cliente = forms.CharField(required=False, help_text='Nombre de usuario del cliente')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        desde, hasta = cleaned_data.get('desde'), cleaned_data.get('hasta')
+        if desde and hasta and desde > hasta:
+            raise forms.ValidationError('La fecha inicial es posterior a la final')
+        return cleaned_data
+
+
+class InformeVentasForm(forms.Form):
+    periodo = forms.ChoiceField(choices=[('', 'Automático')] + VentasPeriodo.PERIODOS, required=False)
+    dimension = forms.ChoiceField(choices=VentasPeriodo.DIMENSIONES[:3], required=False)
+    desde = forms.DateField(required=False)
+    hasta = forms.DateField(required=False)
+    clave = forms.IntegerField(min_value=1, required=False,
+                               help_text='Id del producto, marca o cliente cuya evolución se quiere ver')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        desde, hasta = cleaned_data.get('desde'), cleaned_data.get('hasta')
+        if desde and hasta and desde > hasta:
+            raise forms.ValidationError('La fecha inicial es posterior a la final')
+        return cleaned_data
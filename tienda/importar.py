@@ -0,0 +1,314 @@
+import csv
+import io
+import json
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+
+from . import cache_catalogo, reservas
+from .busqueda import obtener_backend
+from .models import Marca, Producto
+
+# Importación masiva de productos desde CSV o JSONL. El fichero se lee en
+# streaming y se procesa por lotes, cada uno en su transacción:
+#   - las marcas del lote se resuelven con una consulta (y se crean las que faltan),
+#   - los productos se buscan por su clave natural (marca, modelo),
+#   - sólo se escriben los productos nuevos o con algún campo distinto.
+# Con ``solo_cambios`` únicamente se actualizan precio y stock de productos que
+# ya existen. Las operaciones masivas no disparan señales, así que índice de
+# búsqueda y caché del catálogo se actualizan explícitamente tras cada lote.
+# Las unidades del fichero son el stock total: a los productos que ya existen se
+# les guardan sin las reservadas en carritos (ver reservas.py).
+
+LOTE = 2000
+CAMPOS = ('nombre', 'unidades', 'precio', 'vip')
+CAMPOS_DELTA = ('precio', 'unidades')
+_VERDADERO = {'1', 'true', 'si', 'sí', 'yes', 'x'}
+
+
+class FilaRechazada(Exception):
+    pass
+
+
+def leer_csv(fichero):
+    for numero, fila in enumerate(csv.DictReader(fichero), start=2):
+        yield numero, fila
+
+
+def leer_jsonl(fichero):
+    for numero, linea in enumerate(fichero, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            fila = None
+        yield numero, fila if isinstance(fila, dict) else {'__error__': 'JSON no válido'}
+
+
+LECTORES = {'csv': leer_csv, 'jsonl': leer_jsonl}
+
+
+def _texto(fila, campo, maximo, obligatorio=True):
+    valor = str(fila.get(campo) or '').strip()
+    if not valor:
+        if obligatorio:
+            raise FilaRechazada(f'falta {campo}')
+        return None
+    if len(valor) > maximo:
+        raise FilaRechazada(f'{campo} supera {maximo} caracteres')
+    return valor
+
+
+def _numero(fila, campo, tipo, obligatorio=True):
+    valor = fila.get(campo)
+    if valor is None or str(valor).strip() == '':
+        if obligatorio:
+            raise FilaRechazada(f'falta {campo}')
+        return None
+    try:
+        valor = tipo(str(valor).strip())
+    except (ValueError, InvalidOperation):
+        raise FilaRechazada(f'{campo} no válido: {valor!r}') from None
+    if valor < 0 or (tipo is Decimal and not valor.is_finite()):
+        raise FilaRechazada(f'{campo} no válido: {valor}')
+    return valor
+
+
+def validar(fila, solo_cambios=False):
+    """Fila normalizada {'marca', 'modelo', campo: valor}; en modo delta sólo precio y unidades."""
+    if '__error__' in fila:
+        raise FilaRechazada(fila['__error__'])
+    datos = {
+        'marca': _texto(fila, 'marca', Marca._meta.get_field('nombre').max_length),
+        'modelo': _texto(fila, 'modelo', Producto._meta.get_field('modelo').max_length),
+        'precio': _numero(fila, 'precio', Decimal, obligatorio=not solo_cambios),
+        'unidades': _numero(fila, 'unidades', int, obligatorio=not solo_cambios),
+    }
+    if datos['precio'] is not None:
+        datos['precio'] = datos['precio'].quantize(Decimal('0.01'))
+    if solo_cambios:
+        if datos['precio'] is None and datos['unidades'] is None:
+            raise FilaRechazada('no trae precio ni unidades')
+        return {clave: valor for clave, valor in datos.items() if valor is not None}
+    datos['nombre'] = _texto(fila, 'nombre', Producto._meta.get_field('nombre').max_length)
+    datos['vip'] = str(fila.get('vip') or '').strip().lower() in _VERDADERO
+    return datos
+
+
+class Resultado:
+
+    def __init__(self):
+        self.contadores = Counter()
+        self.rechazos = []
+        self.inicio = time.perf_counter()
+
+    def rechazar(self, numero, motivo):
+        self.contadores['rechazados'] += 1
+        self.rechazos.append((numero, motivo))
+
+    def resumen(self):
+        duracion = time.perf_counter() - self.inicio
+        c = self.contadores
+        return (f'{c["leidas"]} filas ({c["leidas"] / duracion:.0f}/s): {c["creados"]} creados, '
+                f'{c["actualizados"]} actualizados, {c["sin_cambios"]} sin cambios, {c["rechazados"]} rechazados')
+
+
+class Importador:
+    """Importación con el ORM: se leen los productos del lote y se escriben los nuevos o cambiados
+    con bulk_create(update_conflicts=...)."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, solo_cambios=False, lote=LOTE):
+        self.using = using
+        self.solo_cambios = solo_cambios
+        self.lote = lote
+
+    def importar(self, filas, progreso=None):
+        """Importa las filas ((número, dict) de LECTORES) y devuelve el Resultado."""
+        resultado = Resultado()
+        pendientes = []
+        for numero, fila in filas:
+            resultado.contadores['leidas'] += 1
+            try:
+                pendientes.append((numero, validar(fila, self.solo_cambios)))
+            except FilaRechazada as error:
+                resultado.rechazar(numero, str(error))
+            if len(pendientes) >= self.lote:
+                self._procesar(pendientes, resultado, progreso)
+                pendientes = []
+        if pendientes:
+            self._procesar(pendientes, resultado, progreso)
+        return resultado
+
+    def _procesar(self, pendientes, resultado, progreso):
+        # Si una clave se repite dentro del lote gana la última aparición
+        por_clave = {}
+        for numero, datos in pendientes:
+            clave = (datos['marca'], datos['modelo'])
+            if clave in por_clave:
+                resultado.rechazar(por_clave[clave][0], f'repetida en la fila {numero}')
+            por_clave[clave] = (numero, datos)
+        with transaction.atomic(using=self.using):
+            marcas = self.marcas({marca for marca, _ in por_clave})
+            filas = []
+            for (marca, modelo), (numero, datos) in por_clave.items():
+                if marca not in marcas:
+                    resultado.rechazar(numero, f'no existe la marca {marca!r}')
+                else:
+                    filas.append((numero, marcas[marca], datos))
+            creados, actualizados = self.aplicar(filas, resultado)
+            self.despues(creados, actualizados)
+        resultado.contadores['creados'] += len(creados)
+        resultado.contadores['actualizados'] += len(actualizados)
+        if progreso:
+            progreso(resultado)
+
+    def marcas(self, nombres):
+        """{nombre: id} de las marcas del lote; fuera del modo delta se crean las que faltan."""
+        marcas = dict(Marca.objects.using(self.using).filter(nombre__in=nombres).values_list('nombre', 'pk'))
+        faltan = nombres - set(marcas)
+        if faltan and not self.solo_cambios:
+            Marca.objects.using(self.using).bulk_create([Marca(nombre=nombre) for nombre in faltan],
+                                                        ignore_conflicts=True)
+            marcas.update(Marca.objects.using(self.using).filter(nombre__in=faltan).values_list('nombre', 'pk'))
+        return marcas
+
+    def _por_claves(self, claves):
+        """Productos con esas claves (marca_id, modelo): una condición por marca, para que cada
+        una sea un recorrido del índice único (marca, modelo) y no un producto cartesiano."""
+        por_marca = {}
+        for marca_id, modelo in claves:
+            por_marca.setdefault(marca_id, []).append(modelo)
+        condicion = Q()
+        for marca_id, modelos in por_marca.items():
+            condicion |= Q(marca_id=marca_id, modelo__in=modelos)
+        return Producto.objects.using(self.using).filter(condicion)
+
+    def existentes(self, filas):
+        """{(marca_id, modelo): Producto} de los productos del lote que ya existen."""
+        claves = {(marca_id, datos['modelo']) for _, marca_id, datos in filas}
+        productos = self._por_claves(claves).only('pk', 'marca_id', 'modelo', *CAMPOS)
+        return {(p.marca_id, p.modelo): p for p in productos}
+
+    def aplicar(self, filas, resultado):
+        existentes = self.existentes(filas)
+        campos = CAMPOS_DELTA if self.solo_cambios else CAMPOS
+        reservadas = reservas.reservadas([producto.pk for producto in existentes.values()], self.using) \
+            if existentes else {}
+        # Por columnas presentes: en modo delta una fila sólo de precio no debe volver a escribir
+        # las unidades leídas antes (las de una compra entre medias se perderían)
+        nuevos, actualizados, escribir = [], [], {}
+        for numero, marca_id, datos in filas:
+            producto = existentes.get((marca_id, datos['modelo']))
+            if producto is not None and reservadas.get(producto.pk) and 'unidades' in datos:
+                datos = dict(datos, unidades=reservas.disponibles(datos['unidades'], reservadas[producto.pk]))
+            if producto is None:
+                if self.solo_cambios:
+                    resultado.rechazar(numero, 'el producto no existe')
+                    continue
+                nuevos.append((marca_id, datos['modelo']))
+                valores = {campo: datos[campo] for campo in CAMPOS}
+            elif all(getattr(producto, campo) == datos[campo] for campo in campos if campo in datos):
+                resultado.contadores['sin_cambios'] += 1
+                continue
+            else:
+                actualizados.append(producto.pk)
+                valores = {campo: datos.get(campo, getattr(producto, campo)) for campo in CAMPOS}
+            presentes = tuple(campo for campo in campos if campo in datos)
+            escribir.setdefault(presentes, []).append(
+                Producto(marca_id=marca_id, marca_nombre=datos['marca'], modelo=datos['modelo'], **valores))
+        for presentes, productos in escribir.items():
+            # Un único INSERT ... ON CONFLICT (marca, modelo) DO UPDATE por lote para nuevos y cambiados;
+            # bulk_update generaría un CASE por fila y campo, mucho más lento
+            Producto.objects.using(self.using).bulk_create(
+                productos, batch_size=500, update_conflicts=True, unique_fields=['marca', 'modelo'],
+                update_fields=list(presentes))
+        # Con update_conflicts Django no devuelve los ids de los nuevos: se leen por la clave natural
+        creados = list(self._por_claves(nuevos).values_list('pk', flat=True)) if nuevos else []
+        return creados, actualizados
+
+    def despues(self, creados, actualizados):
+        # Precio y stock no forman parte del índice de búsqueda; nombre sí
+        if not self.solo_cambios:
+            obtener_backend(self.using).indexar(creados + actualizados)
+        cache_catalogo.invalidar_productos(actualizados)
+        if creados or actualizados:
+            cache_catalogo.invalidar_catalogo()
+
+
+class ImportadorPostgres(Importador):
+    """En PostgreSQL cada lote se carga con COPY en una tabla temporal y se aplica con una
+    sola sentencia: INSERT ... ON CONFLICT DO UPDATE (o UPDATE ... FROM en modo delta)
+    que sólo toca las filas con algún valor distinto."""
+
+    _TEMPORAL = 'tienda_importacion'
+    # Unidades que se guardan de un producto que ya existe: las del fichero menos las reservadas
+    _DISPONIBLES = ('GREATEST({unidades} - (SELECT COALESCE(SUM(r.unidades), 0) FROM tienda_reserva r '
+                    'WHERE r.producto_id = {producto}), 0)')
+
+    def aplicar(self, filas, resultado):
+        if not filas:
+            return [], []
+        columnas = ('numero', 'marca_id', 'modelo', 'nombre', 'unidades', 'precio', 'vip')
+        datos = io.StringIO()
+        escritor = csv.writer(datos)
+        for numero, marca_id, fila in filas:
+            escritor.writerow([numero, marca_id, fila['modelo'],
+                               *['' if fila.get(campo) is None else fila[campo] for campo in columnas[3:]]])
+        datos.seek(0)
+        rechazados = resultado.contadores['rechazados']
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {self._TEMPORAL} (numero integer, marca_id bigint, '
+                f'modelo varchar(50), nombre varchar(50), unidades integer, precio numeric(12, 2), vip boolean) '
+                f'ON COMMIT DELETE ROWS')
+            cursor.copy_expert(f"COPY {self._TEMPORAL} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv)", datos)
+            if self.solo_cambios:
+                cursor.execute(
+                    f'SELECT t.numero FROM {self._TEMPORAL} t WHERE NOT EXISTS (SELECT 1 FROM tienda_producto p '
+                    f'WHERE p.marca_id = t.marca_id AND p.modelo = t.modelo)')
+                for numero, in cursor.fetchall():
+                    resultado.rechazar(numero, 'el producto no existe')
+                # GREATEST ignora los NULL: sin unidades en la fila se conservan las del producto
+                unidades = (f'CASE WHEN t.unidades IS NULL THEN p.unidades '
+                            f'ELSE {self._DISPONIBLES.format(unidades="t.unidades", producto="p.id")} END')
+                cursor.execute(
+                    f'UPDATE tienda_producto p SET precio = COALESCE(t.precio, p.precio), '
+                    f'unidades = {unidades} FROM {self._TEMPORAL} t '
+                    f'WHERE p.marca_id = t.marca_id AND p.modelo = t.modelo '
+                    f'AND (p.precio, p.unidades) IS DISTINCT FROM '
+                    f'(COALESCE(t.precio, p.precio), {unidades}) RETURNING p.id')
+                creados, actualizados = [], [pk for pk, in cursor.fetchall()]
+            else:
+                # El resumen de valoraciones tiene valor por defecto en el modelo, no en la tabla
+                por_defecto = {campo.column: campo.get_default() for campo in Producto._meta.concrete_fields
+                               if campo.has_default() and campo.column not in columnas}
+                unidades = self._DISPONIBLES.format(unidades='EXCLUDED.unidades', producto='tienda_producto.id')
+                cursor.execute(
+                    f'INSERT INTO tienda_producto (marca_id, marca_nombre, modelo, nombre, unidades, precio, vip'
+                    f'{"".join(f", {columna}" for columna in por_defecto)}) '
+                    f'SELECT t.marca_id, m.nombre, t.modelo, t.nombre, t.unidades, t.precio, t.vip'
+                    f'{", %s" * len(por_defecto)} '
+                    f'FROM {self._TEMPORAL} t JOIN tienda_marca m ON m.id = t.marca_id '
+                    f'ON CONFLICT (marca_id, modelo) DO UPDATE SET nombre = EXCLUDED.nombre, '
+                    f'unidades = {unidades}, precio = EXCLUDED.precio, vip = EXCLUDED.vip '
+                    f'WHERE (tienda_producto.nombre, tienda_producto.unidades, tienda_producto.precio, '
+                    f'tienda_producto.vip) IS DISTINCT FROM '
+                    f'(EXCLUDED.nombre, {unidades}, EXCLUDED.precio, EXCLUDED.vip) '
+                    # xmax = 0 sólo en las filas recién insertadas
+                    f'RETURNING id, xmax = 0',
+                    list(por_defecto.values()))
+                devueltas = cursor.fetchall()
+                creados = [pk for pk, nuevo in devueltas if nuevo]
+                actualizados = [pk for pk, nuevo in devueltas if not nuevo]
+        rechazados = resultado.contadores['rechazados'] - rechazados
+        resultado.contadores['sin_cambios'] += len(filas) - len(creados) - len(actualizados) - rechazados
+        return creados, actualizados
+
+
+def obtener_importador(using=DEFAULT_DB_ALIAS, **opciones):
+    clase = ImportadorPostgres if connections[using].vendor == 'postgresql' else Importador
+    return clase(using, **opciones)
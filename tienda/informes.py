@@ -0,0 +1,87 @@
+import datetime
+
+from django.db.models import Q, Sum
+
+from .agregados import inicio_mes
+from .models import Cliente, Marca, Producto, VentasPeriodo
+
+# Informes de ventas por rango de fechas a partir de VentasPeriodo: una serie por día o por
+# mes lee como mucho un centenar de filas por índice y un ranking agrupa las filas del rango
+# de una dimensión, así que el coste depende de la longitud del rango y no del histórico.
+
+# Los rangos más largos se muestran por meses (contados enteros)
+MAX_DIAS = 92
+LIMITE = 20
+
+
+def periodo_para(desde, hasta):
+    return VentasPeriodo.DIA if (hasta - desde).days < MAX_DIAS else VentasPeriodo.MES
+
+
+def sumar_meses(dia, meses):
+    total = dia.year * 12 + dia.month - 1 + meses
+    return dia.replace(year=total // 12, month=total % 12 + 1, day=1)
+
+
+def ajustar(periodo, desde, hasta):
+    """Rango de inicios de periodo que cubre [desde, hasta]."""
+    return (inicio_mes(desde), inicio_mes(hasta)) if periodo == VentasPeriodo.MES else (desde, hasta)
+
+
+def inicios(periodo, desde, hasta):
+    desde, hasta = ajustar(periodo, desde, hasta)
+    resultado = []
+    while desde <= hasta:
+        resultado.append(desde)
+        desde = sumar_meses(desde, 1) if periodo == VentasPeriodo.MES else desde + datetime.timedelta(days=1)
+    return resultado
+
+
+def rango_anterior(periodo, desde, hasta):
+    """Rango de la misma duración inmediatamente anterior, para calcular la tendencia."""
+    desde, hasta = ajustar(periodo, desde, hasta)
+    if periodo == VentasPeriodo.MES:
+        meses = (hasta.year - desde.year) * 12 + hasta.month - desde.month + 1
+        return sumar_meses(desde, -meses), sumar_meses(desde, -1)
+    return desde - (hasta - desde) - datetime.timedelta(days=1), desde - datetime.timedelta(days=1)
+
+
+def serie(dimension, clave, desde, hasta, periodo):
+    """Ventas de una clave (0 para el total de la tienda) en cada periodo del rango, con ceros
+    en los periodos sin ventas."""
+    filas = {fila.pop('inicio'): fila for fila in VentasPeriodo.objects.filter(
+        periodo=periodo, dimension=dimension, clave=clave, inicio__range=ajustar(periodo, desde, hasta),
+    ).values('inicio', 'unidades', 'importe', 'compras')}
+    vacio = {'unidades': 0, 'importe': 0, 'compras': 0}
+    return [{'inicio': inicio, **filas.get(inicio, vacio)} for inicio in inicios(periodo, desde, hasta)]
+
+
+def ranking(dimension, desde, hasta, periodo, limite=LIMITE):
+    """Las claves con más importe en el rango, con el importe del rango anterior y la variación."""
+    desde, hasta = ajustar(periodo, desde, hasta)
+    anterior_desde, _ = rango_anterior(periodo, desde, hasta)
+    actual = Q(inicio__gte=desde)
+    filas = list(VentasPeriodo.objects.filter(
+        periodo=periodo, dimension=dimension, inicio__range=(anterior_desde, hasta),
+    ).values('clave').annotate(
+        total_unidades=Sum('unidades', filter=actual), total_importe=Sum('importe', filter=actual),
+        total_compras=Sum('compras', filter=actual), importe_anterior=Sum('importe', filter=~actual),
+    ).filter(total_importe__gt=0).order_by('-total_importe', 'clave')[:limite])
+    nombres = _nombres(dimension, [fila['clave'] for fila in filas])
+    return [{
+        'clave': fila['clave'], 'nombre': nombres.get(fila['clave'], fila['clave']),
+        'unidades': fila['total_unidades'], 'importe': fila['total_importe'], 'compras': fila['total_compras'],
+        'importe_anterior': fila['importe_anterior'],
+        'variacion': round(float(fila['total_importe'] / fila['importe_anterior'] - 1), 4)
+        if fila['importe_anterior'] else None,
+    } for fila in filas]
+
+
+def _nombres(dimension, claves):
+    if dimension == 'producto':
+        return dict(Producto.objects.filter(pk__in=claves).values_list('pk', 'nombre'))
+    if dimension == 'marca':
+        return dict(Marca.objects.filter(pk__in=claves).values_list('pk', 'nombre'))
+    if dimension == 'cliente':
+        return dict(Cliente.objects.filter(pk__in=claves).values_list('pk', 'user__username'))
+    return {0: 'Total'}
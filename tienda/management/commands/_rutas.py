@@ -0,0 +1,184 @@
+import copy
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from tienda.carrito import Carrito
+from tienda.compras import realizar_compra
+from tienda.models import Cliente, Comentario, Marca, Producto
+from tienda.valoraciones import aplicar_valoracion
+
+# Contraseña del usuario de los datos de prueba, para medir el inicio de sesión
+CLAVE = 'auditoria-clave'
+
+
+# Páginas de la tienda que recorren los comandos de auditoría y de rendimiento.
+# ``argumentos`` indica qué objeto de los datos de prueba va en cada argumento de la URL y
+# ``parametros`` va en la query string o, con ``metodo='POST'``, en el formulario; en ambos un
+# valor que es una clave de los datos se sustituye por ese dato. Las anónimas se piden sin
+# sesión y las que escriben (los POST y las que escriben con GET) en una transacción que se
+# deshace después de cada petición, para que todas las repeticiones encuentren los mismos datos.
+class Ruta(NamedTuple):
+    nombre: str
+    argumentos: dict = {}
+    parametros: dict = {}
+    metodo: str = 'GET'
+    anonima: bool = False
+    escribe: bool = False
+
+    @property
+    def modifica(self):
+        return self.metodo == 'POST' or self.escribe
+
+    @property
+    def etiqueta(self):
+        etiqueta = f'{self.nombre} {self.parametros or ""}'.strip()
+        return f'POST {etiqueta}' if self.metodo == 'POST' else etiqueta
+
+
+PRODUCTO = {'nombre': 'Auditoria', 'modelo': 'modelo', 'unidades': '10', 'precio': '9.99', 'marca': 'marca'}
+COMENTARIO = {'valoracion': '4', 'comentario': 'auditoria'}
+
+RUTAS = (
+    Ruta('welcome'),
+    Ruta('compra'),
+    Ruta('compra', parametros={'orden': '-precio'}),
+    Ruta('compra', parametros={'marca': 'marca', 'precio': '0-50', 'en_stock': '1'}),
+    Ruta('api_catalogo', parametros={'orden': '-precio'}),
+    Ruta('buscar', parametros={'buscar_post': 'auditoria'}),
+    Ruta('autocompletar', parametros={'q': 'audi'}),
+    Ruta('checkout', {'pk': 'producto'}),
+    Ruta('checkout', {'pk': 'producto'}, {'unidades': '1'}, metodo='POST'),
+    Ruta('comentarios_producto', {'pk': 'producto'}, {'formato': 'json'}),
+    Ruta('crear_comentario', {'pk': 'producto'}),
+    Ruta('crear_comentario', {'pk': 'producto'}, COMENTARIO, metodo='POST'),
+    Ruta('editar_comentario', {'pk': 'comentario'}),
+    Ruta('editar_comentario', {'pk': 'comentario'}, COMENTARIO, metodo='POST'),
+    Ruta('productos'),
+    Ruta('nuevo'),
+    Ruta('nuevo', parametros=dict(PRODUCTO, modelo='auditoria-nuevo'), metodo='POST'),
+    Ruta('editar', {'pk': 'producto'}),
+    Ruta('editar', {'pk': 'producto'}, PRODUCTO, metodo='POST'),
+    Ruta('eliminar', {'pk': 'producto'}, escribe=True),
+    Ruta('estadisticas_cache'),
+    Ruta('perfil_consultas'),
+    Ruta('estado_tareas'),
+    Ruta('top_productos'),
+    Ruta('top_clientes'),
+    Ruta('historial'),
+    Ruta('informe_ventas'),
+    # La dimensión por defecto es la marca (un 'dimension': 'marca' se sustituiría por su id)
+    Ruta('informe_ventas', parametros={'clave': 'marca'}),
+    Ruta('exportar_compras', parametros={'formato': 'csv'}),
+    Ruta('agregar_al_carrito', parametros={'producto_id': 'producto', 'unidades': '1'}, metodo='POST'),
+    Ruta('ver_carrito'),
+    Ruta('checkout_carrito'),
+    Ruta('checkout_carrito', metodo='POST'),
+    Ruta('menu'),
+    Ruta('general'),
+    Ruta('general', parametros={'user': 'user', 'saldo': '100'}, metodo='POST'),
+    Ruta('direcciones'),
+    Ruta('direcciones', parametros={'direccion_envio': 'Calle 1', 'direccion_facturacion': 'Calle 1'},
+         metodo='POST'),
+    Ruta('tarjetas'),
+    Ruta('tarjetas', parametros={'nombre_tarjeta': 'Auditoria', 'tipo_tarjeta': 'VISA', 'titular_tarjeta': 'Auditoria',
+                                 'caducidad_tarjeta': '2030-01-01'}, metodo='POST'),
+    Ruta('logout', escribe=True),
+    Ruta('login', anonima=True),
+    Ruta('login', parametros={'username': 'usuario', 'password': CLAVE}, metodo='POST', anonima=True),
+    Ruta('registro', anonima=True),
+    Ruta('registro', parametros={'username': 'registro-bench', 'email': 'registro@example.com',
+                                 'password1': CLAVE, 'password2': CLAVE}, metodo='POST', anonima=True),
+)
+
+
+def crear_datos(using):
+    """Datos mínimos para que todas las rutas respondan con contenido. Se crean dentro
+    de la transacción del comando, que los deshace al terminar."""
+    etiqueta = uuid.uuid4().hex[:8]
+    marca = Marca.objects.using(using).create(nombre=f'auditoria-{etiqueta}')
+    producto = Producto.objects.using(using).create(marca=marca, nombre='Auditoria', modelo=etiqueta, unidades=10,
+                                                    precio=Decimal('9.99'))
+    user = User.objects.db_manager(using).create_user(f'auditoria-{etiqueta}', password=CLAVE, is_staff=True)
+    cliente = Cliente.objects.using(using).create(user=user, saldo=100)
+    # Por el mismo camino que el checkout, para que la compra cuente en los agregados de ventas
+    realizar_compra(cliente, producto.pk, 1, using=using)
+    comentario = Comentario.objects.using(using).create(producto=producto, comentario='auditoria', valoracion=5)
+    aplicar_valoracion(producto.pk, nueva=5, using=using)
+    return {'marca': marca, 'producto': producto, 'user': user, 'comentario': comentario,
+            'usuario': user.username, 'modelo': producto.modelo}
+
+
+def datos_existentes(using):
+    """Objetos de los datos ya cargados (el producto con stock con más valoraciones, su marca y su
+    primer comentario) y un usuario de staff nuevo; se usa dentro de una transacción que se
+    deshace al terminar."""
+    # Con stock, para que las rutas de compra midan una compra y no el "no quedan unidades"
+    productos = Producto.objects.using(using).select_related('marca').order_by('-num_valoraciones', 'pk')
+    producto = productos.filter(unidades__gt=0).first() or productos.first()
+    comentario = Comentario.objects.using(using).filter(producto=producto).order_by('pk').first()
+    user = User.objects.db_manager(using).create_user(f'bench-{uuid.uuid4().hex[:8]}', password=CLAVE,
+                                                      is_staff=True)
+    Cliente.objects.using(using).create(user=user, saldo=0)
+    return {'marca': producto.marca, 'producto': producto, 'user': user, 'comentario': comentario,
+            'usuario': user.username, 'modelo': producto.modelo}
+
+
+def url(ruta, datos):
+    """URL de la ruta con los argumentos y parámetros sustituidos por los datos de prueba."""
+    def valor(clave):
+        return getattr(datos[clave], 'pk', datos[clave])
+
+    argumentos = {nombre: valor(objeto) for nombre, objeto in ruta.argumentos.items()}
+    parametros = {clave: valor(dato) if dato in datos else dato for clave, dato in ruta.parametros.items()}
+    return reverse(ruta.nombre, kwargs=argumentos), parametros
+
+
+def cliente_http(datos):
+    """Cliente con la sesión iniciada y el producto de los datos en el carrito (sin reserva,
+    para no apartar stock de verdad en los comandos que no deshacen sus cambios)."""
+    cliente = Client()
+    cliente.force_login(datos['user'])
+    sesion = cliente.session
+    Carrito(sesion).agregar(datos['producto'].pk, 1)
+    sesion.save()
+    return cliente
+
+
+@contextmanager
+def aislada(cliente, ruta):
+    """Deshace lo que escribe una ruta que modifica datos: sus escrituras en la base de datos
+    y los cambios en la sesión del cliente (cerrar sesión, vaciar el carrito...)."""
+    if not ruta.modifica:
+        yield
+        return
+    cookies, sesion = copy.deepcopy(cliente.cookies), dict(cliente.session.items())
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+    cliente.cookies = cookies
+    restaurada = cliente.session
+    restaurada.clear()
+    restaurada.update(sesion)
+    restaurada.save()
+
+
+def pedir(cliente, ruta, datos):
+    """Pide la página y consume la respuesta completa (también las que van en streaming). Las
+    rutas que modifican datos tienen que pedirse dentro de ``aislada``."""
+    direccion, parametros = url(ruta, datos)
+    if ruta.anonima:
+        cliente = Client()
+    if ruta.metodo == 'POST':
+        respuesta = cliente.post(direccion, parametros)
+    else:
+        respuesta = cliente.get(direccion, parametros)
+    if respuesta.streaming:
+        b''.join(respuesta.streaming_content)
+    return respuesta
@@ -0,0 +1,68 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from tienda.agregados import calcular_desde_compras, calcular_periodos_desde_compras, leer_agregados, \
+    leer_periodos, periodos_desde
+from tienda.models import VentasCliente, VentasPeriodo, VentasProducto
+
+
+def fecha(valor):
+    return datetime.date.fromisoformat(valor)
+
+
+class Command(BaseCommand):
+    help = ('Reconstruye (o con --verificar, sólo comprueba) los agregados de ventas a partir de Compra: '
+            'totales por producto y por cliente y ventas por día y por mes. Con --desde sólo se rellenan '
+            'los periodos a partir de esa fecha (los totales no se tocan)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true',
+                            help='No escribe nada; falla si los agregados no cuadran con el histórico')
+        parser.add_argument('--desde', type=fecha, help='Fecha (AAAA-MM-DD) desde la que rellenar los periodos')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['verificar']:
+            self.verificar(using, options['desde'])
+        else:
+            self.reconstruir(using, options['desde'])
+
+    def reconstruir(self, using, desde):
+        with transaction.atomic(using=using):
+            if desde is None:
+                productos, clientes = calcular_desde_compras(using)
+                VentasProducto.objects.using(using).all().delete()
+                VentasCliente.objects.using(using).all().delete()
+                VentasProducto.objects.using(using).bulk_create(
+                    [VentasProducto(producto_id=pk, **valores) for pk, valores in productos.items()], batch_size=1000)
+                VentasCliente.objects.using(using).bulk_create(
+                    [VentasCliente(cliente_id=pk, **valores) for pk, valores in clientes.items()], batch_size=1000)
+                self.stdout.write(f'Totales reconstruidos: {len(productos)} productos, {len(clientes)} clientes')
+            periodos = calcular_periodos_desde_compras(using, desde)
+            periodos_desde(using, desde).delete()
+            VentasPeriodo.objects.using(using).bulk_create(
+                [VentasPeriodo(periodo=periodo, dimension=dimension, clave=clave, inicio=inicio, **valores)
+                 for (periodo, dimension, clave, inicio), valores in periodos.items()], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(
+            f'Agregados reconstruidos: {len(periodos)} filas de ventas por periodo'
+            + (f' desde {desde}' if desde else '')))
+
+    def verificar(self, using, desde):
+        # Lectura consistente de histórico y agregados
+        with transaction.atomic(using=using):
+            esperados = (*calcular_desde_compras(using), calcular_periodos_desde_compras(using, desde))
+            actuales = (*leer_agregados(using), leer_periodos(using, desde))
+        diferencias = 0
+        vacio = {'unidades': 0, 'importe': 0, 'compras': 0}
+        for nombre, esperado, actual in zip(('producto', 'cliente', 'periodo'), esperados, actuales):
+            for pk in sorted(set(esperado) | set(actual)):
+                if esperado.get(pk, vacio) != actual.get(pk, vacio):
+                    diferencias += 1
+                    self.stdout.write(f'{nombre} {pk}: esperado {esperado.get(pk, vacio)}, '
+                                      f'guardado {actual.get(pk, vacio)}')
+        if diferencias:
+            raise CommandError(f'{diferencias} agregados no cuadran; ejecute agregados_ventas para reconstruirlos')
+        self.stdout.write(self.style.SUCCESS('Los agregados cuadran con el histórico'))
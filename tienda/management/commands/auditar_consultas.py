@@ -0,0 +1,89 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.test.utils import override_settings
+
+from ._rutas import RUTAS, aislada, cliente_http, crear_datos, pedir
+
+# Consultas que recorren una tabla entera a propósito, con el motivo.
+PERMITIDAS = (
+    (re.compile(r'GROUP BY "tienda_producto"\."marca_id"'), 'cubo de facetas: una vez por versión del catálogo'),
+    (re.compile(r'SELECT COUNT\(\*\) AS "__count" FROM "tienda_compra"'), 'recuento del paginador del historial'),
+    (re.compile(r'FROM "tienda_compra" .*ORDER BY "tienda_compra"\."fecha" ASC$'), 'exportación del histórico'),
+    (re.compile(r'^SELECT "tienda_marca"\."id", "tienda_marca"\."nombre" FROM "tienda_marca"( ORDER BY [^ ]+ ASC)?$'),
+     'lista de marcas para facetas y formularios: tabla pequeña'),
+    (re.compile(r'FROM "tienda_tarea" GROUP BY "tienda_tarea"\."nombre", "tienda_tarea"\."estado"$'),
+     'profundidad de la cola en el estado de tareas: las hechas se purgan (procesar_tareas --purgar)'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Pide cada página de la tienda, captura su SQL y ejecuta EXPLAIN sobre cada consulta. '
+            'Falla si alguna recorre una tabla entera sin estar en la lista de consultas permitidas. '
+            'Los datos de prueba se crean dentro de una transacción que se deshace al terminar.')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'EXPLAIN no soportado para {connection.vendor}')
+        detalle = options['verbosity'] > 1
+        problemas = 0
+        # Sin caché, para auditar el camino que va a la base de datos; cualquier host para el cliente de pruebas
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                               ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            datos = crear_datos(DEFAULT_DB_ALIAS)
+            cliente = cliente_http(datos)
+            if connection.vendor == 'postgresql':
+                # Con tablas casi vacías el planificador siempre prefiere leerlas enteras
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for ruta in RUTAS:
+                consultas = []
+
+                def capturar(execute, sql, params, many, context):
+                    consultas.append((sql, params))
+                    return execute(sql, params, many, context)
+
+                with aislada(cliente, ruta):
+                    with connection.execute_wrapper(capturar):
+                        respuesta = pedir(cliente, ruta, datos)
+                    escaneos = [(sql, motivo) for sql, params in consultas
+                                if sql.lstrip().upper().startswith('SELECT') for motivo in self.escaneos(sql, params)]
+                marcados = [(sql, motivo) for sql, motivo in escaneos if not self.permitida(sql)]
+                problemas += len(marcados)
+                estado = self.style.SUCCESS('OK') if not marcados else self.style.ERROR(f'{len(marcados)} escaneos')
+                self.stdout.write(f'{ruta.etiqueta:<60} {respuesta.status_code} {len(consultas):>3} consultas  '
+                                  f'{estado}')
+                for sql, motivo in escaneos if detalle else marcados:
+                    self.stdout.write(f'    {motivo}: {sql}')
+            transaction.set_rollback(True)
+        if problemas:
+            raise CommandError(f'{problemas} consultas recorren tablas enteras')
+
+    def permitida(self, sql):
+        return any(patron.search(sql) for patron, _ in PERMITIDAS)
+
+    def escaneos(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                # Las filas son (id, padre, no usado, detalle). "SCAN" recorre la tabla o un índice entero;
+                # sólo se acepta con LIMIT, que lo corta tras las primeras filas en orden del índice.
+                # Las subconsultas y las tablas virtuales (la de búsqueda) no son tablas de la base de datos.
+                limitada = re.search(r'\bLIMIT\b', sql)
+                for *_, paso in cursor.fetchall():
+                    if paso.startswith('SCAN ') and not paso.startswith('SCAN (') and 'VIRTUAL TABLE' not in paso \
+                            and not (limitada and ' INDEX' in paso):
+                        yield paso
+            else:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                pendientes = [plan[0]['Plan']]
+                while pendientes:
+                    nodo = pendientes.pop()
+                    if nodo['Node Type'] == 'Seq Scan':
+                        yield f'Seq Scan on {nodo["Relation Name"]}'
+                    pendientes.extend(nodo.get('Plans', ()))
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import statistics
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from tienda.models import Producto
+
+from ._rutas import RUTAS, cliente_http, datos_existentes, url
+
+# Páginas que tienen versión asíncrona en vistas_async.py
+RUTAS_ASYNC = ('compra', 'buscar', 'checkout', 'top_productos', 'top_clientes', 'historial')
+
+
+def urlconf(asincronas):
+    """Módulo de URLs completo (como main/urls.py) con las vistas síncronas o las asíncronas."""
+    from main import urls as urls_main
+    modulo = types.ModuleType(f'bench_asgi_urls_{"async" if asincronas else "sync"}')
+    modulo.urlpatterns = urls_main.patrones(asincronas)
+    return modulo
+
+
+class Command(BaseCommand):
+    help = ('Compara cuántas conexiones simultáneas atiende la tienda servida con ASGI (vistas asíncronas) '
+            'y con WSGI (vistas síncronas en un número fijo de hilos, como gunicorn --threads). Los clientes '
+            'piden las páginas que tienen versión asíncrona sin pausa entre peticiones; la latencia incluye '
+            'la espera por un hilo libre. --latencia-ms simula una base de datos en otra máquina.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=10, help='Duración de cada medida')
+        parser.add_argument('--conexiones', type=int, default=50, help='Clientes simultáneos')
+        parser.add_argument('--hilos', type=int, default=4, help='Hilos del servidor WSGI')
+        parser.add_argument('--latencia-ms', type=float, default=0,
+                            help='Espera añadida a cada consulta, como la ida y vuelta a un servidor remoto')
+        parser.add_argument('--rutas', help='Nombres de URL a pedir separados por comas (por defecto, '
+                                            'las que tienen versión asíncrona)')
+
+    def handle(self, *args, **options):
+        if not Producto.objects.exists():
+            raise CommandError('No hay productos: genere antes un conjunto de datos con generar_datos')
+        nombres = options['rutas'].split(',') if options['rutas'] else RUTAS_ASYNC
+        # Las peticiones confirman sus transacciones: sólo las rutas que no escriben
+        rutas = [ruta for ruta in RUTAS if ruta.nombre in nombres and not ruta.modifica]
+        latencia = options['latencia_ms'] / 1000
+
+        def simular_latencia(execute, sql, params, many, context):
+            time.sleep(latencia)
+            return execute(sql, params, many, context)
+
+        def al_conectar(sender, connection, **kwargs):
+            connection.execute_wrappers.append(simular_latencia)
+
+        if latencia:
+            connection_created.connect(al_conectar)
+        datos = datos_existentes(DEFAULT_DB_ALIAS)
+        informes = []
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                cookie = cliente_http(datos).cookies[settings.SESSION_COOKIE_NAME].value
+                cabecera = f'{settings.SESSION_COOKIE_NAME}={cookie}'
+                peticiones = [url(ruta, datos) for ruta in rutas]
+                # Las conexiones abiertas antes no llevan la latencia simulada
+                connections.close_all()
+                with override_settings(ROOT_URLCONF=urlconf(False)):
+                    informes.append(('WSGI', self.medir_wsgi(peticiones, cabecera, options)))
+                with override_settings(ROOT_URLCONF=urlconf(True)):
+                    informes.append(('ASGI', self.medir_asgi(peticiones, cabecera, options)))
+        finally:
+            connection_created.disconnect(al_conectar)
+            connections.close_all()
+            User.objects.filter(pk=datos['user'].pk).delete()
+
+        self.stdout.write(f'{options["conexiones"]} conexiones simultáneas, latencia simulada '
+                          f'{options["latencia_ms"]:g}ms, {len(rutas)} rutas')
+        for nombre, informe in informes:
+            errores = f', {informe["errores"]} errores' if informe['errores'] else ''
+            self.stdout.write(f'  {nombre}: {informe["peticiones_por_segundo"]:8.1f} peticiones/s  '
+                              f'p50 {informe["p50_ms"]:8.2f}ms  p95 {informe["p95_ms"]:8.2f}ms{errores}')
+        (_, wsgi), (_, asgi) = informes
+        if wsgi['peticiones_por_segundo']:
+            cambio = asgi['peticiones_por_segundo'] / wsgi['peticiones_por_segundo'] - 1
+            self.stdout.write(self.style.SUCCESS(f'ASGI frente a WSGI ({options["hilos"]} hilos): {cambio:+.1%}'))
+
+    def medir_wsgi(self, peticiones, cabecera, options):
+        manejador = WSGIHandler()
+        fabrica = RequestFactory(HTTP_COOKIE=cabecera)
+        entornos = [fabrica.get(direccion, parametros).environ for direccion, parametros in peticiones]
+
+        def pedir(entorno):
+            estado = []
+            entorno = dict(entorno, **{'wsgi.input': io.BytesIO(b'')})
+            respuesta = manejador(entorno, lambda status, headers, exc_info=None: estado.append(status))
+            try:
+                for _ in respuesta:
+                    pass
+            finally:
+                respuesta.close()
+            return int(estado[0].split()[0])
+
+        with ThreadPoolExecutor(options['hilos']) as grupo:
+            bucle = asyncio.new_event_loop()
+
+            async def pedir_en_hilo(entorno):
+                return await bucle.run_in_executor(grupo, pedir, entorno)
+
+            try:
+                informe = bucle.run_until_complete(self.cargar(pedir_en_hilo, entornos, options))
+            finally:
+                bucle.close()
+        return informe
+
+    def medir_asgi(self, peticiones, cabecera, options):
+        manejador = ASGIHandler()
+        ambitos = [{
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': direccion, 'raw_path': direccion.encode(), 'query_string': urlencode(parametros).encode(),
+            'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(b'host', b'testserver'), (b'cookie', cabecera.encode())],
+        } for direccion, parametros in peticiones]
+
+        async def recibir():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def pedir(ambito):
+            estado = []
+
+            async def enviar(mensaje):
+                if mensaje['type'] == 'http.response.start':
+                    estado.append(mensaje['status'])
+
+            await manejador(dict(ambito), recibir, enviar)
+            return estado[0]
+
+        return asyncio.run(self.cargar(pedir, ambitos, options))
+
+    async def cargar(self, pedir, peticiones, options):
+        # Una vuelta sin medir para cargar cachés y plantillas
+        for peticion in peticiones:
+            await pedir(peticion)
+        tiempos, errores = [], 0
+        fin = time.perf_counter() + options['segundos']
+
+        async def cliente(desplazamiento):
+            nonlocal errores
+            i = desplazamiento
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                if await pedir(peticiones[i % len(peticiones)]) != 200:
+                    errores += 1
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+                i += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente(i) for i in range(options['conexiones'])))
+        duracion = time.perf_counter() - inicio
+        percentiles = statistics.quantiles(tiempos, n=20) if len(tiempos) > 1 else tiempos * 19 or [0] * 19
+        return {
+            'peticiones': len(tiempos),
+            'errores': errores,
+            'peticiones_por_segundo': round(len(tiempos) / duracion, 1),
+            'p50_ms': round(percentiles[9], 3),
+            'p95_ms': round(percentiles[18], 3),
+        }
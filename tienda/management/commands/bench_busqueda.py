@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from tienda.autocompletar import IndicePrefijos, construir
+from tienda.busqueda import obtener_backend
+from tienda.models import Marca, Producto
+
+PALABRAS = ['portatil', 'monitor', 'teclado', 'raton', 'altavoz', 'auricular', 'tablet', 'movil', 'camara',
+            'impresora', 'router', 'disco', 'memoria', 'cargador', 'funda', 'cable', 'pantalla', 'consola',
+            'mando', 'reloj', 'pro', 'max', 'mini', 'ultra', 'gaming', 'inalambrico', 'negro', 'blanco']
+
+
+class Command(BaseCommand):
+    help = ('Mide la latencia del motor de búsqueda y de las sugerencias del buscador (índice en memoria '
+            'de autocompletar.py) sobre un catálogo sintético. Los datos se crean dentro de una transacción '
+            'que se deshace al terminar.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=100_000)
+        parser.add_argument('--marcas', type=int, default=200)
+        parser.add_argument('--consultas', type=int, default=500)
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        azar = random.Random(options['semilla'])
+        backend = obtener_backend(alias)
+        self.stdout.write(f'Motor: {connections[alias].vendor} ({type(backend).__name__})')
+
+        with transaction.atomic(using=alias):
+            inicio = time.perf_counter()
+            marcas = Marca.objects.using(alias).bulk_create(
+                [Marca(nombre=f'bench-marca-{i}') for i in range(options['marcas'])])
+            lote = []
+            for i in range(options['productos']):
+                marca = azar.choice(marcas)
+                lote.append(Producto(marca=marca, marca_nombre=marca.nombre,
+                                     nombre=' '.join(azar.sample(PALABRAS, 3)), modelo=f'B{i}X',
+                                     unidades=azar.randint(0, 100),
+                                     precio=azar.randint(1, 2000)))
+                if len(lote) == 5000:
+                    Producto.objects.using(alias).bulk_create(lote)
+                    lote = []
+            Producto.objects.using(alias).bulk_create(lote)
+            backend.reconstruir()
+            self.stdout.write(f'Carga e indexado: {time.perf_counter() - inicio:.1f}s')
+
+            textos = [' '.join(palabra[:azar.randint(3, len(palabra))]
+                               for palabra in azar.sample(PALABRAS, azar.randint(1, 2)))
+                      for _ in range(options['consultas'])]
+            self.informe('Búsqueda', self.medir(backend.buscar, textos), options)
+
+            maximo = Producto.objects.using(alias).count()
+            inicio = time.perf_counter()
+            construir(IndicePrefijos(maximo), None, alias)
+            duracion = time.perf_counter() - inicio
+            # Otra vez para medir la memoria: con tracemalloc activo la construcción es más lenta
+            tracemalloc.start()
+            indice = IndicePrefijos(maximo)
+            construir(indice, None, alias)
+            memoria = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self.stdout.write(f'Índice de sugerencias: {len(indice.palabras)} entradas en {duracion:.1f}s, '
+                              f'{memoria / 2 ** 20:.1f} MiB ({memoria / len(indice.productos):.0f} bytes/producto)')
+            # Lo que se envía mientras se escribe: prefijos de una o dos palabras
+            prefijos = [texto[:azar.randint(1, len(texto))] for texto in textos]
+            self.informe('Sugerencias', self.medir(indice.sugerir, prefijos), options)
+            transaction.set_rollback(True, using=alias)
+
+    @staticmethod
+    def medir(funcion, textos):
+        tiempos = []
+        for texto in textos:
+            inicio = time.perf_counter()
+            funcion(texto)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return sorted(tiempos)
+
+    def informe(self, nombre, tiempos, options):
+        percentil = lambda p: tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))]
+        self.stdout.write(f'{nombre}: {len(tiempos)} consultas sobre {options["productos"]} productos: '
+                          f'media {statistics.mean(tiempos):.3f}ms, p50 {percentil(0.50):.3f}ms, '
+                          f'p95 {percentil(0.95):.3f}ms, p99 {percentil(0.99):.3f}ms')
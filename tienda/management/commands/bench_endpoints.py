@@ -0,0 +1,121 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from tienda.middleware import Registro
+from tienda.models import Compra, Producto
+
+from ._rutas import RUTAS, aislada, cliente_http, datos_existentes, pedir, url
+
+
+class Command(BaseCommand):
+    help = ('Pide cada página de la tienda varias veces con el cliente de pruebas sobre los datos actuales '
+            '(ver generar_datos) y mide latencia p50/p95/p99, consultas y pico de memoria por página. '
+            'Con --salida guarda los resultados en JSON; con --comparar falla si empeoran respecto a otro JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=50)
+        parser.add_argument('--calentamiento', type=int, default=3,
+                            help='Peticiones descartadas antes de medir (cargan cachés y plantillas)')
+        parser.add_argument('--salida', help='Fichero JSON donde guardar los resultados')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior contra el que comparar')
+        parser.add_argument('--rutas', help='Nombres de URL a medir separados por comas (por defecto, todas)')
+        parser.add_argument('--tolerancia', type=float, default=0.25,
+                            help='Empeoramiento relativo de p50 admitido al comparar (0.25 = 25%%)')
+        parser.add_argument('--margen-ms', type=float, default=2.0,
+                            help='Empeoramiento absoluto de p50 por debajo del cual se considera ruido')
+
+    def handle(self, *args, **options):
+        if not Producto.objects.exists():
+            raise CommandError('No hay productos: genere antes un conjunto de datos con generar_datos')
+        resultados = []
+        with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            # El usuario de staff para las páginas con login se deshace al terminar
+            datos = datos_existentes(DEFAULT_DB_ALIAS)
+            cliente = cliente_http(datos)
+            nombres = options['rutas'].split(',') if options['rutas'] else None
+            for ruta in RUTAS:
+                if nombres and ruta.nombre not in nombres:
+                    continue
+                resultados.append(self.medir(cliente, ruta, datos, options))
+                fila = resultados[-1]
+                self.stdout.write(f'{fila["ruta"]:<60} {fila["estado"]} p50 {fila["p50_ms"]:7.2f}ms  '
+                                  f'p95 {fila["p95_ms"]:7.2f}ms  p99 {fila["p99_ms"]:7.2f}ms  '
+                                  f'{fila["consultas"]:>3} consultas  {fila["memoria_kb"]:>8.0f}KB')
+            transaction.set_rollback(True)
+
+        informe = {
+            'fecha': timezone.now().isoformat(),
+            'motor': connection.vendor,
+            'python': platform.python_version(),
+            'repeticiones': options['repeticiones'],
+            'datos': {'productos': Producto.objects.count(), 'compras': Compra.objects.count()},
+            'rutas': resultados,
+        }
+        if options['salida']:
+            with open(options['salida'], 'w') as fichero:
+                json.dump(informe, fichero, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Resultados guardados en {options["salida"]}')
+        if options['comparar']:
+            self.comparar(informe, options['comparar'], options['tolerancia'], options['margen_ms'])
+
+    def medir(self, cliente, ruta, datos, options):
+        for _ in range(options['calentamiento']):
+            with aislada(cliente, ruta):
+                pedir(cliente, ruta, datos)
+        tiempos = []
+        for _ in range(options['repeticiones']):
+            registro = Registro()
+            # Deshacer lo escrito queda fuera de la medida y de las consultas contadas
+            with aislada(cliente, ruta), connection.execute_wrapper(registro):
+                inicio = time.perf_counter()
+                respuesta = pedir(cliente, ruta, datos)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+        # La memoria se mide aparte: tracemalloc ralentiza la ejecución y falsearía las latencias
+        with aislada(cliente, ruta):
+            tracemalloc.start()
+            try:
+                pedir(cliente, ruta, datos)
+                pico = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        percentiles = statistics.quantiles(tiempos, n=100, method='inclusive') if len(tiempos) > 1 else tiempos * 99
+        direccion, parametros = url(ruta, datos)
+        return {
+            'ruta': ruta.etiqueta,
+            'url': direccion,
+            'estado': respuesta.status_code,
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'consultas': registro.consultas,
+            'memoria_kb': round(pico / 1024, 1),
+        }
+
+    def comparar(self, informe, fichero, tolerancia, margen_ms):
+        """Compara la mediana, que es estable entre ejecuciones; p95 y p99 oscilan demasiado
+        con la carga de la máquina para decidir sobre ellos."""
+        with open(fichero) as entrada:
+            base = {fila['ruta']: fila for fila in json.load(entrada)['rutas']}
+        regresiones = 0
+        self.stdout.write(f'Comparación con {fichero}:')
+        for fila in informe['rutas']:
+            anterior = base.get(fila['ruta'])
+            if anterior is None:
+                continue
+            diferencia = fila['p50_ms'] - anterior['p50_ms']
+            cambio = diferencia / anterior['p50_ms'] if anterior['p50_ms'] else 0
+            peor = cambio > tolerancia and diferencia > margen_ms or fila['consultas'] > anterior['consultas']
+            regresiones += peor
+            estado = self.style.ERROR('PEOR') if peor else self.style.SUCCESS('OK')
+            self.stdout.write(f'  {fila["ruta"]:<60} p50 {cambio:+7.1%}  consultas {anterior["consultas"]:>3} -> '
+                              f'{fila["consultas"]:<3} {estado}')
+        if regresiones:
+            raise CommandError(f'{regresiones} páginas empeoran respecto a {fichero}')
@@ -0,0 +1,144 @@
+import io
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from tienda.models import Compra, Producto
+
+from ._rutas import RUTAS, cliente_http, datos_existentes, url
+
+# La exportación descarga el histórico entero: dominaría la medida y no es tráfico de navegación
+EXCLUIDAS = ('exportar_compras',)
+
+
+class Command(BaseCommand):
+    help = ('Mide peticiones por segundo de la tienda pasando por el manejador WSGI completo (señales de '
+            'inicio y fin de petición incluidas, así que cuenta la apertura de conexiones) con los ajustes '
+            'activos. Para comparar perfiles se ejecuta una vez con cada uno sobre la misma base de datos:\n'
+            '  DJANGO_SETTINGS_MODULE=config.settings.base manage.py bench_rps --salida base.json\n'
+            '  DJANGO_SETTINGS_MODULE=config.settings.production manage.py bench_rps --comparar base.json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=10, help='Duración de la medida')
+        parser.add_argument('--hilos', type=int, default=1, help='Peticiones simultáneas')
+        parser.add_argument('--rutas', help='Nombres de URL a pedir separados por comas (por defecto, todas '
+                                            'menos la exportación)')
+        parser.add_argument('--salida', help='Fichero JSON donde guardar los resultados')
+        parser.add_argument('--comparar', help='JSON de otra ejecución (p. ej. con otros ajustes) para comparar')
+
+    def handle(self, *args, **options):
+        if not Producto.objects.exists():
+            raise CommandError('No hay productos: genere antes un conjunto de datos con generar_datos')
+        nombres = options['rutas'].split(',') if options['rutas'] else None
+        # Sólo las que no escriben: aquí cada petición confirma su transacción y no se puede deshacer
+        rutas = [ruta for ruta in RUTAS if not ruta.modifica and (ruta.nombre in nombres if nombres
+                                                                   else ruta.nombre not in EXCLUIDAS)]
+        # Las peticiones pasan por sus propias conexiones y transacciones: el usuario de staff
+        # se crea de verdad y se borra al terminar (con su cliente y su sesión)
+        datos = datos_existentes(DEFAULT_DB_ALIAS)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                cookie = cliente_http(datos).cookies[settings.SESSION_COOKIE_NAME].value
+                fabrica = RequestFactory(HTTP_COOKIE=f'{settings.SESSION_COOKIE_NAME}={cookie}')
+                entornos = [(ruta, (RequestFactory() if ruta.anonima else fabrica).get(*url(ruta, datos)).environ)
+                            for ruta in rutas]
+                informe = self.medir(WSGIHandler(), entornos, options['segundos'], options['hilos'])
+        finally:
+            User.objects.filter(pk=datos['user'].pk).delete()
+
+        informe.update({
+            'fecha': timezone.now().isoformat(),
+            'ajustes': settings.SETTINGS_MODULE,
+            'motor': connections[DEFAULT_DB_ALIAS].vendor,
+            'hilos': options['hilos'],
+            'datos': {'productos': Producto.objects.count(), 'compras': Compra.objects.count()},
+        })
+        for fila in informe['rutas']:
+            self.stdout.write(f'{fila["ruta"]:<60} {fila["estado"]} {fila["peticiones"]:>6} peticiones  '
+                              f'p50 {fila["p50_ms"]:7.2f}ms')
+        self.stdout.write(self.style.SUCCESS(
+            f'{settings.SETTINGS_MODULE}: {informe["peticiones_por_segundo"]:.1f} peticiones/s '
+            f'({informe["peticiones"]} en {informe["segundos"]:.1f}s, {options["hilos"]} hilos)'))
+        if options['salida']:
+            with open(options['salida'], 'w') as fichero:
+                json.dump(informe, fichero, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Resultados guardados en {options["salida"]}')
+        if options['comparar']:
+            self.comparar(informe, options['comparar'])
+
+    def medir(self, manejador, entornos, segundos, hilos):
+        def pedir(entorno):
+            estado = []
+            entorno = dict(entorno, **{'wsgi.input': io.BytesIO(b'')})
+            respuesta = manejador(entorno, lambda status, headers, exc_info=None: estado.append(status))
+            try:
+                for _ in respuesta:
+                    pass
+            finally:
+                # Lanza request_finished: cierra o conserva la conexión según CONN_MAX_AGE
+                respuesta.close()
+            return int(estado[0].split()[0])
+
+        # Una vuelta sin medir para cargar cachés y plantillas, igual con cualquier perfil
+        estados = [pedir(entorno) for _, entorno in entornos]
+        tiempos = [[] for _ in entornos]
+        cerrojo = threading.Lock()
+        fin = time.perf_counter() + segundos
+
+        def trabajar(desplazamiento):
+            propios = [[] for _ in entornos]
+            i = desplazamiento
+            while time.perf_counter() < fin:
+                indice = i % len(entornos)
+                inicio = time.perf_counter()
+                pedir(entornos[indice][1])
+                propios[indice].append((time.perf_counter() - inicio) * 1000)
+                i += 1
+            with cerrojo:
+                for indice, lista in enumerate(propios):
+                    tiempos[indice] += lista
+            if hilos > 1:
+                connections.close_all()
+
+        inicio = time.perf_counter()
+        if hilos == 1:
+            trabajar(0)
+        else:
+            with ThreadPoolExecutor(hilos) as grupo:
+                list(grupo.map(trabajar, range(hilos)))
+        duracion = time.perf_counter() - inicio
+        total = sum(len(lista) for lista in tiempos)
+        return {
+            'peticiones': total,
+            'segundos': round(duracion, 2),
+            'peticiones_por_segundo': round(total / duracion, 1),
+            'rutas': [{'ruta': ruta.etiqueta, 'estado': estado,
+                       'peticiones': len(lista), 'p50_ms': round(statistics.median(lista), 3) if lista else 0}
+                      for (ruta, _), estado, lista in zip(entornos, estados, tiempos)],
+        }
+
+    def comparar(self, informe, fichero):
+        with open(fichero) as entrada:
+            base = json.load(entrada)
+        anteriores = {fila['ruta']: fila for fila in base['rutas']}
+        self.stdout.write(f'Comparación con {fichero} ({base["ajustes"]}):')
+        for fila in informe['rutas']:
+            anterior = anteriores.get(fila['ruta'])
+            if anterior and anterior['p50_ms']:
+                self.stdout.write(f'  {fila["ruta"]:<60} p50 {anterior["p50_ms"]:7.2f}ms -> {fila["p50_ms"]:7.2f}ms '
+                                  f'({fila["p50_ms"] / anterior["p50_ms"] - 1:+.1%})')
+        cambio = informe['peticiones_por_segundo'] / base['peticiones_por_segundo'] - 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Peticiones/s: {base["peticiones_por_segundo"]:.1f} ({base["ajustes"]}) -> '
+            f'{informe["peticiones_por_segundo"]:.1f} ({informe["ajustes"]}), {cambio:+.1%}'))
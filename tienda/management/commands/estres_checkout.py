@@ -0,0 +1,110 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.models import Sum
+
+from tienda.compras import StockInsuficiente, realizar_compra
+from tienda.models import Cliente, Compra, Marca, Producto, VentasProducto
+
+
+class Command(BaseCommand):
+    help = ('Lanza compras concurrentes contra un mismo producto y comprueba que no se vende más '
+            'stock del que hay y que el saldo cuadra con las compras. Crea y borra sus propios datos; '
+            'no lo ejecute contra la base de datos de producción.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compras', type=int, default=200, help='Intentos de compra por ronda')
+        parser.add_argument('--stock', type=int, help='Stock inicial (por defecto, 3/4 de las compras)')
+        parser.add_argument('--hilos', default='1,8,32', help='Lista de hilos concurrentes por ronda')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        hilos = [int(valor) for valor in options['hilos'].split(',')]
+        stock = options['stock'] if options['stock'] is not None else options['compras'] * 3 // 4
+        fallos = 0
+        for n in hilos:
+            fallos += self.ronda(n, options['compras'], stock, options['database'])
+        if fallos:
+            raise CommandError(f'{fallos} invariantes incumplidos')
+
+    def ronda(self, hilos, compras, stock, using):
+        etiqueta = uuid.uuid4().hex[:8]
+        marca = Marca.objects.using(using).create(nombre=f'estres-{etiqueta}')
+        producto = Producto.objects.using(using).create(marca=marca, nombre='Estrés', modelo=etiqueta,
+                                                        unidades=stock, precio=Decimal('9.99'))
+        user = User.objects.db_manager(using).create_user(f'estres-{etiqueta}')
+        saldo_inicial = Decimal('100000.00')
+        cliente = Cliente.objects.using(using).create(user=user, saldo=saldo_inicial)
+        resultados = {'ok': 0, 'sin_stock': 0, 'errores': 0}
+        cerrojo = threading.Lock()
+
+        pendientes = iter(range(compras))
+
+        def comprar():
+            try:
+                realizar_compra(cliente, producto.pk, 1, using)
+                clave = 'ok'
+            except StockInsuficiente:
+                clave = 'sin_stock'
+            except OperationalError:
+                clave = 'errores'
+            with cerrojo:
+                resultados[clave] += 1
+
+        def trabajar():
+            # Cada hilo reparte las compras con los demás y reutiliza su conexión; la cierra al
+            # terminar pase lo que pase, como cola.trabajar
+            try:
+                while True:
+                    with cerrojo:
+                        if next(pendientes, None) is None:
+                            return
+                    comprar()
+            finally:
+                connections[using].close()
+
+        try:
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=hilos) as pool:
+                for hilo in [pool.submit(trabajar) for _ in range(hilos)]:
+                    hilo.result()
+            duracion = time.perf_counter() - inicio
+            fallos = self.comprobar(producto, cliente, stock, saldo_inicial, resultados, using)
+            self.stdout.write(
+                f'{hilos:>3} hilos: {compras / duracion:8.1f} compras/s  '
+                f'ok={resultados["ok"]} sin_stock={resultados["sin_stock"]} errores={resultados["errores"]}  '
+                + (self.style.SUCCESS('invariantes OK') if not fallos else self.style.ERROR(f'{fallos} fallos')))
+            return fallos
+        finally:
+            Compra.objects.using(using).filter(producto=producto).delete()
+            producto.delete()
+            marca.delete()
+            user.delete()
+
+    def comprobar(self, producto, cliente, stock, saldo_inicial, resultados, using):
+        producto.refresh_from_db(using=using)
+        cliente.refresh_from_db(using=using)
+        compras = Compra.objects.using(using).filter(producto=producto)
+        vendidas = compras.aggregate(total=Sum('unidades'))['total'] or 0
+        gastado = compras.aggregate(total=Sum('importe'))['total'] or 0
+        venta = VentasProducto.objects.using(using).filter(producto=producto).first()
+        comprobaciones = [
+            ('stock no negativo', producto.unidades >= 0),
+            ('stock + vendidas = stock inicial', producto.unidades + vendidas == stock),
+            ('no se vende más de lo que hay', vendidas <= stock),
+            ('compras registradas = compras con éxito', compras.count() == resultados['ok']),
+            ('saldo = inicial - importe comprado', cliente.saldo == saldo_inicial - gastado),
+            ('agregado = unidades vendidas', (venta.unidades if venta else 0) == vendidas),
+        ]
+        fallos = 0
+        for descripcion, correcto in comprobaciones:
+            if not correcto:
+                fallos += 1
+                self.stderr.write(f'  incumplido: {descripcion}')
+        return fallos
@@ -0,0 +1,102 @@
+import datetime
+import itertools
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from tienda import cache_catalogo
+from tienda.models import Cliente, Comentario, Compra, Marca, Producto
+
+from .bench_busqueda import PALABRAS
+
+COMENTARIOS = ['Muy buen producto', 'Llegó tarde', 'Calidad precio correcta', 'No lo recomiendo',
+               'Cumple lo prometido', 'Mejor de lo esperado', 'Se rompió al mes', 'Perfecto para regalar']
+
+
+class Command(BaseCommand):
+    help = ('Genera un conjunto de datos sintético (marcas, productos, clientes, compras y comentarios) con '
+            'bulk_create y una semilla fija, y reconstruye después índice de búsqueda, agregados y valoraciones. '
+            'Los datos se quedan en la base de datos: no lo ejecute contra la de producción.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--marcas', type=int, default=100)
+        parser.add_argument('--productos', type=int, default=10_000)
+        parser.add_argument('--clientes', type=int, default=2_000)
+        parser.add_argument('--compras', type=int, default=100_000)
+        parser.add_argument('--comentarios', type=int, default=20_000)
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--lote', type=int, default=5000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        self.lote = options['lote']
+        azar = random.Random(options['semilla'])
+        prefijo = f'gen{options["semilla"]}'
+        if Marca.objects.using(using).filter(nombre__startswith=f'{prefijo}-').exists():
+            raise CommandError(f'Ya hay datos generados con la semilla {options["semilla"]}')
+        if options['productos'] and not options['marcas'] or options['compras'] and not options['clientes']:
+            raise CommandError('Hacen falta marcas para crear productos y clientes para crear compras')
+
+        inicio = time.perf_counter()
+        with transaction.atomic(using=using):
+            marcas = Marca.objects.using(using).bulk_create(
+                [Marca(nombre=f'{prefijo}-{i}') for i in range(options['marcas'])])
+            # bulk_create no pasa por la señal que copia el nombre de la marca en el producto
+            productos = self.crear(Producto, using, (
+                Producto(marca=marca, marca_nombre=marca.nombre, nombre=' '.join(azar.sample(PALABRAS, 3)),
+                         modelo=f'{prefijo}-{i}', unidades=azar.choice((0, azar.randint(1, 500))),
+                         vip=azar.random() < 0.05,
+                         precio=Decimal(azar.lognormvariate(4, 1.2)).quantize(Decimal('0.01')) + 1)
+                for i, marca in ((i, azar.choice(marcas)) for i in range(options['productos']))))
+            # Todos los usuarios comparten contraseña ("tienda"): se calcula el hash una sola vez
+            clave = make_password('tienda')
+            usuarios = self.crear(User, using, (User(username=f'{prefijo}-{i}', password=clave)
+                                                for i in range(options['clientes'])))
+            clientes = self.crear(Cliente, using, (Cliente(user=user, saldo=Decimal(azar.randint(0, 5000)),
+                                                           vip=azar.random() < 0.1) for user in usuarios))
+            # Popularidad con cola larga: el producto de rango k se elige con peso 1/(k+1)
+            pesos = list(itertools.accumulate(1 / (k + 1) for k in range(len(productos))))
+            ahora = timezone.now()
+            self.crear(Compra, using, (
+                self.compra(producto, azar.choice(clientes), azar, ahora)
+                for producto in (azar.choices(productos, cum_weights=pesos)[0] for _ in range(options['compras']))),
+                devolver=False)
+            self.crear(Comentario, using, (
+                Comentario(producto=azar.choices(productos, cum_weights=pesos)[0], valoracion=azar.randint(1, 5),
+                           comentario=azar.choice(COMENTARIOS))
+                for _ in range(options['comentarios'])), devolver=False)
+            self.stdout.write(f'Datos creados en {time.perf_counter() - inicio:.1f}s')
+
+            # Estructuras derivadas, igual que tras una carga real
+            for comando in ('reindexar_busqueda', 'agregados_ventas', 'recalcular_valoraciones'):
+                call_command(comando, database=using, stdout=self.stdout)
+            cache_catalogo.invalidar_catalogo()
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(marcas)} marcas, {len(productos)} productos, {len(clientes)} clientes, '
+            f'{options["compras"]} compras y {options["comentarios"]} comentarios '
+            f'en {time.perf_counter() - inicio:.1f}s'))
+
+    def crear(self, modelo, using, objetos, devolver=True):
+        """bulk_create por lotes; con devolver=False no se guardan los objetos creados en memoria."""
+        creados = []
+        objetos = iter(objetos)
+        while lote := list(itertools.islice(objetos, self.lote)):
+            lote = modelo.objects.using(using).bulk_create(lote)
+            if devolver:
+                creados += lote
+        return creados
+
+    @staticmethod
+    def compra(producto, cliente, azar, ahora):
+        unidades = azar.choices((1, 2, 3, 5), weights=(70, 20, 7, 3))[0]
+        fecha = ahora - datetime.timedelta(seconds=azar.uniform(0, 365 * 24 * 3600))
+        return Compra(producto=producto, user=cliente, unidades=unidades, importe=unidades * producto.precio,
+                      fecha=fecha)
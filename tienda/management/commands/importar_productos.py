@@ -0,0 +1,48 @@
+import csv
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from tienda.importar import LECTORES, LOTE, obtener_importador
+
+
+class Command(BaseCommand):
+    help = ('Importa productos desde un fichero CSV o JSONL (columnas marca, modelo, nombre, unidades, precio '
+            'y opcionalmente vip) creando o actualizando por (marca, modelo). Con --solo-cambios sólo se '
+            'aplican precio y unidades a productos que ya existen. Las filas no válidas se informan y se omiten.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichero', help='Ruta del fichero, o "-" para leer de la entrada estándar')
+        parser.add_argument('--formato', choices=sorted(LECTORES), help='Por defecto, según la extensión')
+        parser.add_argument('--solo-cambios', action='store_true')
+        parser.add_argument('--lote', type=int, default=LOTE)
+        parser.add_argument('--rechazados', help='Fichero CSV donde guardar las filas rechazadas y el motivo')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or os.path.splitext(options['fichero'])[1].lstrip('.').lower()
+        if formato not in LECTORES:
+            raise CommandError('Indique --formato csv o jsonl')
+        importador = obtener_importador(options['database'], solo_cambios=options['solo_cambios'],
+                                        lote=options['lote'])
+        if options['fichero'] == '-':
+            resultado = importador.importar(LECTORES[formato](sys.stdin), self.progreso)
+        else:
+            with open(options['fichero'], newline='', encoding='utf-8-sig') as fichero:
+                resultado = importador.importar(LECTORES[formato](fichero), self.progreso)
+
+        for numero, motivo in resultado.rechazos[:20]:
+            self.stderr.write(f'  fila {numero}: {motivo}')
+        if len(resultado.rechazos) > 20:
+            self.stderr.write(f'  ... y {len(resultado.rechazos) - 20} más')
+        if options['rechazados'] and resultado.rechazos:
+            with open(options['rechazados'], 'w', newline='', encoding='utf-8') as salida:
+                escritor = csv.writer(salida)
+                escritor.writerow(['fila', 'motivo'])
+                escritor.writerows(sorted(resultado.rechazos))
+        self.stdout.write(self.style.SUCCESS(f'Importación terminada: {resultado.resumen()}'))
+
+    def progreso(self, resultado):
+        self.stdout.write(resultado.resumen())
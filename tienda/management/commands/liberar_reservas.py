@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from tienda.reservas import LOTE, liberar_caducadas
+
+
+class Command(BaseCommand):
+    help = ('Devuelve al stock las unidades de las reservas de carrito caducadas (ver tienda/reservas.py), '
+            'por lotes. Pensado para cron cada minuto o, con --intervalo, para quedarse en marcha.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=LOTE, help='Reservas liberadas por transacción')
+        parser.add_argument('--intervalo', type=float,
+                            help='Segundos entre barridos; sin él se hace uno solo y se sale')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        while True:
+            liberadas = liberar_caducadas(options['lote'], options['database'])
+            self.stdout.write(f'{liberadas} unidades liberadas')
+            if options['intervalo'] is None:
+                return
+            time.sleep(options['intervalo'])
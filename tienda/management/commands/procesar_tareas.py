@@ -0,0 +1,82 @@
+import json
+import multiprocessing
+import signal
+import threading
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from tienda import cola
+
+
+def parar_con_senales(parar):
+    """SIGTERM (systemd, docker stop) y SIGINT terminan la tarea en curso y salen del bucle."""
+    for senal in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(senal, lambda *args: parar.set())
+
+
+def proceso_trabajador(opciones):
+    # Con el método "spawn" el proceso hijo empieza sin Django cargado
+    django.setup()
+    parar = threading.Event()
+    parar_con_senales(parar)
+    cola.trabajar(parar, opciones['hilos'], opciones['lote'], opciones['intervalo'], opciones['una_vez'],
+                  opciones['database'])
+
+
+class Command(BaseCommand):
+    help = ('Ejecuta las tareas en segundo plano de la cola (tienda/cola.py): correos de confirmación, avisos '
+            'de stock bajo... Cada proceso reclama lotes de tareas y las ejecuta en --hilos hilos; las que '
+            'fallan se reintentan con espera exponencial hasta TIENDA_TAREAS_INTENTOS veces. Con --estado '
+            'sólo muestra la profundidad de la cola y la latencia de las últimas tareas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=4, help='Hilos por proceso')
+        parser.add_argument('--procesos', type=int, default=1,
+                            help='Procesos trabajadores (para tareas que usan CPU)')
+        parser.add_argument('--lote', type=int, help='Tareas reclamadas de una vez (por defecto, --hilos)')
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help='Segundos de espera cuando no hay tareas disponibles')
+        parser.add_argument('--una-vez', action='store_true', help='Sale cuando no quedan tareas disponibles')
+        parser.add_argument('--estado', action='store_true', help='Muestra las estadísticas de la cola y sale')
+        parser.add_argument('--purgar', type=int, metavar='DIAS',
+                            help='Borra las tareas hechas hace más de DIAS días y sale')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['estado']:
+            self.stdout.write(json.dumps(cola.estadisticas(using), indent=2))
+            return
+        if options['purgar'] is not None:
+            self.stdout.write(f'{cola.purgar(options["purgar"], using)} tareas borradas')
+            return
+        if options['procesos'] > 1:
+            self.supervisar(options)
+            return
+        parar = threading.Event()
+        parar_con_senales(parar)
+        ejecutadas = cola.trabajar(parar, options['hilos'], options['lote'], options['intervalo'],
+                                   options['una_vez'], using)
+        self.stdout.write(f'{ejecutadas} tareas ejecutadas')
+
+    def supervisar(self, options):
+        """Arranca los procesos trabajadores y les reenvía la orden de parar."""
+        # Los hijos no pueden compartir las conexiones abiertas por el padre
+        connections.close_all()
+        opciones = {clave: options[clave] for clave in ('hilos', 'lote', 'intervalo', 'una_vez', 'database')}
+        procesos = [multiprocessing.Process(target=proceso_trabajador, args=(opciones,), daemon=True)
+                    for _ in range(options['procesos'])]
+        for proceso in procesos:
+            proceso.start()
+        parar = threading.Event()
+        parar_con_senales(parar)
+        while any(proceso.is_alive() for proceso in procesos) and not parar.wait(1):
+            pass
+        for proceso in procesos:
+            if proceso.is_alive():
+                proceso.terminate()
+        for proceso in procesos:
+            proceso.join()
+        self.stdout.write(f'{len(procesos)} procesos terminados')
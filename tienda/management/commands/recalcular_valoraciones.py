@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from tienda.models import Producto
+from tienda.valoraciones import CAMPOS, calcular_resumenes, resumen_vacio
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde los comentarios el resumen de valoraciones de todos los productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            resumenes = calcular_resumenes(using)
+            # Primero se ponen a cero los productos sin comentarios, luego se escriben el resto por lotes
+            Producto.objects.using(using).exclude(pk__in=list(resumenes)).exclude(num_valoraciones=0) \
+                .update(**resumen_vacio())
+            Producto.objects.using(using).bulk_update(
+                [Producto(pk=pk, **resumen) for pk, resumen in resumenes.items()], CAMPOS,
+                batch_size=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'Valoraciones recalculadas para {len(resumenes)} productos'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from tienda.busqueda import obtener_backend
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero el índice de búsqueda de productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        backend = obtener_backend(options['database'])
+        with transaction.atomic(using=options['database']):
+            backend.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Índice reconstruido ({type(backend).__name__})'))
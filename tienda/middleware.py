@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+logger = logging.getLogger('tienda.consultas')
+
+# Código de la tienda (para localizar la línea que lanza cada consulta); todo lo demás es Django o librerías
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+_LIBRERIAS = ('site-packages', 'dist-packages', f'{os.sep}lib{os.sep}python')
+_LISTA_IN = re.compile(r'\((?:%s, )+%s\)')
+
+
+def forma(sql):
+    """La consulta sin parámetros; las listas IN se colapsan para que tamaños distintos cuenten igual."""
+    return _LISTA_IN.sub('(%s, ...)', sql)
+
+
+def origen():
+    """Nodo de plantilla y línea de código de la tienda más internos desde los que se lanzó la consulta."""
+    plantilla = linea = None
+    frame = sys._getframe(2)
+    while frame is not None and not (plantilla and linea):
+        codigo = frame.f_code
+        if plantilla is None and codigo.co_name == 'render_annotated':
+            nodo = frame.f_locals.get('self')
+            if getattr(nodo, 'token', None) is not None and getattr(nodo, 'origin', None) is not None:
+                plantilla = f'{nodo.origin.template_name}:{nodo.token.lineno}'
+        elif linea is None and codigo.co_filename.startswith(_RAIZ) \
+                and not any(ruta in codigo.co_filename for ruta in _LIBRERIAS):
+            linea = f'{os.path.relpath(codigo.co_filename, _RAIZ)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return ' <- '.join(filter(None, (linea, plantilla))) or None
+
+
+class Registro:
+    """Consultas de una petición: número, tiempo y cuántas veces se repite cada forma."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo = 0.0
+        self.formas = Counter()
+        self.origenes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tiempo += time.perf_counter() - inicio
+            self.consultas += 1
+            clave = forma(sql)
+            self.formas[clave] += 1
+            if clave not in self.origenes:
+                self.origenes[clave] = origen()
+
+    def duplicadas(self):
+        return [{'sql': clave, 'veces': veces, 'origen': self.origenes[clave]}
+                for clave, veces in self.formas.most_common() if veces > 1]
+
+
+# Acumulado por vista desde que arrancó el proceso, para la página de staff. Las rutas que no
+# resuelven (404) van todas a la misma entrada: con la ruta como clave crecería sin límite.
+SIN_RESOLVER = '<sin resolver>'
+_por_vista = defaultdict(lambda: {'peticiones': 0, 'consultas': 0, 'max_consultas': 0, 'tiempo': 0.0,
+                                  'duplicadas': Counter(), 'origenes': {}})
+_cerrojo = threading.Lock()
+
+
+def _acumular(vista, registro, duplicadas):
+    with _cerrojo:
+        datos = _por_vista[vista]
+        datos['peticiones'] += 1
+        datos['consultas'] += registro.consultas
+        datos['max_consultas'] = max(datos['max_consultas'], registro.consultas)
+        datos['tiempo'] += registro.tiempo
+        for duplicada in duplicadas:
+            datos['duplicadas'][duplicada['sql']] += duplicada['veces']
+            datos['origenes'][duplicada['sql']] = duplicada['origen']
+
+
+def peores_vistas(limite=20):
+    """Vistas ordenadas por consultas medias por petición, con sus consultas más repetidas."""
+    with _cerrojo:
+        vistas = []
+        for vista, datos in _por_vista.items():
+            peticiones = datos['peticiones']
+            vistas.append({
+                'vista': vista,
+                'peticiones': peticiones,
+                'consultas_media': round(datos['consultas'] / peticiones, 1),
+                'max_consultas': datos['max_consultas'],
+                'tiempo_medio_ms': round(datos['tiempo'] * 1000 / peticiones, 2),
+                'duplicadas': [{'sql': sql, 'veces': veces, 'origen': datos['origenes'][sql]}
+                               for sql, veces in datos['duplicadas'].most_common(5)],
+            })
+    vistas.sort(key=lambda vista: (vista['consultas_media'], vista['tiempo_medio_ms']), reverse=True)
+    return vistas[:limite]
+
+
+def reiniciar():
+    with _cerrojo:
+        _por_vista.clear()
+
+
+class PerfilConsultasMiddleware:
+    """Mide las consultas de cada petición cuando TIENDA_PERFILAR_CONSULTAS está activo.
+
+    Añade las cabeceras X-DB-Consultas, X-DB-Tiempo-ms y X-DB-Duplicadas, escribe
+    una línea JSON en el logger ``tienda.consultas`` y acumula los datos por vista.
+    Desactivado, Django lo retira de la cadena al arrancar y no cuesta nada. En las
+    respuestas en streaming sólo cuenta lo ejecutado antes de empezar a enviarlas.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TIENDA_PERFILAR_CONSULTAS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        registro = Registro()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(registro))
+            inicio = time.perf_counter()
+            response = self.get_response(request)
+            duracion = time.perf_counter() - inicio
+        duplicadas = registro.duplicadas()
+        response['X-DB-Consultas'] = str(registro.consultas)
+        response['X-DB-Tiempo-ms'] = f'{registro.tiempo * 1000:.2f}'
+        response['X-DB-Duplicadas'] = str(sum(duplicada['veces'] - 1 for duplicada in duplicadas))
+        vista = request.resolver_match.view_name if request.resolver_match else SIN_RESOLVER
+        _acumular(vista, registro, duplicadas)
+        logger.info(json.dumps({
+            'vista': vista, 'ruta': request.path, 'estado': response.status_code, 'consultas': registro.consultas,
+            'tiempo_db_ms': round(registro.tiempo * 1000, 2), 'tiempo_ms': round(duracion * 1000, 2),
+            'duplicadas': duplicadas,
+        }, ensure_ascii=False))
+        return response
+
+
+def obtener_cliente(request):
+    """Cliente del usuario de la petición (None si es anónimo o no tiene ficha), leído una sola vez."""
+    if not hasattr(request, '_cliente'):
+        from .models import Cliente
+        request._cliente = None
+        if request.user.is_authenticated:
+            request._cliente = Cliente.objects.select_related('user').filter(user_id=request.user.pk).first()
+    return request._cliente
+
+
+class ClienteMiddleware(MiddlewareMixin):
+    """Añade ``request.cliente``, que se carga la primera vez que una vista lo usa.
+
+    Como ``request.user``, es un objeto perezoso: en las páginas que no lo usan no hay
+    consulta, y en las que sí sólo una aunque se consulte varias veces. Evalúa a falso
+    si el usuario es anónimo o no tiene ficha de cliente. Con MiddlewareMixin sirve
+    también para las vistas asíncronas sin pasar la petición a un hilo.
+    """
+
+    def process_request(self, request):
+        request.cliente = SimpleLazyObject(lambda: obtener_cliente(request))
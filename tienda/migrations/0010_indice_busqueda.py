@@ -0,0 +1,62 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Tablas espejo del motor de búsqueda (ver tienda/busqueda.py). Dependen del
+# motor de base de datos, así que se crean con SQL propio de cada uno.
+
+SQLITE = [
+    "CREATE VIRTUAL TABLE tienda_producto_fts USING fts5("
+    "nombre, modelo, marca, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "INSERT INTO tienda_producto_fts (rowid, nombre, modelo, marca) "
+    "SELECT p.id, p.nombre, p.modelo, m.nombre FROM tienda_producto p "
+    "INNER JOIN tienda_marca m ON m.id = p.marca_id",
+]
+
+POSTGRESQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE tienda_producto_busqueda ("
+    "producto_id bigint PRIMARY KEY REFERENCES tienda_producto (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "documento text NOT NULL, "
+    "vector tsvector NOT NULL)",
+    "CREATE INDEX tienda_producto_busqueda_vector ON tienda_producto_busqueda USING gin (vector)",
+    "CREATE INDEX tienda_producto_busqueda_trgm ON tienda_producto_busqueda USING gin (documento gin_trgm_ops)",
+    "INSERT INTO tienda_producto_busqueda (producto_id, documento, vector) "
+    "SELECT p.id, lower(concat_ws(' ', p.nombre, p.modelo, m.nombre)), "
+    "setweight(to_tsvector('simple', p.nombre), 'A') || "
+    "setweight(to_tsvector('simple', p.modelo), 'B') || "
+    "setweight(to_tsvector('simple', m.nombre), 'C') "
+    "FROM tienda_producto p INNER JOIN tienda_marca m ON m.id = p.marca_id",
+]
+
+
+def crear_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            for sql in SQLITE:
+                schema_editor.execute(sql)
+        except OperationalError:
+            # SQLite sin FTS5: la búsqueda usará el respaldo con icontains
+            pass
+    elif vendor == 'postgresql':
+        for sql in POSTGRESQL:
+            schema_editor.execute(sql)
+
+
+def borrar_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS tienda_producto_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS tienda_producto_busqueda")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0009_producto_indices_catalogo'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
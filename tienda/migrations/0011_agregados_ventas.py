@@ -0,0 +1,62 @@
+# Generated by Django 4.1.13 on 2026-10-18 09:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def poblar_agregados(apps, schema_editor):
+    Compra = apps.get_model('tienda', 'Compra')
+    VentasProducto = apps.get_model('tienda', 'VentasProducto')
+    VentasCliente = apps.get_model('tienda', 'VentasCliente')
+    using = schema_editor.connection.alias
+    totales = dict(unidades=models.Sum('unidades'), importe=models.Sum('importe'), compras=models.Count('pk'))
+    compras = Compra.objects.using(using)
+    VentasProducto.objects.using(using).bulk_create(
+        [VentasProducto(producto_id=fila.pop('producto'), **fila)
+         for fila in compras.values('producto').annotate(**totales).order_by()], batch_size=1000)
+    VentasCliente.objects.using(using).bulk_create(
+        [VentasCliente(cliente_id=fila.pop('user'), **fila)
+         for fila in compras.values('user').annotate(**totales).order_by()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0010_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentasCliente',
+            fields=[
+                ('cliente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='tienda.cliente')),
+                ('unidades', models.BigIntegerField(default=0)),
+                ('importe', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('compras', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Ventas por cliente',
+            },
+        ),
+        migrations.CreateModel(
+            name='VentasProducto',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='tienda.producto')),
+                ('unidades', models.BigIntegerField(default=0)),
+                ('importe', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('compras', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Ventas por producto',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ventasproducto',
+            index=models.Index(fields=['-unidades', 'producto'], name='ventas_producto_unidades_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ventascliente',
+            index=models.Index(fields=['-importe', 'cliente'], name='ventas_cliente_importe_idx'),
+        ),
+        migrations.RunPython(poblar_agregados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0011_agregados_ventas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Pedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('importe', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tienda.cliente')),
+            ],
+            options={
+                'verbose_name_plural': 'Pedidos',
+            },
+        ),
+        migrations.AddField(
+            model_name='compra',
+            name='pedido',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tienda.pedido'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+def poblar_resumenes(apps, schema_editor):
+    Comentario = apps.get_model('tienda', 'Comentario')
+    Producto = apps.get_model('tienda', 'Producto')
+    using = schema_editor.connection.alias
+    resumenes = {}
+    filas = Comentario.objects.using(using).filter(valoracion__isnull=False) \
+        .values_list('producto', 'valoracion').annotate(n=models.Count('pk')).order_by()
+    for producto_id, valoracion, n in filas:
+        resumen = resumenes.setdefault(producto_id, {f'estrellas_{i}': 0 for i in range(1, 6)})
+        resumen[f'estrellas_{valoracion}'] += n
+    productos = []
+    for producto_id, resumen in resumenes.items():
+        num = sum(resumen.values())
+        media = sum(resumen[f'estrellas_{i}'] * i for i in range(1, 6)) / num
+        productos.append(Producto(pk=producto_id, num_valoraciones=num, valoracion_media=media, **resumen))
+    campos = ['num_valoraciones', 'valoracion_media'] + [f'estrellas_{i}' for i in range(1, 6)]
+    Producto.objects.using(using).bulk_update(productos, campos, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0012_pedido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='num_valoraciones',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='valoracion_media',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(poblar_resumenes, migrations.RunPython.noop),
+    ]
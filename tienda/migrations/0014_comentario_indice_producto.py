@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0013_producto_resumen_valoraciones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(fields=['producto', '-id'], name='comentario_producto_id_idx'),
+        ),
+    ]
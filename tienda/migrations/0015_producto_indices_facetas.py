@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0014_comentario_indice_producto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['marca', 'precio'], name='producto_marca_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('unidades__gt', 0)), fields=['precio'], name='producto_en_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('vip', True)), fields=['precio'], name='producto_vip_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0015_producto_indices_facetas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='compra',
+            index=models.Index(fields=['producto', '-fecha'], name='compra_producto_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='compra',
+            index=models.Index(fields=['user', '-fecha'], name='compra_cliente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', '-fecha'], name='pedido_cliente_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0017_version_catalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentasPeriodo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('dia', 'Día'), ('mes', 'Mes')], max_length=3)),
+                ('dimension', models.CharField(choices=[('producto', 'Producto'), ('marca', 'Marca'), ('cliente', 'Cliente'), ('total', 'Total')], max_length=8)),
+                ('clave', models.PositiveIntegerField()),
+                ('inicio', models.DateField()),
+                ('unidades', models.BigIntegerField(default=0)),
+                ('importe', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('compras', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Ventas por periodo',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ventasperiodo',
+            index=models.Index(fields=['periodo', 'dimension', 'inicio'], name='ventas_periodo_inicio_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ventasperiodo',
+            unique_together={('periodo', 'dimension', 'clave', 'inicio')},
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0019_tareas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('titular', models.CharField(max_length=32)),
+                ('unidades', models.PositiveIntegerField()),
+                ('caduca', models.DateTimeField()),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tienda.producto')),
+            ],
+            options={
+                'verbose_name_plural': 'Reservas',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['caduca'], name='reserva_caduca_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reserva',
+            unique_together={('titular', 'producto')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0020_reservas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='versioncatalogo',
+            index=models.Index(fields=['actualizado'], name='version_catalogo_actual_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+def copiar_nombres(apps, schema_editor):
+    Marca = apps.get_model('tienda', 'Marca')
+    Producto = apps.get_model('tienda', 'Producto')
+    using = schema_editor.connection.alias
+    nombre = Marca.objects.using(using).filter(pk=models.OuterRef('marca_id')).values('nombre')[:1]
+    Producto.objects.using(using).update(marca_nombre=models.Subquery(nombre))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0021_version_catalogo_actualizado'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='producto',
+            name='producto_marca_id_idx',
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='marca_nombre',
+            field=models.CharField(default='', editable=False, max_length=30),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copiar_nombres, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['marca_nombre', 'id'], name='producto_marca_nombre_id_idx'),
+        ),
+    ]
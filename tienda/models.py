@@ -17,18 +17,92 @@ class Marca(models.Model):
 
 class Producto(models.Model):
     marca = models.ForeignKey(Marca, on_delete=models.PROTECT)
+    # Copia de marca.nombre para ordenar el catálogo por marca con un índice (ver signals.py)
+    marca_nombre = models.CharField(max_length=30, editable=False)
     nombre = models.CharField(max_length=50)
     modelo = models.CharField(max_length=50)
     unidades = models.PositiveIntegerField()
     precio = models.DecimalField(max_digits=12, decimal_places=2)
     vip = models.BooleanField(default=False)
+    # Resumen de valoraciones, actualizado al guardar cada comentario (ver valoraciones.py)
+    num_valoraciones = models.PositiveIntegerField(default=0)
+    valoracion_media = models.FloatField(default=0)
+    estrellas_1 = models.PositiveIntegerField(default=0)
+    estrellas_2 = models.PositiveIntegerField(default=0)
+    estrellas_3 = models.PositiveIntegerField(default=0)
+    estrellas_4 = models.PositiveIntegerField(default=0)
+    estrellas_5 = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'{self.marca}{self.modelo}'
 
+    @property
+    def histograma_valoraciones(self):
+        return [(estrellas, getattr(self, f'estrellas_{estrellas}')) for estrellas in range(5, 0, -1)]
+
     class Meta:
         unique_together = ['marca', 'modelo']
         verbose_name_plural = "Productos"
+        # Índices para la paginación por cursor del catálogo (clave de orden + id)
+        indexes = [
+            models.Index(fields=['nombre', 'id'], name='producto_nombre_id_idx'),
+            models.Index(fields=['precio', 'id'], name='producto_precio_id_idx'),
+            models.Index(fields=['marca_nombre', 'id'], name='producto_marca_nombre_id_idx'),
+            # Facetas: marca + rango de precio, y los filtros VIP y con stock como índices parciales
+            models.Index(fields=['marca', 'precio'], name='producto_marca_precio_idx'),
+            models.Index(fields=['precio'], condition=models.Q(unidades__gt=0), name='producto_en_stock_idx'),
+            models.Index(fields=['precio'], condition=models.Q(vip=True), name='producto_vip_idx'),
+        ]
+
+
+# Validadores HTTP (ETag y Last-Modified) del catálogo, de cada producto y de cada marca:
+# una fila por clave ('catalogo', 'producto:<id>', 'marca:<id>') que se incrementa en la misma
+# transacción que el cambio (ver versiones.py). A diferencia de las versiones de cache_catalogo
+# no se pierden al vaciar la caché y son las mismas para todos los procesos.
+class VersionCatalogo(models.Model):
+    clave = models.CharField(max_length=40, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.clave}: {self.version}'
+
+    class Meta:
+        verbose_name_plural = "Versiones del catálogo"
+        # Cambios recientes, para poner al día el índice de autocompletar.py
+        indexes = [models.Index(fields=['actualizado'], name='version_catalogo_actual_idx')]
+
+
+# Cola de tareas en segundo plano (ver cola.py). Se insertan en la misma transacción que el
+# cambio que las origina, así que sólo existen si éste se confirma, y las ejecuta
+# manage.py procesar_tareas. ``disponible`` es cuándo puede ejecutarse: la espera del
+# reintento tras un fallo y, mientras está en curso, el fin del plazo del trabajador.
+class Tarea(models.Model):
+    PENDIENTE, EN_CURSO, HECHA, FALLIDA = 'pendiente', 'en_curso', 'hecha', 'fallida'
+    ESTADOS = [(PENDIENTE, 'Pendiente'), (EN_CURSO, 'En curso'), (HECHA, 'Hecha'), (FALLIDA, 'Fallida')]
+
+    nombre = models.CharField(max_length=60)
+    argumentos = models.JSONField(default=dict)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=5)
+    creada = models.DateTimeField(default=timezone.now)
+    disponible = models.DateTimeField(default=timezone.now)
+    iniciada = models.DateTimeField(blank=True, null=True)
+    terminada = models.DateTimeField(blank=True, null=True)
+    trabajador = models.CharField(max_length=60, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.nombre} #{self.pk} ({self.estado})'
+
+    class Meta:
+        verbose_name_plural = "Tareas"
+        indexes = [
+            # Las que toca ejecutar, y las últimas terminadas para las estadísticas
+            models.Index(fields=['estado', 'disponible'], name='tarea_estado_disponible_idx'),
+            models.Index(fields=['estado', 'terminada'], name='tarea_estado_terminada_idx'),
+        ]
 
 
 class Cliente(models.Model):
@@ -43,9 +117,42 @@ class Cliente(models.Model):
         verbose_name_plural = "Clientes"
 
 
+# Unidades apartadas para el carrito de una sesión (ver reservas.py). Se descuentan de
+# Producto.unidades al reservar, así que ``unidades`` del producto es siempre lo disponible;
+# si la reserva caduca sin comprarse, manage.py liberar_reservas las devuelve.
+class Reserva(models.Model):
+    titular = models.CharField(max_length=32)
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    unidades = models.PositiveIntegerField()
+    caduca = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.unidades} x {self.producto_id} hasta {self.caduca:%H:%M}'
+
+    class Meta:
+        verbose_name_plural = "Reservas"
+        unique_together = [('titular', 'producto')]
+        indexes = [models.Index(fields=['caduca'], name='reserva_caduca_idx')]
+
+
+# Cabecera de un pedido del carrito; cada línea es una Compra que apunta a él
+class Pedido(models.Model):
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
+    fecha = models.DateTimeField(default=timezone.now)
+    importe = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.pk} - {self.fecha}'
+
+    class Meta:
+        verbose_name_plural = "Pedidos"
+        indexes = [models.Index(fields=['cliente', '-fecha'], name='pedido_cliente_fecha_idx')]
+
+
 class Compra(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
     user = models.ForeignKey(Cliente, on_delete=models.CASCADE)
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, blank=True, null=True)
     fecha = models.DateTimeField(default=timezone.now)
     unidades = models.IntegerField()
     importe = models.DecimalField(max_digits=12, decimal_places=2)
@@ -55,8 +162,71 @@ class Compra(models.Model):
         return f'{self.user.user.username}{self.fecha}'
 
     class Meta:
+        # El índice de esta restricción empieza por fecha y es el que usa el historial ordenado por fecha
         unique_together = ['fecha', 'producto', 'user']
         verbose_name_plural = "Compras"
+        # Compras de un producto y de un cliente, de más reciente a más antigua
+        indexes = [
+            models.Index(fields=['producto', '-fecha'], name='compra_producto_fecha_idx'),
+            models.Index(fields=['user', '-fecha'], name='compra_cliente_fecha_idx'),
+        ]
+
+
+# Agregados de ventas mantenidos en la misma transacción que cada Compra
+# (ver agregados.py) para que los informes no recorran todo el histórico.
+class VentasProducto(models.Model):
+    producto = models.OneToOneField(Producto, on_delete=models.CASCADE, primary_key=True)
+    unidades = models.BigIntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    compras = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.producto_id}: {self.unidades}'
+
+    class Meta:
+        verbose_name_plural = "Ventas por producto"
+        indexes = [models.Index(fields=['-unidades', 'producto'], name='ventas_producto_unidades_idx')]
+
+
+class VentasCliente(models.Model):
+    cliente = models.OneToOneField(Cliente, on_delete=models.CASCADE, primary_key=True)
+    unidades = models.BigIntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    compras = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.cliente_id}: {self.importe}'
+
+    class Meta:
+        verbose_name_plural = "Ventas por cliente"
+        indexes = [models.Index(fields=['-importe', 'cliente'], name='ventas_cliente_importe_idx')]
+
+
+# Ventas por día y por mes de cada producto, marca y cliente, y del total de la tienda
+# (dimensión 'total', clave 0). Se mantienen igual que los agregados anteriores, en la
+# transacción de cada Compra, y los informes por rango de fechas (informes.py) leen de aquí
+# en lugar de recorrer Compra. ``clave`` es el id del producto, la marca o el cliente.
+class VentasPeriodo(models.Model):
+    DIA, MES = 'dia', 'mes'
+    PERIODOS = [(DIA, 'Día'), (MES, 'Mes')]
+    DIMENSIONES = [('producto', 'Producto'), ('marca', 'Marca'), ('cliente', 'Cliente'), ('total', 'Total')]
+
+    periodo = models.CharField(max_length=3, choices=PERIODOS)
+    dimension = models.CharField(max_length=8, choices=DIMENSIONES)
+    clave = models.PositiveIntegerField()
+    inicio = models.DateField()
+    unidades = models.BigIntegerField(default=0)
+    importe = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    compras = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.dimension} {self.clave} {self.periodo} {self.inicio}: {self.importe}'
+
+    class Meta:
+        # El índice de la restricción sirve para las series de una clave; el otro, para los rankings
+        unique_together = ['periodo', 'dimension', 'clave', 'inicio']
+        verbose_name_plural = "Ventas por periodo"
+        indexes = [models.Index(fields=['periodo', 'dimension', 'inicio'], name='ventas_periodo_inicio_idx')]
 
 
 class Comentario(models.Model):
@@ -70,6 +240,8 @@ class Comentario(models.Model):
 
     class Meta:
         verbose_name_plural = "Comentarios"
+        # Páginas de comentarios de un producto, de más reciente a más antiguo
+        indexes = [models.Index(fields=['producto', '-id'], name='comentario_producto_id_idx')]
 
 
 class Direccion(models.Model):
@@ -0,0 +1,115 @@
+import contextvars
+import functools
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Lecturas en una réplica de sólo lectura (alias TIENDA_REPLICA, ver settings). Sólo van a
+# la réplica las consultas de modelos de la tienda hechas dentro de una vista marcada con
+# ``leer_de_replica`` (catálogo, búsqueda, informes y exportación), y nunca:
+#   - en peticiones que no son GET/HEAD/OPTIONS,
+#   - dentro de una transacción en la primaria (p. ej. las de compras.py),
+#   - durante unos segundos después de que el usuario haya escrito (cookie COOKIE), para
+#     que vea sus propios cambios aunque la réplica vaya con retraso,
+#   - al rellenar la caché del catálogo (ver cache_catalogo.obtener): una entrada guardada
+#     con la versión nueva no puede contener datos anteriores a la escritura.
+# Usuarios y sesiones siempre se leen de la primaria.
+
+COOKIE = 'tienda_primaria'
+METODOS_LECTURA = ('GET', 'HEAD', 'OPTIONS')
+# Tablas de la tienda que se escriben como efecto de otra escritura o sin que el usuario cambie
+# nada que vaya a leer (versiones de los validadores, cola de tareas): no fijan a la primaria.
+# Las escrituras de otras aplicaciones (sesiones, usuarios) tampoco, porque se leen siempre de ella.
+SIN_LECTURA_PROPIA = {'versioncatalogo', 'tarea'}
+
+
+class _Estado:
+    __slots__ = ('primaria', 'replica', 'escrito')
+
+    def __init__(self, primaria):
+        self.primaria = primaria
+        self.replica = False
+        self.escrito = False
+
+
+_estado = contextvars.ContextVar('tienda_replica', default=None)
+
+
+def alias_replica():
+    alias = getattr(settings, 'TIENDA_REPLICA', None)
+    return alias if alias and alias in connections.settings else None
+
+
+def leer_de_replica(vista):
+    """Decorador de vista: las lecturas del resto de la petición pueden ir a la réplica, también
+    las que se hacen al renderizar la TemplateResponse, que ocurre después de salir de la vista."""
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        estado = _estado.get()
+        if estado is not None:
+            estado.replica = True
+        return vista(*args, **kwargs)
+    return envoltura
+
+
+@contextmanager
+def en_primaria():
+    """Las lecturas dentro del bloque van a la primaria aunque la vista use la réplica."""
+    estado = _estado.get()
+    if estado is None:
+        yield
+        return
+    anterior, estado.primaria = estado.primaria, True
+    try:
+        yield
+    finally:
+        estado.primaria = anterior
+
+
+class ReplicaMiddleware:
+    """Delimita el estado de cada petición y pone la cookie que la fija a la primaria tras una escritura.
+    Sin réplica configurada Django lo retira de la cadena al arrancar."""
+
+    def __init__(self, get_response):
+        if alias_replica() is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        estado = _Estado(primaria=request.method not in METODOS_LECTURA or COOKIE in request.COOKIES)
+        token = _estado.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _estado.reset(token)
+        if estado.escrito:
+            response.set_cookie(COOKIE, '1', max_age=settings.TIENDA_REPLICA_PEGAJOSA, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+class RouterReplica:
+
+    def db_for_read(self, model, **hints):
+        estado = _estado.get()
+        if estado is None or not estado.replica or estado.primaria or model._meta.app_label != 'tienda':
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias_replica()
+
+    def db_for_write(self, model, **hints):
+        estado = _estado.get()
+        if estado is not None and model._meta.app_label == 'tienda' \
+                and model._meta.model_name not in SIN_LECTURA_PROPIA:
+            estado.escrito = True
+        # Explícito: si no, un objeto leído de la réplica se guardaría en ella
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica tiene los mismos datos que la primaria
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, alias_replica()}:
+            return True
+        return None
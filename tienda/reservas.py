@@ -0,0 +1,137 @@
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Case, F, IntegerField, Min, Sum, Value, When
+from django.utils import timezone
+
+from . import cache_catalogo
+from .cola import encolar
+from .compras import StockInsuficiente, realizar_pedido
+from .models import Producto, Reserva
+
+# Reservas de stock del carrito. Añadir al carrito aparta las unidades en ese momento con el
+# mismo UPDATE condicional que una compra, así que la disputa por el stock (y el "no quedan")
+# llega al añadir y se reparte en el tiempo en lugar de concentrarse en el pago. Las unidades
+# reservadas se descuentan de Producto.unidades: catálogo, facetas y ficha siguen leyendo ahí
+# el stock disponible. Al pagar, realizar_pedido sólo toca los productos cuya reserva no
+# cubre el carrito; las reservas que caducan las devuelve manage.py liberar_reservas.
+# Quien fija el stock con un valor absoluto (importación, formulario de producto, admin)
+# escribe el total físico menos lo reservado (``disponibles``): si escribiera el total, al
+# devolverse las reservas se contarían dos veces.
+
+CLAVE_SESION = 'reserva'
+LOTE = 500
+
+
+def titular(session):
+    """Identificador de las reservas de la sesión. No sirve la clave de sesión: cambia al
+    iniciar sesión y, con las sesiones en cookie firmada, en cada respuesta."""
+    if CLAVE_SESION not in session:
+        session[CLAVE_SESION] = uuid.uuid4().hex
+    return session[CLAVE_SESION]
+
+
+def reservar(titular, producto_id, unidades, using=DEFAULT_DB_ALIAS):
+    """Aparta ``unidades`` de un producto durante TIENDA_RESERVA_MINUTOS (sumándolas a la reserva
+    que ya tenga el titular, que se renueva). StockInsuficiente si no quedan."""
+    if unidades <= 0:
+        raise ValueError('Las unidades deben ser positivas')
+    caduca = timezone.now() + timedelta(minutes=settings.TIENDA_RESERVA_MINUTOS)
+    with transaction.atomic(using=using):
+        actualizados = Producto.objects.using(using).filter(pk=producto_id, unidades__gte=unidades) \
+            .update(unidades=F('unidades') - unidades)
+        if not actualizados:
+            raise StockInsuficiente(f'No quedan {unidades} unidades del producto {producto_id}', [producto_id])
+        if not Reserva.objects.using(using).filter(titular=titular, producto_id=producto_id) \
+                .update(unidades=F('unidades') + unidades, caduca=caduca):
+            Reserva.objects.using(using).create(titular=titular, producto_id=producto_id, unidades=unidades,
+                                                caduca=caduca)
+        quedan = Producto.objects.using(using).values_list('unidades', flat=True).get(pk=producto_id)
+        cache_catalogo.invalidar_producto(producto_id)
+        if not quedan:
+            cache_catalogo.invalidar_catalogo()
+        if quedan <= settings.TIENDA_STOCK_BAJO < quedan + unidades:
+            encolar('avisar_stock_bajo', using=using, productos=[producto_id])
+
+
+def reservadas(productos, using=DEFAULT_DB_ALIAS):
+    """{producto_id: unidades} apartadas en carritos, incluidas las de reservas caducadas que
+    liberar_reservas aún no ha devuelto: también están descontadas de Producto.unidades."""
+    return dict(Reserva.objects.using(using).filter(producto_id__in=productos).values('producto_id')
+                .annotate(total=Sum('unidades')).values_list('producto_id', 'total').order_by())
+
+
+def disponibles(total, reservadas):
+    """Valor de Producto.unidades para un stock total: sin las reservadas (nunca negativo)."""
+    return max(total - reservadas, 0)
+
+
+def _borrar(condicion, parametros, using):
+    """Borra reservas con DELETE ... RETURNING y devuelve {producto_id: unidades} de las borradas.
+    Es una sola sentencia: si el barrido y el pago coinciden sobre la misma reserva, sólo uno
+    de los dos la recibe (el otro espera al bloqueo de la fila y ya no la encuentra)."""
+    opts = Reserva._meta
+    quote_name = connections[using].ops.quote_name
+    tabla = quote_name(opts.db_table)
+    producto, unidades = (quote_name(opts.get_field(campo).column) for campo in ('producto', 'unidades'))
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {tabla} WHERE {condicion} RETURNING {producto}, {unidades}', parametros)
+        borradas = Counter()
+        for producto_id, n in cursor.fetchall():
+            borradas[producto_id] += n
+    return dict(borradas)
+
+
+def devolver(unidades, using=DEFAULT_DB_ALIAS):
+    """Suma al stock las unidades ({producto_id: unidades}) de reservas liberadas."""
+    if not unidades:
+        return
+    productos = Producto.objects.using(using).filter(pk__in=unidades)
+    # Sólo si alguno estaba agotado cambia la faceta "con stock" del catálogo
+    agotados = productos.filter(unidades=0).exists()
+    productos.update(unidades=F('unidades') + Case(*[When(pk=pk, then=Value(n)) for pk, n in unidades.items()],
+                                                   output_field=IntegerField()))
+    cache_catalogo.invalidar_productos(list(unidades))
+    if agotados:
+        cache_catalogo.invalidar_catalogo()
+
+
+def confirmar(cliente, titular, lineas, using=DEFAULT_DB_ALIAS):
+    """Paga el carrito: convierte en compras las reservas del titular y sólo pide stock para lo
+    que no estaba reservado (o devuelve lo reservado de más). Si falta stock no se consume
+    ninguna reserva."""
+    columna = connections[using].ops.quote_name(Reserva._meta.get_field('titular').column)
+    with transaction.atomic(using=using):
+        reservadas = _borrar(f'{columna} = %s', [titular], using)
+        return realizar_pedido(cliente, lineas, using, reservadas=reservadas)
+
+
+def liberar_caducadas(lote=LOTE, using=DEFAULT_DB_ALIAS):
+    """Devuelve al stock las reservas caducadas, de ``lote`` en ``lote`` para no retener el
+    bloqueo de escritura mucho tiempo. Devuelve el número de unidades liberadas."""
+    opts = Reserva._meta
+    quote_name = connections[using].ops.quote_name
+    tabla, pk = quote_name(opts.db_table), quote_name(opts.pk.column)
+    caduca = quote_name(opts.get_field('caduca').column)
+    ahora = connections[using].ops.adapt_datetimefield_value(timezone.now())
+    total = 0
+    while True:
+        with transaction.atomic(using=using):
+            liberadas = _borrar(
+                f'{pk} IN (SELECT {pk} FROM {tabla} WHERE {caduca} <= %s ORDER BY {caduca} LIMIT %s)',
+                [ahora, lote], using)
+            devolver(liberadas, using)
+        if not liberadas:
+            return total
+        total += sum(liberadas.values())
+
+
+def caducidad(session, using=DEFAULT_DB_ALIAS):
+    """Cuándo caduca la primera reserva del carrito de la sesión, o None si no tiene."""
+    if CLAVE_SESION not in session:
+        return None
+    return Reserva.objects.using(using).filter(titular=session[CLAVE_SESION], caduca__gt=timezone.now()) \
+        .aggregate(caduca=Min('caduca'))['caduca']
@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache_catalogo
+from .agregados import anular_ventas, registrar_ventas
+from .busqueda import obtener_backend
+from .models import Comentario, Compra, Marca, Producto
+
+
+# Mantenimiento incremental del índice de búsqueda
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        obtener_backend(using).indexar([instance.pk])
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, using=None, **kwargs):
+    obtener_backend(using).eliminar([instance.pk])
+
+
+# Copia del nombre de la marca en sus productos (orden del catálogo por marca)
+@receiver(pre_save, sender=Producto)
+def copiar_nombre_marca(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and update_fields is None:
+        instance.marca_nombre = instance.marca.nombre
+
+
+@receiver(post_save, sender=Marca)
+def renombrar_marca(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if not created and not raw:
+        Producto.objects.using(using).filter(marca=instance).exclude(marca_nombre=instance.nombre) \
+            .update(marca_nombre=instance.nombre)
+
+
+@receiver(post_save, sender=Marca)
+def reindexar_marca(sender, instance, created=False, raw=False, using=None, **kwargs):
+    # Una marca nueva todavía no tiene productos que reindexar
+    if not created and not raw:
+        obtener_backend(using).indexar_marca(instance.pk)
+
+
+# Invalidación de la caché del catálogo (se aplica al confirmar la transacción)
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_producto(sender, instance, **kwargs):
+    cache_catalogo.invalidar_producto(instance.pk)
+    cache_catalogo.invalidar_catalogo()
+
+
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+def invalidar_marca(sender, instance, **kwargs):
+    cache_catalogo.invalidar_marca(instance.pk)
+    cache_catalogo.invalidar_catalogo()
+
+
+@receiver(post_save, sender=Comentario)
+@receiver(post_delete, sender=Comentario)
+def invalidar_comentario(sender, instance, **kwargs):
+    # El catálogo muestra la valoración media, así que también cambia
+    cache_catalogo.invalidar_producto(instance.producto_id)
+    cache_catalogo.invalidar_catalogo()
+
+
+# Agregados de ventas: se suman las compras que se crean una a una (las de bulk_create y loaddata no
+# envían la señal: realizar_pedido las suma él mismo y tras generar_datos se reconstruyen con agregados_ventas),
+# se restan las que se borran y se cambian las que se modifican.
+@receiver(post_save, sender=Compra)
+def registrar_compra(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if created and not raw:
+        # realizar_compra crea la compra con el producto ya leído: no hace falta consultar su marca
+        marcas = {instance.producto_id: instance.producto.marca_id} if Compra.producto.is_cached(instance) else None
+        registrar_ventas([instance], using, marcas=marcas)
+
+
+# Campo que lleva de Compra a cada modelo cuyo borrado se lleva compras por delante
+ORIGENES_COMPRA = {'tienda.Compra': 'pk', 'tienda.Pedido': 'pedido', 'tienda.Producto': 'producto',
+                   'tienda.Cliente': 'user', settings.AUTH_USER_MODEL: 'user__user'}
+
+
+@receiver(pre_delete, sender='tienda.Compra')
+@receiver(pre_delete, sender='tienda.Pedido')
+@receiver(pre_delete, sender='tienda.Producto')
+@receiver(pre_delete, sender='tienda.Cliente')
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def anular_compras(sender, instance, origin=None, using=None, **kwargs):
+    """Resta de los agregados las compras que se van a borrar, con una sola lectura y un UPDATE por agregado.
+
+    La señal llega por cada objeto del borrado, también por los que caen en cascada; sólo actúa la del
+    modelo que lo origina (una vez por queryset) y resta de golpe todas sus compras. Antes de borrar,
+    porque después ya no está la marca del producto.
+    """
+    campo = ORIGENES_COMPRA[sender._meta.label]
+    if isinstance(origin, QuerySet):
+        if origin.model is not sender or getattr(origin, '_ventas_anuladas', False):
+            return
+        origin._ventas_anuladas = True
+        filtro = {f'{campo}__in': origin.values('pk')}
+    elif origin is instance:
+        filtro = {campo: instance.pk}
+    else:
+        return
+    compras = Compra.objects.using(using).filter(**filtro).only('producto_id', 'user_id', 'unidades', 'importe',
+                                                                 'fecha')
+    anular_ventas(compras, using)
+
+
+@receiver(pre_save, sender=Compra)
+def corregir_compra(sender, instance, raw=False, using=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    anterior = Compra.objects.using(using).filter(pk=instance.pk).first()
+    if anterior is not None:
+        anular_ventas([anterior], using)
+        registrar_ventas([instance], using)
@@ -0,0 +1,26 @@
+// Sugerencias del buscador mientras se escribe (ver AutocompletarView). Rellena el
+// <datalist> del campo con los nombres que devuelve data-autocompletar.
+document.querySelectorAll('input[data-autocompletar]').forEach(function (campo) {
+    var lista = document.getElementById(campo.getAttribute('list'));
+    var espera, ultima = '';
+    campo.addEventListener('input', function () {
+        clearTimeout(espera);
+        espera = setTimeout(function () {
+            var texto = campo.value.trim();
+            if (!texto || texto === ultima) {
+                return;
+            }
+            ultima = texto;
+            fetch(campo.dataset.autocompletar + '?q=' + encodeURIComponent(texto))
+                .then(function (respuesta) { return respuesta.json(); })
+                .then(function (datos) {
+                    lista.replaceChildren.apply(lista, datos.sugerencias.map(function (sugerencia) {
+                        var opcion = document.createElement('option');
+                        opcion.value = sugerencia.nombre;
+                        opcion.label = sugerencia.marca;
+                        return opcion;
+                    }));
+                });
+        }, 80);
+    });
+});
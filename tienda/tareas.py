@@ -0,0 +1,52 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import mail_admins, send_mail
+
+from .cola import tarea
+from .models import Compra, Producto
+
+# Trabajo que no tiene por qué hacer esperar al cliente: se encola en la transacción de la
+# compra o del registro (ver cola.py) y lo ejecuta manage.py procesar_tareas. Una tarea puede
+# ejecutarse más de una vez si un trabajador cae a mitad, así que enviar un correo repetido es
+# el peor caso admisible; nada de aquí cambia datos de la tienda.
+
+logger = logging.getLogger('tienda.tareas')
+
+
+@tarea()
+def confirmar_compra(compras):
+    """Correo al cliente con el resumen de una compra o de las líneas de un pedido."""
+    lineas = list(Compra.objects.filter(pk__in=compras).select_related('producto__marca', 'user__user')
+                  .order_by('pk'))
+    if not lineas or not lineas[0].user.user.email:
+        return
+    usuario = lineas[0].user.user
+    detalle = '\n'.join(f'- {linea.unidades} x {linea.producto}: {linea.importe} €' for linea in lineas)
+    total = sum(linea.importe for linea in lineas)
+    send_mail(f'Confirmación de su compra ({len(lineas)} productos)',
+              f'Hola {usuario.username},\n\nHemos recibido su compra:\n{detalle}\n\nTotal: {total} €\n',
+              settings.DEFAULT_FROM_EMAIL, [usuario.email])
+
+
+@tarea()
+def avisar_stock_bajo(productos):
+    """Avisa a los administradores de los productos que se han quedado con poco stock."""
+    bajos = list(Producto.objects.filter(pk__in=productos, unidades__lte=settings.TIENDA_STOCK_BAJO)
+                 .select_related('marca').order_by('unidades'))
+    if not bajos:
+        # Se ha repuesto antes de que llegara el aviso
+        return
+    detalle = '\n'.join(f'- {producto} (#{producto.pk}): quedan {producto.unidades}' for producto in bajos)
+    logger.warning('Stock bajo: %s', ', '.join(str(producto.pk) for producto in bajos))
+    mail_admins(f'Stock bajo en {len(bajos)} productos', detalle)
+
+
+@tarea()
+def bienvenida(user_id):
+    usuario = User.objects.filter(pk=user_id).first()
+    if usuario is None or not usuario.email:
+        return
+    send_mail('Bienvenido a la tienda', f'Hola {usuario.username}, gracias por registrarse.',
+              settings.DEFAULT_FROM_EMAIL, [usuario.email])
@@ -1,3 +1,1436 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import types
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.db.models import F, Sum
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from main import urls as urls_main
+
+from . import autocompletar, cache_catalogo, cola, facetas, replicas, reservas, versiones
+from .busqueda import buscar_productos, obtener_backend
+from .carrito import Carrito
+from . import middleware as perfil_consultas
+from .catalogo import paginar_catalogo
+from .compras import StockInsuficiente, realizar_compra, realizar_pedido
+from .importar import Importador
+from .models import Cliente, Comentario, Compra, Marca, Pedido, Producto, Reserva, Tarea, VentasCliente, \
+    VentasPeriodo, VentasProducto, VersionCatalogo
+
+
+class CatalogoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.marcas = [Marca.objects.create(nombre=nombre) for nombre in ('Zeta', 'Alfa', 'Omega')]
+        cls.productos = [
+            Producto.objects.create(marca=cls.marcas[i % 3], nombre=f'Producto {i:02d}', modelo=f'M{i}',
+                                    unidades=10, precio=Decimal(100 - (i % 5)))
+            for i in range(30)
+        ]
+
+    def recorrer(self, orden, por_pagina=7):
+        vistos, cursor = [], None
+        while True:
+            pagina = paginar_catalogo(Producto.objects.select_related('marca'), orden, cursor, por_pagina)
+            vistos.extend(pagina.object_list)
+            if not pagina.siguiente:
+                return vistos
+            cursor = pagina.siguiente
+
+    def test_recorrido_completo_y_estable(self):
+        for orden, clave in [('nombre', lambda p: (p.nombre, p.pk)),
+                             ('precio', lambda p: (p.precio, p.pk)),
+                             ('-precio', lambda p: (-p.precio, -p.pk)),
+                             ('marca', lambda p: (p.marca.nombre, p.pk))]:
+            vistos = self.recorrer(orden)
+            self.assertEqual([p.pk for p in vistos], [p.pk for p in sorted(self.productos, key=clave)], orden)
+
+    def test_orden_por_marca_sigue_al_renombrarla(self):
+        zeta = self.marcas[0]
+        zeta.nombre = 'Beta'
+        zeta.save()
+        marcas = [p.marca_id for p in self.recorrer('marca')]
+        self.assertEqual(marcas[:20], [self.marcas[1].pk] * 10 + [zeta.pk] * 10)
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        pagina = paginar_catalogo(Producto.objects.all(), 'precio', 'no-es-un-cursor', 5)
+        self.assertEqual(len(pagina.object_list), 5)
+
+    def test_consultas_constantes_por_pagina(self):
+        primera = self.client.get(reverse('compra'), {'orden': 'marca'})
+        with self.assertNumQueries(1):
+            self.client.get(reverse('compra'), {'orden': 'marca', 'cursor': primera.context['page_obj'].siguiente})
+
+
+class BusquedaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = Marca.objects.create(nombre='Acme')
+        cls.otra = Marca.objects.create(nombre='Otra')
+        cls.portatil = Producto.objects.create(marca=cls.acme, nombre='Portátil ligero', modelo='X100',
+                                               unidades=1, precio=900)
+        cls.funda = Producto.objects.create(marca=cls.otra, nombre='Funda', modelo='Para portatil',
+                                            unidades=1, precio=20)
+
+    def buscar(self, texto):
+        return list(buscar_productos(texto).values_list('pk', flat=True))
+
+    def test_busca_en_nombre_modelo_y_marca_por_relevancia(self):
+        self.assertEqual(self.buscar('portatil'), [self.portatil.pk, self.funda.pk])
+        self.assertEqual(self.buscar('x10'), [self.portatil.pk])
+        self.assertEqual(self.buscar('acme port'), [self.portatil.pk])
+        self.assertEqual(self.buscar(''), [])
+
+    def test_indice_incremental(self):
+        self.funda.nombre = 'Mochila'
+        self.funda.modelo = 'M1'
+        self.funda.save()
+        self.assertEqual(self.buscar('mochila'), [self.funda.pk])
+        self.assertEqual(self.buscar('portatil'), [self.portatil.pk])
+
+        self.acme.nombre = 'Nueva'
+        self.acme.save()
+        self.assertEqual(self.buscar('nueva'), [self.portatil.pk])
+        self.assertEqual(self.buscar('acme'), [])
+
+        self.portatil.delete()
+        self.assertEqual(self.buscar('ligero'), [])
+
+    def test_puntua_todas_las_coincidencias(self):
+        # El mejor resultado (en el nombre) llega después de 1500 coincidencias sólo por la marca
+        tele = Marca.objects.create(nombre='Tele')
+        Producto.objects.bulk_create([Producto(marca=tele, nombre=f'Pieza {i}', modelo=f'P{i}', unidades=1, precio=1)
+                                      for i in range(1500)])
+        mejor = Producto.objects.bulk_create([Producto(marca=tele, nombre='Tele', modelo='Tele', unidades=1,
+                                                       precio=1)])[0]
+        obtener_backend(connection.alias).reconstruir()
+        self.assertEqual(self.buscar('tele')[0], mejor.pk)
+
+    def test_vista_de_busqueda(self):
+        response = self.client.get(reverse('buscar'), {'buscar_post': 'funda'})
+        self.assertEqual(list(response.context['Productos']), [self.funda])
+
+
+class AgregadosVentasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.producto = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=50, precio=100)
+        cls.user = User.objects.create_user('ana', password='secreto')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=1000)
+
+    def test_checkout_actualiza_agregados_en_la_misma_transaccion(self):
+        self.client.force_login(self.user)
+        for unidades in (2, 3):
+            self.client.post(reverse('checkout', kwargs={'pk': self.producto.pk}), {'unidades': unidades})
+        venta = VentasProducto.objects.get(producto=self.producto)
+        self.assertEqual((venta.unidades, venta.importe, venta.compras), (5, 500, 2))
+        self.assertEqual(VentasCliente.objects.get(cliente=self.cliente).importe, 500)
+
+        response = self.client.get(reverse('top_clientes'))
+        self.assertContains(response, 'ana')
+        response = self.client.get(reverse('top_productos'))
+        self.assertContains(response, 'Se ha comprado 5 veces')
+
+    def test_comando_verifica_y_reconstruye(self):
+        # bulk_create no envía post_save: los agregados se quedan atrás hasta reconstruirlos
+        Compra.objects.bulk_create([Compra(producto=self.producto, user=self.cliente, unidades=1, importe=100)])
+        with self.assertRaises(CommandError):
+            call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        call_command('agregados_ventas', stdout=StringIO())
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        self.assertEqual(VentasProducto.objects.get(producto=self.producto).unidades, 1)
+
+    def test_borrar_o_modificar_compras_corrige_agregados(self):
+        compras = [realizar_compra(self.cliente, self.producto.pk, unidades) for unidades in (2, 3)]
+        compras[0].unidades, compras[0].importe = 4, 400
+        compras[0].save()
+        compras[1].delete()
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        venta = VentasProducto.objects.get(producto=self.producto)
+        self.assertEqual((venta.unidades, venta.importe, venta.compras), (4, 400, 1))
+        # En cascada con el producto: el total de la tienda vuelve a cero
+        self.producto.delete()
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        self.assertEqual(VentasPeriodo.objects.get(periodo='dia', dimension='total').importe, 0)
+
+    def test_compras_creadas_fuera_del_checkout_y_borrado_en_cascada(self):
+        otro = Producto.objects.create(marca=self.producto.marca, nombre='Radio', modelo='R1', unidades=50, precio=10)
+        Compra.objects.create(producto=self.producto, user=self.cliente, unidades=1, importe=100)
+        realizar_pedido(self.cliente, {self.producto.pk: 2, otro.pk: 3})
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        self.assertEqual(VentasCliente.objects.get(cliente=self.cliente).compras, 3)
+        # Las compras del producto se restan con una lectura, la de sus marcas y un UPDATE por agregado
+        with self.assertNumQueries(7):  # + recoger y borrar las compras
+            Compra.objects.filter(producto=self.producto).delete()
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        # Borrar el usuario se lleva cliente, pedido y compras
+        realizar_pedido(self.cliente, {self.producto.pk: 1, otro.pk: 1})
+        self.user.delete()
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        self.assertEqual(VentasPeriodo.objects.get(periodo='dia', dimension='total').compras, 0)
+
+
+class ExportarComprasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        producto = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=50, precio=100)
+        cls.staff = User.objects.create_user('jefa', password='secreto', is_staff=True)
+        for nombre, dia in (('ana', 1), ('luis', 2), ('ana', 3)):
+            user, _ = User.objects.get_or_create(username=nombre)
+            cliente, _ = Cliente.objects.get_or_create(user=user, defaults={'saldo': 0})
+            Compra.objects.create(producto=producto, user=cliente, unidades=dia, importe=100 * dia,
+                                  fecha=timezone.make_aware(datetime.datetime(2024, 3, dia, 12)))
+
+    def exportar(self, **parametros):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('exportar_compras'), parametros)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_csv_con_filtros(self):
+        lineas = self.exportar(desde='2024-03-02', hasta='2024-03-03')
+        self.assertTrue(lineas[0].startswith('id,fecha,producto_id,producto'))
+        self.assertEqual(len(lineas), 3)
+        self.assertEqual(len(self.exportar(cliente='ana')), 3)
+
+    def test_jsonl(self):
+        filas = [json.loads(linea) for linea in self.exportar(formato='jsonl', hasta='2024-03-01')]
+        self.assertEqual([(f['cliente'], f['producto'], f['unidades']) for f in filas], [('ana', 'Tele', 1)])
+
+    def test_solo_staff_y_rango_valido(self):
+        self.assertEqual(self.client.get(reverse('exportar_compras')).status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('exportar_compras'), {'desde': '2024-03-03', 'hasta': '2024-03-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CompraConcurrenteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.producto = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=3, precio=10)
+        cls.user = User.objects.create_user('ana', password='secreto')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=100)
+
+    def test_no_vende_mas_stock_del_que_hay(self):
+        # El objeto en memoria está desfasado a propósito: la comprobación la hace la base de datos
+        realizar_compra(self.cliente, self.producto.pk, 2)
+        with self.assertRaises(StockInsuficiente):
+            realizar_compra(self.cliente, self.producto.pk, 2)
+        self.producto.refresh_from_db()
+        self.cliente.refresh_from_db()
+        self.assertEqual(self.producto.unidades, 1)
+        self.assertEqual(self.cliente.saldo, 80)
+        self.assertEqual(Compra.objects.count(), 1)
+
+    def test_vista_muestra_error_sin_stock(self):
+        self.client.force_login(self.user)
+        url = reverse('checkout', kwargs={'pk': self.producto.pk})
+        response = self.client.post(url, {'unidades': 5})
+        self.assertContains(response, 'No quedan unidades suficientes')
+        response = self.client.post(url, {'unidades': -1})
+        self.assertContains(response, 'Las unidades deben ser positivas')
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.unidades, 3)
+
+
+class CheckoutCarritoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.productos = [Producto.objects.create(marca=marca, nombre=f'P{i}', modelo=f'M{i}', unidades=10, precio=2)
+                         for i in range(50)]
+        cls.user = User.objects.create_user('ana', password='secreto')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=1000)
+
+    def comprar_carrito(self, lineas):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['carrito'] = json.dumps([{'producto_id': str(p.pk), 'unidades': n} for p, n in lineas])
+        session.save()
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(reverse('checkout_carrito'))
+        return response, len(consultas)
+
+    def test_pedido_con_lineas_en_consultas_constantes(self):
+        _, consultas_dos = self.comprar_carrito([(self.productos[0], 1), (self.productos[1], 1)])
+        response, consultas_cincuenta = self.comprar_carrito([(p, 2) for p in self.productos])
+        self.assertRedirects(response, reverse('welcome'), fetch_redirect_response=False)
+        self.assertEqual(consultas_dos, consultas_cincuenta)
+
+        pedido = Pedido.objects.latest('pk')
+        self.assertEqual(pedido.compra_set.count(), 50)
+        self.assertEqual(pedido.importe, 200)
+        self.cliente.refresh_from_db()
+        self.assertEqual(self.cliente.saldo, 1000 - 4 - 200)
+        self.assertEqual(Producto.objects.get(pk=self.productos[0].pk).unidades, 7)
+        self.assertEqual(VentasProducto.objects.get(producto=self.productos[0]).unidades, 3)
+
+    def test_lineas_repetidas_se_agrupan_y_sin_stock_no_se_compra_nada(self):
+        primero, segundo = self.productos[:2]
+        response, _ = self.comprar_carrito([(primero, 6), (primero, 6), (segundo, 1)])
+        self.assertContains(response, 'No quedan unidades suficientes de: P0')
+        self.assertEqual(Producto.objects.get(pk=segundo.pk).unidades, 10)
+        self.assertFalse(Pedido.objects.exists())
+
+
+class CarritoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.productos = [Producto.objects.create(marca=marca, nombre=f'P{i}', modelo=f'M{i}', unidades=10, precio=3)
+                         for i in range(20)]
+
+    def agregar(self, producto, unidades):
+        return self.client.post(reverse('agregar_al_carrito'), {'producto_id': producto.pk, 'unidades': unidades})
+
+    def test_agrega_fusionando_lineas(self):
+        self.agregar(self.productos[0], 2)
+        self.agregar(self.productos[0], 3)
+        self.agregar(self.productos[1], 1)
+        self.assertEqual(self.client.session['carrito'],
+                         {str(self.productos[0].pk): 5, str(self.productos[1].pk): 1})
+        self.assertEqual(self.agregar(self.productos[1], 0).status_code, 400)
+
+    def test_ver_carrito_en_consultas_constantes(self):
+        self.agregar(self.productos[0], 1)
+        with CaptureQueriesContext(connection) as una_linea:
+            self.client.get(reverse('ver_carrito'))
+        for producto in self.productos[1:]:
+            self.agregar(producto, 2)
+        with CaptureQueriesContext(connection) as veinte_lineas:
+            response = self.client.get(reverse('ver_carrito'))
+        self.assertEqual(len(una_linea), len(veinte_lineas))
+        self.assertEqual(len(response.context['carrito']), 20)
+        self.assertEqual(response.context['carrito'][1]['precio_total'], 6)
+
+    def test_lee_el_formato_antiguo(self):
+        antiguo = json.dumps([{'producto_id': '7', 'unidades': 1}, {'producto_id': '7', 'unidades': 2}])
+        self.assertEqual(Carrito({'carrito': antiguo}).por_producto(), {7: 3})
+
+
+class ValoracionesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.producto = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=5, precio=10)
+        cls.user = User.objects.create_user('ana', password='secreto')
+
+    def resumen(self):
+        producto = Producto.objects.get(pk=self.producto.pk)
+        return producto.num_valoraciones, producto.valoracion_media, dict(producto.histograma_valoraciones)
+
+    def test_resumen_incremental_al_crear_y_editar(self):
+        for valoracion in (5, 4, ''):
+            self.client.post(reverse('crear_comentario', kwargs={'pk': self.producto.pk}),
+                             {'valoracion': valoracion, 'comentario': 'bien'})
+        self.assertEqual(self.resumen(), (2, 4.5, {5: 1, 4: 1, 3: 0, 2: 0, 1: 0}))
+
+        self.client.force_login(self.user)
+        comentario = Comentario.objects.get(valoracion=5)
+        self.client.post(reverse('editar_comentario', kwargs={'pk': comentario.pk}),
+                         {'valoracion': 1, 'comentario': 'mal'})
+        self.assertEqual(self.resumen(), (2, 2.5, {5: 0, 4: 1, 3: 0, 2: 0, 1: 1}))
+
+    def test_comando_recalcula(self):
+        Comentario.objects.bulk_create([Comentario(producto=self.producto, valoracion=v) for v in (3, 3, 5)])
+        call_command('recalcular_valoraciones', stdout=StringIO())
+        self.assertEqual(self.resumen()[:2], (3, 11 / 3))
+        Comentario.objects.all().delete()
+        call_command('recalcular_valoraciones', stdout=StringIO())
+        self.assertEqual(self.resumen()[:2], (0, 0))
+
+
+class ComentariosPaginadosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.producto = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=5, precio=10)
+        Comentario.objects.bulk_create([Comentario(producto=cls.producto, comentario=f'c{i}', valoracion=3)
+                                        for i in range(25)])
+        cls.user = User.objects.create_user('ana', password='secreto')
+
+    def test_pagina_del_producto_solo_carga_la_primera_pagina(self):
+        self.client.force_login(self.user)
+        url = reverse('checkout', kwargs={'pk': self.producto.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as antes:
+            self.client.get(url)
+        Comentario.objects.bulk_create([Comentario(producto=self.producto, comentario='otro') for _ in range(50)])
+        with CaptureQueriesContext(connection) as despues:
+            response = self.client.get(url)
+        self.assertEqual(len(antes), len(despues))
+        self.assertEqual(len(response.context['comentarios']), 10)
+        self.assertNotIn('compras', response.context)
+
+    def test_cursor_json_y_fragmento(self):
+        url = reverse('comentarios_producto', kwargs={'pk': self.producto.pk})
+        vistos, antes = [], None
+        while True:
+            datos = self.client.get(url, {'formato': 'json', **({'antes': antes} if antes else {})}).json()
+            vistos += [c['comentario'] for c in datos['comentarios']]
+            antes = datos['siguiente']
+            if not antes:
+                break
+        self.assertEqual(vistos, [f'c{i}' for i in range(24, -1, -1)])
+        self.assertContains(self.client.get(url), 'data-fragmento')
+
+
+class CacheCatalogoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.marca = Marca.objects.create(nombre='Acme')
+        cls.producto = Producto.objects.create(marca=cls.marca, nombre='Tele', modelo='T1', unidades=5, precio=10)
+        cls.user = User.objects.create_user('ana', password='secreto')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=1000)
+
+    def setUp(self):
+        cache.clear()
+        cache_catalogo.reiniciar_estadisticas()
+
+    def test_catalogo_cacheado_hasta_que_cambia_un_producto(self):
+        url = reverse('compra')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(url)
+        self.assertEqual(len(consultas), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            producto = Producto.objects.get(pk=self.producto.pk)
+            producto.nombre = 'Televisor'
+            producto.save()
+        self.assertContains(self.client.get(url), 'Televisor')
+        self.assertEqual(cache_catalogo.estadisticas()['catalogo'], {'aciertos': 1, 'fallos': 2, 'ratio': 0.333})
+
+    def test_busqueda_cacheada_por_terminos(self):
+        url = reverse('buscar')
+        self.client.get(url, {'buscar_post': 'tele'})
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url, {'buscar_post': '  TELE '})
+        self.assertEqual(len(consultas), 0)
+        self.assertEqual([p.pk for p in response.context['object_list']], [self.producto.pk])
+
+    def test_compra_invalida_la_pagina_del_producto(self):
+        self.client.force_login(self.user)
+        url = reverse('checkout', kwargs={'pk': self.producto.pk})
+        self.assertEqual(self.client.get(url).context['producto'].unidades, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            realizar_compra(self.cliente, self.producto.pk, 2)
+        self.assertEqual(self.client.get(url).context['producto'].unidades, 3)
+
+    def test_cambio_de_marca_invalida_la_pagina_del_producto(self):
+        self.client.force_login(self.user)
+        url = reverse('checkout', kwargs={'pk': self.producto.pk})
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.marca.nombre = 'Acme Corp'
+            self.marca.save()
+        self.assertEqual(str(self.client.get(url).context['producto'].marca), 'Acme Corp')
+
+    def test_estadisticas_solo_para_staff(self):
+        url = reverse('estadisticas_cache')
+        self.client.force_login(self.user)
+        self.assertNotEqual(self.client.get(url).status_code, 200)
+        staff = User.objects.create_user('jefe', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class FacetasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme, cls.zeta = Marca.objects.create(nombre='Acme'), Marca.objects.create(nombre='Zeta')
+        datos = [(cls.acme, 10, 5, False), (cls.acme, 120, 0, True), (cls.acme, 120, 3, False),
+                 (cls.zeta, 40, 1, True), (cls.zeta, 5000, 2, False)]
+        for i, (marca, precio, unidades, vip) in enumerate(datos):
+            Producto.objects.create(marca=marca, nombre=f'P{i}', modelo=f'M{i}', precio=precio, unidades=unidades,
+                                    vip=vip)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recuentos_en_una_consulta(self):
+        filtros = facetas.Filtros(marcas=(self.acme.pk,), en_stock=True)
+        with self.assertNumQueries(1):
+            celdas = facetas.cubo(Producto.objects.all())
+        recuentos = facetas.contar(celdas, filtros)
+        # Cada faceta ignora su propio filtro
+        self.assertEqual(recuentos['marca'], {self.acme.pk: 2, self.zeta.pk: 2})
+        self.assertEqual(recuentos['precio'], {'0-50': 1, '50-200': 1, '200-1000': 0, '1000+': 0})
+        self.assertEqual(recuentos['en_stock'], 2)
+        self.assertEqual(recuentos['vip'], 0)
+        self.assertEqual(recuentos['total'], 2)
+        self.assertEqual(recuentos, facetas.contar(facetas.cubo_de(Producto.objects.all()), filtros))
+
+    def test_filtros_en_base_de_datos_y_en_lista(self):
+        filtros = facetas.leer_filtros(QueryDict('precio=50-200&en_stock=1&marca=x'))
+        self.assertEqual(filtros, facetas.Filtros(precio='50-200', en_stock=True))
+        esperados = ['P2']
+        self.assertEqual([p.nombre for p in facetas.aplicar(Producto.objects.all(), filtros)], esperados)
+        self.assertEqual([p.nombre for p in facetas.filtrar_lista(Producto.objects.all(), filtros)], esperados)
+
+    def test_catalogo_filtrado(self):
+        response = self.client.get(reverse('compra'), {'marca': self.zeta.pk, 'vip': '1'})
+        self.assertEqual([p.nombre for p in response.context['Productos']], ['P3'])
+        self.assertEqual(response.context['facetas']['total'], 1)
+        self.assertContains(response, 'Acme</a> (1)')
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(reverse('compra'), {'marca': self.acme.pk})
+        # Página nueva, pero el cubo y las marcas ya están en caché
+        self.assertEqual(len(consultas), 1)
+
+    def test_busqueda_filtrada(self):
+        response = self.client.get(reverse('buscar'), {'buscar_post': 'acme', 'precio': '50-200'})
+        self.assertEqual(sorted(p.nombre for p in response.context['Productos']), ['P1', 'P2'])
+        self.assertEqual(response.context['facetas']['precios'][0]['n'], 1)
+
+
+class AuditoriaConsultasTests(TestCase):
+
+    def test_ninguna_pagina_recorre_tablas_enteras(self):
+        salida = StringIO()
+        call_command('auditar_consultas', stdout=salida)
+        self.assertNotIn('escaneos', salida.getvalue())
+        self.assertFalse(Marca.objects.filter(nombre__startswith='auditoria-').exists())
+
+    def test_detecta_un_escaneo(self):
+        from .management.commands.auditar_consultas import Command
+        sql = 'SELECT "tienda_producto"."id" FROM "tienda_producto" WHERE "tienda_producto"."modelo" = %s'
+        self.assertEqual(len(list(Command().escaneos(sql, ['X']))), 1)
+        self.assertEqual(list(Command().escaneos(sql.replace('modelo', 'nombre'), ['X'])), [])
+
+
+class PerfilConsultasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marcas = [Marca.objects.create(nombre=f'Marca {i}') for i in range(3)]
+        for i, marca in enumerate(marcas):
+            Producto.objects.create(marca=marca, nombre=f'P{i}', modelo=f'M{i}', unidades=1, precio=10)
+        cls.staff = User.objects.create_user('jefe', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        perfil_consultas.reiniciar()
+
+    def test_desactivado_no_añade_cabeceras(self):
+        self.assertNotIn('X-DB-Consultas', self.client.get(reverse('compra')))
+
+    def test_detecta_consultas_repetidas_y_su_origen(self):
+        registro = perfil_consultas.Registro()
+        with connection.execute_wrapper(registro):
+            marcas = [producto.marca.nombre for producto in Producto.objects.all()]
+        self.assertEqual(len(marcas), 3)
+        [duplicada] = registro.duplicadas()
+        self.assertEqual(duplicada['veces'], 3)
+        self.assertIn('tienda/tests.py:', duplicada['origen'])
+        self.assertEqual(perfil_consultas.forma('SELECT 1 WHERE id IN (%s, %s, %s)'),
+                         perfil_consultas.forma('SELECT 1 WHERE id IN (%s, %s)'))
+
+    @override_settings(TIENDA_PERFILAR_CONSULTAS=True)
+    def test_cabeceras_y_pagina_de_staff(self):
+        with self.assertLogs('tienda.consultas') as logs:
+            response = self.client.get(reverse('compra'))
+            self.client.force_login(self.staff)
+            pagina = self.client.get(reverse('perfil_consultas'))
+        linea = json.loads(logs.records[0].getMessage())
+        self.assertEqual(linea['vista'], 'compra')
+        self.assertEqual(int(response['X-DB-Consultas']), linea['consultas'])
+        self.assertEqual(response['X-DB-Duplicadas'], '0')
+        self.assertEqual([vista['vista'] for vista in pagina.context['vistas']], ['compra'])
+
+    @override_settings(TIENDA_PERFILAR_CONSULTAS=True)
+    def test_las_rutas_sin_vista_comparten_entrada(self):
+        with self.assertLogs('tienda.consultas'):
+            for ruta in ('/no-existe/1', '/no-existe/2'):
+                self.assertEqual(self.client.get(ruta).status_code, 404)
+        [vista] = perfil_consultas.peores_vistas()
+        self.assertEqual((vista['vista'], vista['peticiones']), (perfil_consultas.SIN_RESOLVER, 2))
+
+
+class GenerarDatosYBenchTests(TestCase):
+
+    def test_datos_deterministas_y_bench_en_json(self):
+        opciones = {'marcas': 3, 'productos': 40, 'clientes': 5, 'compras': 60, 'comentarios': 20, 'lote': 16,
+                    'stdout': StringIO()}
+        call_command('generar_datos', semilla=1, **opciones)
+        self.assertEqual(Producto.objects.count(), 40)
+        self.assertEqual(Compra.objects.count(), 60)
+        self.assertEqual(VentasProducto.objects.aggregate(total=Sum('unidades'))['total'],
+                         Compra.objects.aggregate(total=Sum('unidades'))['total'])
+        primera = list(Producto.objects.order_by('modelo').values_list('nombre', 'precio'))
+        with self.assertRaises(CommandError):
+            call_command('generar_datos', semilla=1, **opciones)
+        Producto.objects.all().delete()
+        Marca.objects.all().delete()
+        User.objects.all().delete()
+        call_command('generar_datos', semilla=1, **opciones)
+        self.assertEqual(list(Producto.objects.order_by('modelo').values_list('nombre', 'precio')), primera)
+
+        with tempfile.TemporaryDirectory() as directorio:
+            salida = os.path.join(directorio, 'bench.json')
+            call_command('bench_endpoints', repeticiones=2, calentamiento=0, rutas='compra,checkout', salida=salida,
+                         stdout=StringIO())
+            with open(salida) as fichero:
+                informe = json.load(fichero)
+            self.assertEqual({fila['ruta']: fila['estado'] for fila in informe['rutas']},
+                             {'compra': 200, "compra {'orden': '-precio'}": 200,
+                              "compra {'marca': 'marca', 'precio': '0-50', 'en_stock': '1'}": 200, 'checkout': 200,
+                              "POST checkout {'unidades': '1'}": 302})
+            # Las compras de la ruta POST se deshacen después de cada petición
+            self.assertEqual(Compra.objects.count(), 60)
+            call_command('bench_endpoints', repeticiones=2, calentamiento=0, rutas='checkout', comparar=salida,
+                         margen_ms=1000, stdout=StringIO())
+
+
+class ImportarProductosTests(TestCase):
+
+    def importar(self, contenido, extension='csv', **opciones):
+        with tempfile.NamedTemporaryFile('w', suffix=f'.{extension}', delete=False) as fichero:
+            fichero.write(contenido)
+        self.addCleanup(os.remove, fichero.name)
+        salida, errores = StringIO(), StringIO()
+        call_command('importar_productos', fichero.name, lote=2, stdout=salida, stderr=errores, **opciones)
+        return salida.getvalue().splitlines()[-1], errores.getvalue()
+
+    def test_crea_actualiza_y_rechaza(self):
+        Marca.objects.create(nombre='Acme')
+        csv_ = ('marca,modelo,nombre,unidades,precio,vip\n'
+                'Acme,A1,Tostadora,5,19.90,1\n'
+                'Nueva,N1,Nevera,2,399,\n'
+                ',X,Sin marca,1,1,\n'
+                'Acme,A2,Batidora,muchas,10,\n')
+        resumen, errores = self.importar(csv_)
+        self.assertIn('2 creados, 0 actualizados, 0 sin cambios, 2 rechazados', resumen)
+        self.assertIn('fila 4: falta marca', errores)
+        self.assertIn('fila 5: unidades no válido', errores)
+        tostadora = Producto.objects.get(modelo='A1')
+        self.assertEqual((tostadora.precio, tostadora.vip, tostadora.marca.nombre), (Decimal('19.90'), True, 'Acme'))
+        self.assertEqual([p.modelo for p in buscar_productos('nevera')], ['N1'])
+
+        resumen, _ = self.importar(csv_.replace('Nevera,2,399', 'Nevera XL,2,399'))
+        self.assertIn('0 creados, 1 actualizados, 1 sin cambios', resumen)
+        self.assertEqual([p.modelo for p in buscar_productos('xl')], ['N1'])
+
+    def test_solo_cambios_de_precio_y_stock(self):
+        marca = Marca.objects.create(nombre='Acme')
+        Producto.objects.create(marca=marca, modelo='A1', nombre='Tostadora', unidades=5, precio=20)
+        Producto.objects.create(marca=marca, modelo='A2', nombre='Batidora', unidades=3, precio=30)
+        jsonl = ('{"marca": "Acme", "modelo": "A1", "precio": "18.5"}\n'
+                 '{"marca": "Acme", "modelo": "A2", "unidades": 3}\n'
+                 '{"marca": "Acme", "modelo": "A3", "unidades": 1}\n'
+                 '{"marca": "Otra", "modelo": "B1", "unidades": 1}\n'
+                 'no es json\n')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            resumen, errores = self.importar(jsonl, 'jsonl', solo_cambios=True)
+        self.assertIn('0 creados, 1 actualizados, 1 sin cambios, 3 rechazados', resumen)
+        self.assertIn('el producto no existe', errores)
+        self.assertIn("no existe la marca 'Otra'", errores)
+        self.assertIn('JSON no válido', errores)
+        self.assertEqual(list(Producto.objects.order_by('modelo').values_list('precio', 'unidades', 'nombre')),
+                         [(Decimal('18.50'), 5, 'Tostadora'), (Decimal('30.00'), 3, 'Batidora')])
+        self.assertFalse(Marca.objects.filter(nombre='Otra').exists())
+        self.assertTrue(callbacks)
+
+    def test_solo_cambios_no_pisa_las_columnas_que_no_trae(self):
+        marca = Marca.objects.create(nombre='Acme')
+        producto = Producto.objects.create(marca=marca, modelo='A1', nombre='Tostadora', unidades=5, precio=20)
+
+        class VentaEntreMedias(Importador):
+            def existentes(self, filas):
+                # Una compra entre la lectura del lote y su escritura
+                leidos = super().existentes(filas)
+                Producto.objects.filter(pk=producto.pk).update(unidades=F('unidades') - 2)
+                return leidos
+
+        VentaEntreMedias(solo_cambios=True).importar([(1, {'marca': 'Acme', 'modelo': 'A1', 'precio': '18.5'})])
+        producto.refresh_from_db()
+        self.assertEqual((producto.precio, producto.unidades), (Decimal('18.50'), 3))
+
+
+class AdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        marca = Marca.objects.create(nombre='Acme')
+        cls.productos = [Producto.objects.create(marca=marca, nombre=f'Producto {i}', modelo=f'M{i}', unidades=5,
+                                                 precio=10) for i in range(3)]
+        cls.cliente = Cliente.objects.create(user=User.objects.create_user('comprador'), saldo=100)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def crear_compras(self, n):
+        ahora = timezone.now()
+        Compra.objects.bulk_create(
+            Compra(producto=self.productos[i % 3], user=self.cliente, unidades=1, importe=10,
+                   fecha=ahora - datetime.timedelta(minutes=Compra.objects.count() + i)) for i in range(n))
+
+    def consultas(self, url, datos=None):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url, datos)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, len(consultas)
+
+    def test_listados_sin_consultas_por_fila(self):
+        for modelo, crear in (('compra', self.crear_compras), ('producto', None)):
+            url = reverse(f'admin:tienda_{modelo}_changelist')
+            if crear:
+                crear(2)
+            _, pocas = self.consultas(url)
+            if crear:
+                crear(20)
+            else:
+                Producto.objects.bulk_create(Producto(marca=self.productos[0].marca, nombre='Otro', modelo=f'O{i}',
+                                                      unidades=1, precio=1) for i in range(20))
+            _, muchas = self.consultas(url)
+            self.assertEqual(pocas, muchas, modelo)
+
+    def test_formulario_de_compra_sin_desplegables(self):
+        respuesta, _ = self.consultas(reverse('admin:tienda_compra_add'))
+        self.assertNotContains(respuesta, f'<option value="{self.productos[0].pk}"')
+        self.assertContains(respuesta, 'vForeignKeyRawIdAdminField')
+
+    def test_compras_de_solo_lectura(self):
+        respuesta = self.client.post(reverse('admin:tienda_compra_add'), {
+            'producto': self.productos[0].pk, 'user': self.cliente.pk, 'fecha_0': '2024-03-01', 'fecha_1': '10:00',
+            'unidades': 2, 'importe': 20, 'iva': '0.21'})
+        self.assertEqual(respuesta.status_code, 302)
+        compra = Compra.objects.get()
+        self.assertEqual(VentasProducto.objects.get(producto=self.productos[0]).unidades, 2)
+        respuesta, _ = self.consultas(reverse('admin:tienda_compra_change', args=[compra.pk]))
+        self.assertNotContains(respuesta, 'name="unidades"')
+        self.assertEqual(self.client.post(reverse('admin:tienda_compra_delete', args=[compra.pk]),
+                                          {'post': 'yes'}).status_code, 403)
+        self.assertTrue(Compra.objects.exists())
+
+    def test_comentarios_mantienen_el_resumen_de_valoraciones(self):
+        producto, otro = self.productos[:2]
+        self.client.post(reverse('admin:tienda_comentario_add'), {'producto': producto.pk, 'valoracion': 5})
+        comentario = Comentario.objects.get()
+        self.client.post(reverse('admin:tienda_comentario_change', args=[comentario.pk]),
+                         {'producto': producto.pk, 'valoracion': 3})
+        producto.refresh_from_db()
+        self.assertEqual((producto.num_valoraciones, producto.estrellas_3, producto.estrellas_5), (1, 1, 0))
+        self.client.post(reverse('admin:tienda_comentario_change', args=[comentario.pk]),
+                         {'producto': otro.pk, 'valoracion': 4})
+        resumenes = dict(Producto.objects.values_list('pk', 'num_valoraciones'))
+        self.assertEqual((resumenes[producto.pk], resumenes[otro.pk]), (0, 1))
+        self.client.post(reverse('admin:tienda_comentario_changelist'),
+                         {'action': 'delete_selected', '_selected_action': [comentario.pk], 'post': 'yes'})
+        self.assertFalse(Comentario.objects.exists())
+        self.assertFalse(Producto.objects.exclude(num_valoraciones=0, estrellas_4=0).exists())
+
+    def test_busquedas(self):
+        self.crear_compras(3)
+        compra = Compra.objects.order_by('pk').first()
+        respuesta, _ = self.consultas(reverse('admin:tienda_compra_changelist'), {'q': str(compra.pk)})
+        self.assertEqual(list(respuesta.context['cl'].result_list), [compra])
+        respuesta, _ = self.consultas(reverse('admin:tienda_compra_changelist'), {'q': 'abc'})
+        self.assertEqual(len(respuesta.context['cl'].result_list), 0)
+        respuesta, _ = self.consultas(reverse('admin:tienda_producto_changelist'), {'q': 'producto'})
+        self.assertEqual(len(respuesta.context['cl'].result_list), 3)
+
+    def test_conteo_estimado_en_tablas_grandes(self):
+        from .admin import UMBRAL_ESTIMACION, ConteoEstimadoPaginator
+        self.crear_compras(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute("UPDATE sqlite_stat1 SET stat = %s WHERE tbl = 'tienda_compra'",
+                           [f'{UMBRAL_ESTIMACION * 5} 1'])
+            cursor.execute('ANALYZE sqlite_schema')  # recarga las estadísticas modificadas
+        with self.assertNumQueries(1):
+            self.assertEqual(ConteoEstimadoPaginator(Compra.objects.order_by('-fecha'), 50).count, UMBRAL_ESTIMACION * 5)
+        # Con filtros se cuenta de verdad
+        self.assertEqual(ConteoEstimadoPaginator(Compra.objects.filter(unidades=1).order_by('-fecha'), 50).count, 3)
+
+
+class ClienteYSesionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('comprador', password='x')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=100)
+        marca = Marca.objects.create(nombre='Acme')
+        cls.producto = Producto.objects.create(marca=marca, nombre='Tostadora', modelo='T1', unidades=5, precio=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cliente_perezoso_y_una_sola_consulta(self):
+        from django.test import RequestFactory
+        request = RequestFactory().get('/')
+        request.user = self.user
+        perfil_consultas.ClienteMiddleware(lambda request: None)(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.cliente.pk, self.cliente.pk)
+            self.assertEqual(request.cliente.user.username, 'comprador')
+            self.assertEqual(request.cliente.saldo, 100)
+        request.user = User.objects.create_user('sin_ficha')
+        del request._cliente
+        self.assertFalse(perfil_consultas.obtener_cliente(request))
+
+    def test_compra_con_request_cliente(self):
+        self.client.force_login(self.user)
+        respuesta = self.client.post(reverse('checkout', kwargs={'pk': self.producto.pk}), {'unidades': 2})
+        self.assertRedirects(respuesta, reverse('welcome'), fetch_redirect_response=False)
+        self.cliente.refresh_from_db()
+        self.assertEqual(self.cliente.saldo, 80)
+        self.client.force_login(User.objects.create_user('sin_ficha'))
+        respuesta = self.client.post(reverse('checkout', kwargs={'pk': self.producto.pk}), {'unidades': 1})
+        self.assertEqual(respuesta.status_code, 404)
+
+    # El motor por defecto con CACHE_URL compartida (ver config/settings/base.py)
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_la_sesion_se_lee_de_la_cache(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('menu'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.client.get(reverse('menu')).status_code, 200)
+        self.assertFalse([c['sql'] for c in consultas if 'django_session' in c['sql']])
+        # Sin la caché (p. ej. tras reiniciar) la sesión sigue en la base de datos
+        cache.clear()
+        respuesta = self.client.get(reverse('menu'))
+        self.assertEqual(respuesta.context['user'], self.user)
+
+
+@override_settings(TIENDA_REPLICA='replica_pruebas')
+class ReplicaTests(TransactionTestCase):
+    """Primaria y réplica en dos ficheros SQLite distintos, con datos distintos en cada uno. La réplica
+    usa un alias propio para no depender de DATABASE_REPLICA_URL, que en los tests es un espejo."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directorio = tempfile.mkdtemp()
+        connections.settings['replica_pruebas'] = {**connections.settings['default'],
+                                                   'NAME': os.path.join(cls.directorio, 'replica.sqlite3')}
+        call_command('migrate', database='replica_pruebas', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica_pruebas'].close()
+        del connections['replica_pruebas']
+        del connections.settings['replica_pruebas']
+        shutil.rmtree(cls.directorio)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        for alias in ('default', 'replica_pruebas'):
+            marca = Marca.objects.using(alias).create(pk=1, nombre='Acme')
+            Producto.objects.using(alias).create(pk=1, marca=marca, nombre='Tostadora', modelo='T1', unidades=5,
+                                                 precio=10)
+            Comentario.objects.using(alias).create(producto_id=1, comentario=f'leido de {alias}')
+        self.user = User.objects.create_user('comprador')
+        Cliente.objects.create(user=self.user, saldo=100)
+
+    def tearDown(self):
+        Producto.objects.using('replica_pruebas').all().delete()
+        Marca.objects.using('replica_pruebas').all().delete()
+
+    def comentario(self):
+        respuesta = self.client.get(reverse('comentarios_producto', kwargs={'pk': 1}), {'formato': 'json'})
+        return respuesta.json()['comentarios'][0]['comentario']
+
+    def test_lecturas_en_replica_y_primaria_tras_escribir(self):
+        self.assertEqual(self.comentario(), 'leido de replica_pruebas')
+        self.client.force_login(self.user)
+        respuesta = self.client.post(reverse('checkout', kwargs={'pk': 1}), {'unidades': 1})
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(respuesta.cookies[replicas.COOKIE]['max-age'], 5)
+        self.assertEqual(Producto.objects.get(pk=1).unidades, 4)
+        self.assertEqual(self.comentario(), 'leido de default')
+        del self.client.cookies[replicas.COOKIE]
+        self.assertEqual(self.comentario(), 'leido de replica_pruebas')
+
+    def test_router(self):
+        router = replicas.RouterReplica()
+        token = replicas._estado.set(replicas._Estado(primaria=False))
+        try:
+            self.assertIsNone(router.db_for_read(Producto))
+            replicas.leer_de_replica(lambda: None)()
+            self.assertEqual(router.db_for_read(Producto), 'replica_pruebas')
+            self.assertIsNone(router.db_for_read(User))
+            with replicas.en_primaria():
+                self.assertIsNone(router.db_for_read(Producto))
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Producto))
+            leido = Producto.objects.using('replica_pruebas').get()
+            # Sesiones y versiones de los validadores no fijan al usuario a la primaria
+            for modelo in (Session, VersionCatalogo):
+                self.assertEqual(router.db_for_write(modelo), 'default')
+            self.assertFalse(replicas._estado.get().escrito)
+            self.assertEqual(router.db_for_write(Producto, instance=leido), 'default')
+            self.assertTrue(replicas._estado.get().escrito)
+        finally:
+            replicas._estado.reset(token)
+        self.assertIsNone(router.db_for_read(Producto))
+
+
+class ProduccionTests(TestCase):
+
+    def test_estaticos_con_hash_y_comprimidos(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        almacen = 'config.estaticos.ManifestComprimidoStorage'
+        with override_settings(STATIC_ROOT=directorio, STATICFILES_STORAGE=almacen):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            from django.contrib.staticfiles.storage import staticfiles_storage
+            nombre = staticfiles_storage.stored_name('css/tienda.css')
+        self.assertNotEqual(nombre, 'css/tienda.css')
+        with open(os.path.join(directorio, nombre), 'rb') as original, \
+                gzip.open(os.path.join(directorio, nombre + '.gz')) as comprimido:
+            self.assertEqual(comprimido.read(), original.read())
+
+    def test_bench_rps(self):
+        marca = Marca.objects.create(nombre='Acme')
+        Producto.objects.create(marca=marca, nombre='Tostadora', modelo='T1', unidades=5, precio=10)
+        with tempfile.TemporaryDirectory() as directorio:
+            salida = os.path.join(directorio, 'rps.json')
+            call_command('bench_rps', segundos=0.2, rutas='checkout,menu', salida=salida, stdout=StringIO())
+            call_command('bench_rps', segundos=0.2, rutas='checkout,menu', comparar=salida, stdout=StringIO())
+            with open(salida) as fichero:
+                informe = json.load(fichero)
+        self.assertEqual([fila['estado'] for fila in informe['rutas']], [200, 200])
+        self.assertGreater(informe['peticiones'], 0)
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+
+URLS_ASYNC = types.ModuleType('urls_async')
+URLS_ASYNC.urlpatterns = urls_main.patrones(asincronas=True)
+
+
+class VistasAsyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ana', password='x')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=100)
+        marca = Marca.objects.create(nombre='Acme')
+        cls.productos = [Producto.objects.create(marca=marca, nombre=f'Portátil {i}', modelo=f'P{i}', unidades=5,
+                                                 precio=10 + i) for i in range(3)]
+        Comentario.objects.create(producto=cls.productos[0], comentario='bueno', valoracion=5)
+        realizar_compra(cls.cliente, cls.productos[1].pk, 2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    async def pedir_ambas(self, nombre, kwargs=None, parametros=None):
+        """La misma página con las vistas síncronas y con las asíncronas."""
+        direccion = reverse(nombre, kwargs=kwargs)
+        sincrona = await self.async_client.get(direccion, parametros or {})
+        with override_settings(ROOT_URLCONF=URLS_ASYNC):
+            asincrona = await self.async_client.get(direccion, parametros or {})
+            self.assertTrue(asyncio.iscoroutinefunction(asincrona.resolver_match.func))
+        self.assertFalse(asyncio.iscoroutinefunction(sincrona.resolver_match.func))
+        return sincrona, asincrona
+
+    async def test_mismo_contenido_que_las_vistas_sincronas(self):
+        for nombre, kwargs, parametros, claves in [
+            ('compra', None, {'orden': '-precio'}, ['Productos', 'filtros', 'facetas']),
+            ('buscar', None, {'buscar_post': 'portatil'}, ['Productos', 'facetas']),
+            ('checkout', {'pk': self.productos[0].pk}, None, ['producto', 'comentarios', 'siguiente']),
+            ('top_productos', None, None, ['topP']),
+            ('top_clientes', None, None, ['clientes']),
+            ('historial', None, None, ['compras']),
+        ]:
+            sincrona, asincrona = await self.pedir_ambas(nombre, kwargs, parametros)
+            self.assertEqual(asincrona.status_code, 200, nombre)
+            for clave in claves:
+                valores = [respuesta.context[clave] for respuesta in (asincrona, sincrona)]
+                if clave in ('Productos', 'comentarios', 'topP', 'clientes', 'compras'):
+                    valores = [list(valor) for valor in valores]
+                self.assertEqual(*valores, f'{nombre}: {clave}')
+
+    @override_settings(ROOT_URLCONF=URLS_ASYNC)
+    def test_ficha_de_producto_sesion_404_y_compra(self):
+        url = reverse('checkout', kwargs={'pk': self.productos[2].pk})
+        self.assertEqual(self.client.get(reverse('checkout', kwargs={'pk': 999})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('historial'), {'page': 99}).status_code, 404)
+        # La compra (POST) la atiende la vista síncrona
+        respuesta = self.client.post(url, {'unidades': 1})
+        self.assertRedirects(respuesta, reverse('welcome'), fetch_redirect_response=False)
+        self.assertEqual(Compra.objects.filter(producto=self.productos[2]).count(), 1)
+        self.client.logout()
+        self.assertTrue(self.client.get(url)['Location'].startswith(reverse('login')))
+        # Sin sesión no hay 304 aunque el ETag coincida: la autenticación va antes
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 302)
+
+
+class ValidadoresHttpTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ana', password='x')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=100)
+        cls.marca = Marca.objects.create(nombre='Acme')
+        cls.productos = [Producto.objects.create(marca=cls.marca, nombre=f'Tele {i:02d}', modelo=f'T{i}', unidades=5,
+                                                 precio=10 + i) for i in range(30)]
+
+    def setUp(self):
+        cache.clear()
+
+    def cambiar(self, producto, **campos):
+        with self.captureOnCommitCallbacks(execute=True):
+            for campo, valor in campos.items():
+                setattr(producto, campo, valor)
+            producto.save()
+
+    def test_versiones_persistentes(self):
+        clave = versiones.clave_producto(self.productos[0].pk)
+        antes = versiones.leer([clave])[clave]
+        with self.assertNumQueries(1):
+            versiones.registrar_cambios([clave, versiones.clave_producto(999)])
+        fila = VersionCatalogo.objects.get(clave=clave)
+        self.assertEqual(fila.version, antes[0] + 1)
+        self.assertGreaterEqual(fila.actualizado, antes[1])
+        self.assertEqual(VersionCatalogo.objects.get(clave=versiones.clave_producto(999)).version, 1)
+
+    def test_catalogo_304_sin_consultas(self):
+        url = reverse('compra')
+        respuesta = self.client.get(url, {'orden': 'precio'})
+        etag = respuesta['ETag']
+        self.assertIn('no-cache', respuesta['Cache-Control'])
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(url, {'orden': 'precio'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertFalse(respuesta.content)
+        # Otra página u otro usuario tienen su propio ETag
+        self.assertEqual(self.client.get(url, {'orden': 'nombre'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url, {'orden': 'precio'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.logout()
+        # Sobrevive a vaciar la caché; cambia con el catálogo
+        cache.clear()
+        self.assertEqual(self.client.get(url, {'orden': 'precio'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.cambiar(self.productos[3], nombre='Radio')
+        respuesta = self.client.get(url, {'orden': 'precio'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+    def test_pagina_del_producto(self):
+        self.client.force_login(self.user)
+        url = reverse('checkout', kwargs={'pk': self.productos[0].pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Cambiar otro producto no la afecta; una compra de éste (cambia el stock) sí
+        self.cambiar(self.productos[1], nombre='Radio')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            realizar_compra(self.cliente, self.productos[0].pk, 1)
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['producto'].unidades, 4)
+        etag = respuesta['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.marca.nombre = 'Nueva'
+            self.marca.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(reverse('checkout', kwargs={'pk': 999})).status_code, 404)
+
+    def test_api_json_con_cursor_y_validadores(self):
+        url = reverse('api_catalogo')
+        vistos, cursor, etags = [], None, []
+        while True:
+            respuesta = self.client.get(url, {'orden': '-precio', **({'cursor': cursor} if cursor else {})})
+            datos = respuesta.json()
+            vistos += [producto['nombre'] for producto in datos['productos']]
+            etags.append((cursor, respuesta['ETag'], respuesta['Last-Modified']))
+            cursor = datos['siguiente']
+            if not cursor:
+                break
+        self.assertEqual(vistos, [f'Tele {i:02d}' for i in range(29, -1, -1)])
+        self.assertIn('public', respuesta['Cache-Control'])
+        # Revalidación incremental: ninguna página ha cambiado
+        for cursor, etag, modificado in etags:
+            parametros = {'orden': '-precio', **({'cursor': cursor} if cursor else {})}
+            self.assertEqual(self.client.get(url, parametros, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url, parametros, HTTP_IF_MODIFIED_SINCE=modificado).status_code, 304)
+        self.cambiar(self.productos[0], unidades=0)
+        respuesta = self.client.get(url, {'orden': '-precio'}, HTTP_IF_NONE_MATCH=etags[0][1])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['productos'][0]['en_stock'], True)
+
+    @override_settings(ROOT_URLCONF=URLS_ASYNC)
+    def test_vistas_asincronas(self):
+        self.client.force_login(self.user)
+        for url in (reverse('compra'), reverse('checkout', kwargs={'pk': self.productos[0].pk})):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class VentasPeriodoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme, cls.zeta = Marca.objects.create(nombre='Acme'), Marca.objects.create(nombre='Zeta')
+        cls.tele = Producto.objects.create(marca=cls.acme, nombre='Tele', modelo='T1', unidades=50, precio=100)
+        cls.radio = Producto.objects.create(marca=cls.zeta, nombre='Radio', modelo='R1', unidades=50, precio=10)
+        cls.staff = User.objects.create_user('jefa', is_staff=True)
+        cls.cliente = Cliente.objects.create(user=cls.staff, saldo=10000)
+        # Marzo y abril de 2024; la de las 23:30 UTC del 31 de marzo es ya 1 de abril en Madrid
+        for producto, unidades, fecha in ((cls.tele, 1, (2024, 3, 1, 10)), (cls.tele, 2, (2024, 3, 15, 10)),
+                                          (cls.radio, 5, (2024, 3, 15, 11)), (cls.tele, 1, (2024, 3, 31, 23, 30)),
+                                          (cls.radio, 1, (2024, 4, 2, 10))):
+            Compra.objects.create(producto=producto, user=cls.cliente, unidades=unidades,
+                                  importe=unidades * producto.precio,
+                                  fecha=datetime.datetime(*fecha, tzinfo=datetime.timezone.utc))
+
+    def fila(self, periodo, dimension, clave, inicio):
+        return VentasPeriodo.objects.filter(periodo=periodo, dimension=dimension, clave=clave,
+                                            inicio=inicio).values_list('unidades', 'importe', 'compras').first()
+
+    def test_registro_incremental_por_dia_y_mes_en_hora_local(self):
+        self.assertEqual(self.fila('dia', 'producto', self.tele.pk, datetime.date(2024, 3, 15)), (2, 200, 1))
+        self.assertEqual(self.fila('dia', 'total', 0, datetime.date(2024, 3, 15)), (7, 250, 2))
+        self.assertEqual(self.fila('dia', 'total', 0, datetime.date(2024, 4, 1)), (1, 100, 1))
+        self.assertEqual(self.fila('mes', 'marca', self.acme.pk, datetime.date(2024, 3, 1)), (3, 300, 2))
+        self.assertEqual(self.fila('mes', 'cliente', self.cliente.pk, datetime.date(2024, 4, 1)), (2, 110, 2))
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            realizar_compra(self.cliente, self.radio.pk, 3)
+        self.assertEqual(self.fila('dia', 'marca', self.zeta.pk, timezone.localdate()), (3, 30, 1))
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+
+    def test_relleno_desde_una_fecha(self):
+        VentasPeriodo.objects.all().delete()
+        call_command('agregados_ventas', desde=datetime.date(2024, 3, 20), stdout=StringIO())
+        # Sólo los días desde el 20 y los meses desde marzo, que se recalcula entero
+        self.assertIsNone(self.fila('dia', 'total', 0, datetime.date(2024, 3, 15)))
+        self.assertEqual(self.fila('mes', 'total', 0, datetime.date(2024, 3, 1)), (8, 350, 3))
+        call_command('agregados_ventas', '--verificar', desde=datetime.date(2024, 3, 20), stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('agregados_ventas', '--verificar', stdout=StringIO())
+        call_command('agregados_ventas', stdout=StringIO())
+        call_command('agregados_ventas', '--verificar', stdout=StringIO())
+
+    def test_informe_por_rango_marca_y_tendencia(self):
+        self.client.force_login(self.staff)
+        url = reverse('informe_ventas')
+        with self.assertNumQueries(5):  # sesión, usuario, serie, ranking y nombres
+            datos = self.client.get(url, {'desde': '2024-04-01', 'hasta': '2024-04-30', 'formato': 'json'}).json()
+        self.assertEqual(datos['periodo'], 'dia')
+        self.assertEqual(len(datos['serie']), 30)
+        self.assertEqual(datos['serie'][0]['inicio'], '2024-04-01')
+        self.assertEqual((datos['serie'][0]['unidades'], Decimal(datos['serie'][0]['importe'])), (1, 100))
+        # Periodo anterior: del 2 al 31 de marzo. Acme 200 -> 100, Zeta 50 -> 10
+        self.assertEqual([(f['nombre'], Decimal(f['importe']), f['variacion']) for f in datos['ranking']],
+                         [('Acme', 100, -0.5), ('Zeta', 10, -0.8)])
+
+        datos = self.client.get(url, {'desde': '2024-01-01', 'hasta': '2024-12-31', 'dimension': 'marca',
+                                      'clave': self.zeta.pk, 'formato': 'json'}).json()
+        self.assertEqual(datos['periodo'], 'mes')
+        self.assertEqual([Decimal(f['importe']) for f in datos['serie']][2:4], [50, 10])
+        self.assertEqual(datos['ranking'], [])
+
+        respuesta = self.client.get(url, {'desde': '2024-03-01', 'hasta': '2024-03-31', 'dimension': 'producto'})
+        self.assertContains(respuesta, 'Tele')
+        self.assertEqual(self.client.get(url, {'desde': '2024-03-02', 'hasta': '2024-03-01'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+
+class ReservasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.tele = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=10, precio=100)
+        cls.radio = Producto.objects.create(marca=marca, nombre='Radio', modelo='R1', unidades=10, precio=10)
+        cls.user = User.objects.create_user('ana')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=10000)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def agregar(self, producto, unidades, cliente=None):
+        return (cliente or self.client).post(reverse('agregar_al_carrito'),
+                                             {'producto_id': producto.pk, 'unidades': unidades})
+
+    def stock(self, producto):
+        return Producto.objects.values_list('unidades', flat=True).get(pk=producto.pk)
+
+    def test_anadir_reserva_y_el_pago_no_vuelve_a_tocar_el_producto(self):
+        self.agregar(self.tele, 6)
+        self.agregar(self.tele, 2)
+        self.agregar(self.radio, 1)
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (2, 9))
+        self.assertEqual(Reserva.objects.get(producto=self.tele).unidades, 8)
+        self.assertIsNotNone(self.client.get(reverse('ver_carrito')).context['reservado_hasta'])
+
+        # Otra sesión ya no encuentra las unidades reservadas
+        otro = self.client_class()
+        otro.force_login(User.objects.create_user('luis'))
+        respuesta = self.agregar(self.tele, 3, otro)
+        self.assertContains(respuesta, 'No quedan unidades suficientes')
+        self.assertNotIn('carrito', otro.session)
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertRedirects(self.client.post(reverse('checkout_carrito')), reverse('welcome'),
+                                 fetch_redirect_response=False)
+        self.assertFalse([q for q in consultas if q['sql'].startswith('UPDATE "tienda_producto"')])
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (2, 9))
+        self.assertFalse(Reserva.objects.exists())
+        self.assertEqual(Pedido.objects.get().importe, 810)
+
+    def test_barrido_devuelve_las_caducadas_por_lotes(self):
+        self.agregar(self.tele, 10)
+        self.agregar(self.radio, 4)
+        reservas.reservar('otra-sesion', self.radio.pk, 3)
+        Reserva.objects.exclude(titular='otra-sesion').update(caduca=timezone.now() - datetime.timedelta(seconds=1))
+        version = cache_catalogo.version_catalogo()
+        with self.captureOnCommitCallbacks(execute=True):
+            salida = StringIO()
+            call_command('liberar_reservas', lote=1, stdout=salida)
+        self.assertEqual(salida.getvalue().strip(), '14 unidades liberadas')
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (10, 7))
+        self.assertEqual(list(Reserva.objects.values_list('titular', flat=True)), ['otra-sesion'])
+        # La tele estaba agotada: vuelve a tener stock en el catálogo
+        self.assertNotEqual(cache_catalogo.version_catalogo(), version)
+
+    def test_pago_con_reservas_caducadas_o_parciales(self):
+        self.agregar(self.tele, 2)
+        self.agregar(self.radio, 5)
+        Reserva.objects.filter(producto=self.tele).update(caduca=timezone.now() - datetime.timedelta(seconds=1))
+        reservas.liberar_caducadas()
+        session = self.client.session
+        # El carrito pide más radios de las reservadas y la tele ya no tiene reserva
+        session['carrito'] = {str(self.tele.pk): 2, str(self.radio.pk): 7}
+        session.save()
+        Producto.objects.filter(pk=self.radio.pk).update(unidades=1)
+        respuesta = self.client.post(reverse('checkout_carrito'))
+        self.assertContains(respuesta, 'No quedan unidades suficientes de: Radio')
+        # Sin stock no se consume ninguna reserva
+        self.assertEqual(Reserva.objects.get().unidades, 5)
+
+        Producto.objects.filter(pk=self.radio.pk).update(unidades=2)
+        self.client.post(reverse('checkout_carrito'))
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (8, 0))
+        self.assertEqual(Compra.objects.get(producto=self.radio).unidades, 7)
+        self.assertFalse(Reserva.objects.exists())
+
+    def test_lo_reservado_de_mas_vuelve_al_stock(self):
+        titular = 'sesion'
+        reservas.reservar(titular, self.tele.pk, 4)
+        reservas.reservar(titular, self.radio.pk, 2)
+        reservas.confirmar(self.cliente, titular, {self.tele.pk: 1})
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (9, 10))
+        with self.assertRaises(StockInsuficiente):
+            reservas.reservar(titular, self.tele.pk, 10)
+        self.assertFalse(Reserva.objects.exists())
+
+    def test_el_stock_absoluto_descuenta_lo_reservado(self):
+        self.agregar(self.tele, 3)
+        self.agregar(self.radio, 4)
+        # Importación (completa y sólo de cambios) y formulario de edición escriben el stock total
+        Importador().importar([(1, {'marca': 'Acme', 'modelo': 'T1', 'nombre': 'Tele', 'unidades': '20',
+                                    'precio': '100'})])
+        Importador(solo_cambios=True).importar([(1, {'marca': 'Acme', 'modelo': 'R1', 'unidades': '6'})])
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (17, 2))
+        self.client.force_login(User.objects.create_user('jefa', is_staff=True))
+        editar = reverse('editar', kwargs={'pk': self.radio.pk})
+        self.assertEqual(self.client.get(editar).context['form'].initial['unidades'], 6)
+        self.client.post(editar, {'nombre': 'Radio', 'modelo': 'R1', 'unidades': 8, 'precio': 10,
+                                  'marca': self.radio.marca_id})
+        self.assertEqual(self.stock(self.radio), 4)
+        Reserva.objects.update(caduca=timezone.now())
+        reservas.liberar_caducadas()
+        self.assertEqual((self.stock(self.tele), self.stock(self.radio)), (20, 8))
+
+
+FALLOS = []
+
+
+@cola.tarea(intentos=2)
+def tarea_que_falla():
+    FALLOS.append(timezone.now())
+    raise ValueError('Servicio externo caído')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', TIENDA_STOCK_BAJO=5,
+                   ADMINS=[('Jefa', 'jefa@example.com')])
+class TareasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nombre='Acme')
+        cls.tele = Producto.objects.create(marca=marca, nombre='Tele', modelo='T1', unidades=7, precio=100)
+        cls.radio = Producto.objects.create(marca=marca, nombre='Radio', modelo='R1', unidades=50, precio=10)
+        cls.user = User.objects.create_user('ana', email='ana@example.com')
+        cls.cliente = Cliente.objects.create(user=cls.user, saldo=10000)
+
+    def trabajar(self, ejecuta=True):
+        with (self.assertLogs if ejecuta else self.assertNoLogs)('tienda.tareas', 'INFO') as logs:
+            call_command('procesar_tareas', '--una-vez', hilos=1, stdout=StringIO())
+        return logs
+
+    def test_la_compra_encola_en_su_transaccion(self):
+        with self.assertRaises(StockInsuficiente):
+            realizar_compra(self.cliente, self.tele.pk, 8)
+        self.assertFalse(Tarea.objects.exists())
+        with transaction.atomic():
+            realizar_compra(self.cliente, self.radio.pk, 1)
+            transaction.set_rollback(True)
+        self.assertFalse(Tarea.objects.exists())
+
+        realizar_compra(self.cliente, self.tele.pk, 3)
+        realizar_pedido(self.cliente, {self.radio.pk: 2, self.tele.pk: 1})
+        self.assertEqual(sorted(Tarea.objects.values_list('nombre', flat=True)),
+                         ['avisar_stock_bajo', 'confirmar_compra', 'confirmar_compra'])
+        self.trabajar()
+        self.assertEqual(set(Tarea.objects.values_list('estado', flat=True)), {Tarea.HECHA})
+        self.assertEqual(len(mail.outbox), 3)
+        confirmacion = next(correo for correo in mail.outbox if correo.to == ['ana@example.com']
+                            and '2 productos' in correo.subject)
+        self.assertIn('Total: 120', confirmacion.body)
+        self.assertTrue(any('Stock bajo' in correo.subject for correo in mail.outbox))
+
+    def test_reintentos_con_espera_hasta_fallar(self):
+        tarea = cola.encolar('tarea_que_falla')
+        self.trabajar()
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.PENDIENTE, 1))
+        self.assertGreater(tarea.disponible, timezone.now())
+        self.assertIn('Servicio externo caído', tarea.error)
+        # Aún no toca: el trabajador no la ejecuta
+        self.trabajar(ejecuta=False)
+        self.assertEqual(len(FALLOS), 1)
+        Tarea.objects.filter(pk=tarea.pk).update(disponible=timezone.now())
+        self.trabajar()
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos, len(FALLOS)), (Tarea.FALLIDA, 2, 2))
+        self.assertEqual(cola.reintentar(Tarea.objects.all()), 1)
+        self.assertEqual(Tarea.objects.get().estado, Tarea.PENDIENTE)
+
+    def test_recupera_tareas_de_un_trabajador_caido(self):
+        tarea = cola.encolar('bienvenida', user_id=self.user.pk)
+        self.assertEqual(cola.reclamar('caido', 10), [tarea])
+        self.assertEqual(cola.reclamar('otro', 10), [])
+        # Pasa el plazo sin que el primero termine
+        Tarea.objects.filter(pk=tarea.pk).update(disponible=timezone.now() - datetime.timedelta(seconds=1))
+        self.trabajar()
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), (Tarea.HECHA, 2))
+        self.assertNotEqual(tarea.trabajador, 'caido')
+        self.assertEqual(mail.outbox[0].subject, 'Bienvenido a la tienda')
+
+    def test_registro_y_estadisticas(self):
+        self.client.post(reverse('registro'), {'username': 'luis', 'email': 'luis@example.com',
+                                               'password1': 'Clave-segura-123', 'password2': 'Clave-segura-123'})
+        self.assertEqual(Tarea.objects.filter(nombre='bienvenida').count(), 1)
+        staff = User.objects.create_user('jefa', is_staff=True)
+        self.client.force_login(staff)
+        datos = self.client.get(reverse('estado_tareas')).json()
+        self.assertEqual((datos['pendientes'], datos['profundidad']), (1, {'bienvenida': {'pendiente': 1}}))
+        logs = self.trabajar()
+        self.assertIn('"espera_ms"', logs.output[0])
+        datos = self.client.get(reverse('estado_tareas')).json()
+        self.assertEqual((datos['pendientes'], datos['muestra']), (0, 1))
+        self.assertIsNotNone(datos['espera']['p95_ms'])
+        salida = StringIO()
+        call_command('procesar_tareas', '--estado', stdout=salida)
+        self.assertEqual(json.loads(salida.getvalue())['profundidad'], {'bienvenida': {'hecha': 1}})
+
+
+class AutocompletarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme, cls.zeta = Marca.objects.create(nombre='Acme'), Marca.objects.create(nombre='Zeta')
+        cls.camara = Producto.objects.create(marca=cls.acme, nombre='Cámara réflex', modelo='CR1', unidades=5,
+                                             precio=500)
+        cls.cable = Producto.objects.create(marca=cls.zeta, nombre='Cable de cámara', modelo='CB2', unidades=5,
+                                            precio=5)
+        cls.camion = Producto.objects.create(marca=cls.zeta, nombre='Camión juguete', modelo='J3', unidades=5,
+                                             precio=20)
+
+    def setUp(self):
+        autocompletar.reiniciar()
+
+    def nombres(self, texto):
+        return [sugerencia['nombre'] for sugerencia in autocompletar.sugerir(texto)]
+
+    def test_prefijos_sin_tildes_y_varias_palabras(self):
+        self.assertEqual(self.nombres('cam'), ['Cámara réflex', 'Cable de cámara', 'Camión juguete'])
+        # Primero los que tienen la palabra completa
+        self.assertEqual(self.nombres('camara'), ['Cámara réflex', 'Cable de cámara'])
+        self.assertEqual(self.nombres('cable'), ['Cable de cámara'])
+        self.assertEqual(self.nombres('cám ref'), ['Cámara réflex'])
+        self.assertEqual(self.nombres('zeta cam'), ['Cable de cámara', 'Camión juguete'])
+        self.assertEqual(self.nombres('cr1'), ['Cámara réflex'])
+        self.assertEqual(self.nombres('  '), [])
+
+        with self.assertNumQueries(0):
+            datos = self.client.get(reverse('autocompletar'), {'q': 'juguete'}).json()
+        self.assertEqual(datos['sugerencias'], [{'id': self.camion.pk, 'nombre': 'Camión juguete', 'marca': 'Zeta',
+                                                 'url': reverse('checkout', args=[self.camion.pk])}])
+        self.assertEqual(self.client.get(reverse('autocompletar'), {'q': 'c', 'limite': 'x'}).status_code, 400)
+
+    def test_se_pone_al_dia_con_los_cambios_del_catalogo(self):
+        self.nombres('cam')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.camara.nombre = 'Objetivo'
+            self.camara.save()
+            self.cable.delete()
+            Producto.objects.create(marca=self.acme, nombre='Camiseta', modelo='T4', unidades=5, precio=10)
+            self.zeta.nombre = 'Omega'
+            self.zeta.save()
+        # Sólo se leen las versiones cambiadas y esos productos, no todo el catálogo
+        with self.assertNumQueries(2):
+            self.assertEqual(self.nombres('cam'), ['Camión juguete', 'Camiseta'])
+        self.assertEqual(self.nombres('obj'), ['Objetivo'])
+        self.assertEqual(self.nombres('omega'), ['Camión juguete'])
+        self.assertEqual(self.nombres('zeta'), [])
+        with self.assertNumQueries(0):
+            self.nombres('cam')
+
+    def test_renombrar_una_marca_grande_reconstruye(self):
+        Producto.objects.bulk_create(Producto(marca=self.acme, nombre=f'Lente {i}', modelo=f'L{i}', unidades=1,
+                                              precio=1) for i in range(autocompletar.MAX_CAMBIOS))
+        self.nombres('cam')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.acme.nombre = 'Fotos'
+            self.acme.save()
+        # Versiones cambiadas, los productos de la marca cortados en MAX_CAMBIOS + 1 y la reconstrucción
+        with self.assertNumQueries(3):
+            self.assertEqual(self.nombres('fotos lente 7')[0], 'Lente 7')
+        self.assertEqual(self.nombres('acme'), [])
+
+    @override_settings(TIENDA_AUTOCOMPLETAR_MAXIMO=2)
+    def test_memoria_acotada(self):
+        self.assertEqual(len(self.nombres('cam')), 2)
+        self.assertEqual(len(autocompletar.obtener_indice().productos), 2)
@@ -1,32 +1,58 @@
+from django.conf import settings
 from django.urls import path
 from .views import CompraView, ProductosView, Post_EditView, Post_eliminarView, Post_Nuevo_View, Log_In_View, Checkout, \
     TopProducto_Views, Log_outView, topClientes_View, historial_View, menuPerfil, EditarGeneralView, \
     EditarDireccionView, EditarTarjetaView, RegistroView, BuscarProductoListView, ComentarioCreateView, \
-    ComentarioUpdateView, AgregarAlCarrito, VerCarritoView, CheckoutCarritoView
+    ComentarioUpdateView, AgregarAlCarrito, VerCarritoView, CheckoutCarritoView, ExportarComprasView, \
+    ComentariosProductoView, EstadisticasCacheView, PerfilConsultasView, CatalogoApiView, InformeVentasView, \
+    EstadoTareasView, AutocompletarView
+from .vistas_async import CompraAsyncView, BuscarProductoAsyncView, ProductoAsyncView, TopProductosAsyncView, \
+    TopClientesAsyncView, HistorialAsyncView
 
-urlpatterns = [
-    path('', CompraView.as_view(), name='welcome'),
-    path('tienda/', CompraView.as_view(), name='compra'),
-    path('tienda/admin/productos', ProductosView.as_view(), name='productos'),
-    path('tienda/admin/editar/<int:pk>', Post_EditView.as_view(), name='editar'),
-    path('tienda/admin/eliminar/<int:pk>', Post_eliminarView.as_view(), name='eliminar'),
-    path('tienda/admin/nuevo/', Post_Nuevo_View.as_view(), name='nuevo'),
-    path('tienda/mostrarBusqueda/', BuscarProductoListView.as_view(), name='buscar'),
-    path('tienda/login/', Log_In_View.as_view(), name='login'),
-    path('tienda/checkout/<int:pk>/', Checkout.as_view(), name='checkout'),
-    path('tienda/logout/', Log_outView.as_view(), name='logout'),
-    path('tienda/informes/top10Compras/', TopProducto_Views.as_view(), name='top_productos'),
-    path('tienda/informes/top10mejores/', topClientes_View.as_view(), name='top_clientes'),
-    path('tienda/informes/historialCompras/', historial_View.as_view(), name='historial'),
-    path('tienda/menuPerfil/', menuPerfil.as_view(), name='menu'),
-    path('tienda/perfil/', EditarGeneralView.as_view(), name='general'),
-    path('tienda/direcciones/', EditarDireccionView.as_view(), name='direcciones'),
-    path('tienda/tarjetas/', EditarTarjetaView.as_view(), name='tarjetas'),
-    path('tienda/registro/', RegistroView.as_view(), name='registro'),
-    path('tienda/comentario_create/<int:pk>/', ComentarioCreateView.as_view(), name='crear_comentario'),
-    path('tienda/comentario_editar/<int:pk>/', ComentarioUpdateView.as_view(), name='editar_comentario'),
-    path('tienda/agregar_al_carrito/', AgregarAlCarrito.as_view(), name='agregar_al_carrito'),
-    path('tienda/ver_carrito/', VerCarritoView.as_view(), name='ver_carrito'),
-    path('tienda/checkout_carrito/', CheckoutCarritoView.as_view(), name='checkout_carrito'),
-    path('tienda/comentario_create/<int:pk>/', ComentarioCreateView.as_view(), name='crear_comentario'),
-]
\ No newline at end of file
+
+def patrones(asincronas=False):
+    """Rutas de la tienda. Con ``asincronas`` las páginas de sólo lectura usan las vistas de
+    vistas_async.py (para ASGI) y el resto las mismas vistas síncronas."""
+    if asincronas:
+        catalogo, busqueda, producto = CompraAsyncView, BuscarProductoAsyncView, ProductoAsyncView
+        top_productos, top_clientes, historial = TopProductosAsyncView, TopClientesAsyncView, HistorialAsyncView
+    else:
+        catalogo, busqueda, producto = CompraView, BuscarProductoListView, Checkout
+        top_productos, top_clientes, historial = TopProducto_Views, topClientes_View, historial_View
+    return [
+        path('', catalogo.as_view(), name='welcome'),
+        path('tienda/', catalogo.as_view(), name='compra'),
+        path('tienda/admin/productos', ProductosView.as_view(), name='productos'),
+        path('tienda/admin/editar/<int:pk>', Post_EditView.as_view(), name='editar'),
+        path('tienda/admin/eliminar/<int:pk>', Post_eliminarView.as_view(), name='eliminar'),
+        path('tienda/admin/nuevo/', Post_Nuevo_View.as_view(), name='nuevo'),
+        path('tienda/admin/cache/', EstadisticasCacheView.as_view(), name='estadisticas_cache'),
+        path('tienda/admin/consultas/', PerfilConsultasView.as_view(), name='perfil_consultas'),
+        path('tienda/admin/tareas/', EstadoTareasView.as_view(), name='estado_tareas'),
+        path('tienda/api/catalogo/', CatalogoApiView.as_view(), name='api_catalogo'),
+        path('tienda/mostrarBusqueda/', busqueda.as_view(), name='buscar'),
+        path('tienda/autocompletar/', AutocompletarView.as_view(), name='autocompletar'),
+        path('tienda/login/', Log_In_View.as_view(), name='login'),
+        path('tienda/checkout/<int:pk>/', producto.as_view(), name='checkout'),
+        path('tienda/checkout/<int:pk>/comentarios/', ComentariosProductoView.as_view(), name='comentarios_producto'),
+        path('tienda/logout/', Log_outView.as_view(), name='logout'),
+        path('tienda/informes/top10Compras/', top_productos.as_view(), name='top_productos'),
+        path('tienda/informes/top10mejores/', top_clientes.as_view(), name='top_clientes'),
+        path('tienda/informes/historialCompras/', historial.as_view(), name='historial'),
+        path('tienda/informes/ventas/', InformeVentasView.as_view(), name='informe_ventas'),
+        path('tienda/informes/historialCompras/exportar/', ExportarComprasView.as_view(), name='exportar_compras'),
+        path('tienda/menuPerfil/', menuPerfil.as_view(), name='menu'),
+        path('tienda/perfil/', EditarGeneralView.as_view(), name='general'),
+        path('tienda/direcciones/', EditarDireccionView.as_view(), name='direcciones'),
+        path('tienda/tarjetas/', EditarTarjetaView.as_view(), name='tarjetas'),
+        path('tienda/registro/', RegistroView.as_view(), name='registro'),
+        path('tienda/comentario_create/<int:pk>/', ComentarioCreateView.as_view(), name='crear_comentario'),
+        path('tienda/comentario_editar/<int:pk>/', ComentarioUpdateView.as_view(), name='editar_comentario'),
+        path('tienda/agregar_al_carrito/', AgregarAlCarrito.as_view(), name='agregar_al_carrito'),
+        path('tienda/ver_carrito/', VerCarritoView.as_view(), name='ver_carrito'),
+        path('tienda/checkout_carrito/', CheckoutCarritoView.as_view(), name='checkout_carrito'),
+        path('tienda/comentario_create/<int:pk>/', ComentarioCreateView.as_view(), name='crear_comentario'),
+    ]
+
+
+urlpatterns = patrones(settings.TIENDA_VISTAS_ASYNC)
@@ -0,0 +1,120 @@
+import functools
+import hashlib
+from calendar import timegm
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.translation import get_language
+
+from . import cache_catalogo, versiones
+from .models import Producto
+
+# GET condicional (ETag / Last-Modified) para el catálogo, la página del producto y la API
+# JSON del catálogo. Los validadores salen de las versiones persistentes de versiones.py,
+# cacheadas con la versión de cache_catalogo en la clave, así que comprobarlos no cuesta
+# ninguna consulta mientras el catálogo no cambia. Si el cliente ya tiene la versión actual se
+# responde 304 sin ejecutar la vista ni renderizar nada.
+#
+# Las páginas HTML muestran el usuario y llevan su token CSRF: su ETag incluye usuario, sesión
+# e idioma, y no llevan Last-Modified (una fecha no distingue entre usuarios). La API no
+# depende del usuario y lleva los dos validadores.
+
+METODOS = ('GET', 'HEAD')
+
+
+def etag(*partes):
+    return '"%s"' % hashlib.md5(repr(partes).encode()).hexdigest()
+
+
+def version_catalogo():
+    """(versión, fecha de actualización) persistentes del catálogo completo."""
+    clave = cache_catalogo.clave('validadores', 'catalogo', cache_catalogo.version_catalogo())
+    return cache_catalogo.obtener('validadores', clave,
+                                  lambda: versiones.leer([versiones.CATALOGO])[versiones.CATALOGO])
+
+
+def version_producto(pk):
+    """Versiones persistentes del producto y de su marca, o None si el producto no existe."""
+    def calcular():
+        marca_id = Producto.objects.filter(pk=pk).values_list('marca_id', flat=True).first()
+        if marca_id is None:
+            return {'versiones': None, 'marca_id': None}
+        leidas = versiones.leer([versiones.clave_producto(pk), versiones.clave_marca(marca_id)])
+        return {'versiones': (leidas[versiones.clave_producto(pk)], leidas[versiones.clave_marca(marca_id)]),
+                'marca_id': marca_id, 'version_marca': cache_catalogo.version_marca(marca_id)}
+
+    def valida(datos):
+        return datos['marca_id'] is None or datos['version_marca'] == cache_catalogo.version_marca(datos['marca_id'])
+
+    clave = cache_catalogo.clave('validadores', 'producto', pk, cache_catalogo.version_producto(pk))
+    return cache_catalogo.obtener('validadores', clave, calcular, valida)['versiones']
+
+
+def _de_usuario(request):
+    # La sesión cambia al iniciar sesión, que es cuando se renueva el secreto CSRF
+    return request.user.pk, request.session.session_key, get_language()
+
+
+def validadores_catalogo(request):
+    return etag(version_catalogo(), request.get_full_path(), *_de_usuario(request)), None
+
+
+def validadores_producto(request, pk):
+    leidas = version_producto(pk)
+    # Sin producto no hay validador: la vista responde 404
+    return (etag(leidas, pk, *_de_usuario(request)), None) if leidas else (None, None)
+
+
+def validadores_api(request):
+    version, actualizado = version_catalogo()
+    return etag(version, actualizado, request.get_full_path()), actualizado
+
+
+def _condicional(request, etag_actual, modificado):
+    marca = timegm(modificado.utctimetuple()) if modificado else None
+    return get_conditional_response(request, etag=etag_actual, last_modified=marca)
+
+
+def _cabeceras(respuesta, etag_actual, modificado, publica):
+    if respuesta.status_code in (200, 304):
+        if etag_actual:
+            respuesta.headers.setdefault('ETag', etag_actual)
+        if modificado:
+            respuesta.headers.setdefault('Last-Modified', http_date(timegm(modificado.utctimetuple())))
+        # Se puede guardar, pero hay que revalidarla cada vez (con If-None-Match es barato)
+        patch_cache_control(respuesta, no_cache=True, **({'public': True} if publica else {'private': True}))
+    return respuesta
+
+
+def condicional(calcular, publica=False):
+    """Decorador de vista (para ``dispatch``): ``calcular(request, *args, **kwargs)`` devuelve
+    (etag, fecha de última modificación); si el cliente ya los tiene, 304 sin llamar a la vista."""
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if request.method not in METODOS:
+                return vista(request, *args, **kwargs)
+            etag_actual, modificado = calcular(request, *args, **kwargs)
+            respuesta = _condicional(request, etag_actual, modificado) or vista(request, *args, **kwargs)
+            return _cabeceras(respuesta, etag_actual, modificado, publica)
+        return envoltura
+    return decorador
+
+
+def acondicional(calcular, publica=False):
+    """Como condicional, para el ``dispatch`` de las vistas asíncronas (devuelve una corrutina).
+    Los validadores se calculan en un hilo: pueden necesitar la sesión o la base de datos."""
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if request.method not in METODOS:
+                return vista(request, *args, **kwargs)
+
+            async def responder():
+                etag_actual, modificado = await sync_to_async(calcular)(request, *args, **kwargs)
+                respuesta = _condicional(request, etag_actual, modificado) or await vista(request, *args, **kwargs)
+                return _cabeceras(respuesta, etag_actual, modificado, publica)
+            return responder()
+        return envoltura
+    return decorador
@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .models import Comentario, Producto
+
+ESTRELLAS = range(1, 6)
+CAMPOS = ['num_valoraciones', 'valoracion_media'] + [f'estrellas_{estrellas}' for estrellas in ESTRELLAS]
+
+
+def aplicar_valoracion(producto_id, anterior=None, nueva=None, using=DEFAULT_DB_ALIAS):
+    """Ajusta el resumen del producto cuando un comentario pasa de ``anterior`` a ``nueva`` estrellas.
+
+    Un solo UPDATE con expresiones F(): la media se recalcula a partir del
+    histograma dentro de la propia sentencia, sin leer el producto ni agregar
+    sus comentarios.
+    """
+    if anterior == nueva:
+        return
+    cambios = {}
+    if anterior:
+        cambios[f'estrellas_{anterior}'] = F(f'estrellas_{anterior}') - 1
+    if nueva:
+        cambios[f'estrellas_{nueva}'] = F(f'estrellas_{nueva}') + 1
+    # En un UPDATE todas las columnas se leen con su valor anterior
+    num = F('num_valoraciones') + int(bool(nueva)) - int(bool(anterior))
+    suma = sum(F(f'estrellas_{estrellas}') * estrellas for estrellas in ESTRELLAS) + (nueva or 0) - (anterior or 0)
+    media = ExpressionWrapper(Cast(suma, FloatField()) / NullIf(num, 0), output_field=FloatField())
+    cambios['num_valoraciones'] = num
+    cambios['valoracion_media'] = Coalesce(media, Value(0.0))
+    Producto.objects.using(using).filter(pk=producto_id).update(**cambios)
+
+
+def resumen_vacio():
+    return dict.fromkeys(CAMPOS, 0)
+
+
+def calcular_resumenes(using=DEFAULT_DB_ALIAS):
+    """Resúmenes de todos los productos con comentarios, en una única consulta agrupada."""
+    resumenes = defaultdict(resumen_vacio)
+    filas = Comentario.objects.using(using).filter(valoracion__isnull=False) \
+        .values_list('producto', 'valoracion').annotate(n=Count('pk')).order_by()
+    for producto_id, valoracion, n in filas:
+        resumen = resumenes[producto_id]
+        resumen[f'estrellas_{valoracion}'] += n
+        resumen['num_valoraciones'] += n
+    for resumen in resumenes.values():
+        suma = sum(resumen[f'estrellas_{estrellas}'] * estrellas for estrellas in ESTRELLAS)
+        resumen['valoracion_media'] = suma / resumen['num_valoraciones']
+    return resumenes
@@ -0,0 +1,58 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from .models import VersionCatalogo
+
+# Versiones persistentes del catálogo (modelo VersionCatalogo) para los validadores HTTP de
+# validadores.py. cache_catalogo.invalidar_* las incrementa junto con las de la caché.
+
+CATALOGO = 'catalogo'
+LOTE = 500
+
+
+def clave_producto(pk):
+    return f'producto:{pk}'
+
+
+def clave_marca(pk):
+    return f'marca:{pk}'
+
+
+def registrar_cambios(claves, using=DEFAULT_DB_ALIAS):
+    """Incrementa la versión de cada clave (creándola si no existe) con un solo
+    INSERT ... ON CONFLICT DO UPDATE. Dentro de una transacción, la versión nueva se ve
+    a la vez que el cambio que la provoca."""
+    claves = sorted(set(claves))
+    if not claves:
+        return
+    opts = VersionCatalogo._meta
+    quote_name = connections[using].ops.quote_name
+    tabla = quote_name(opts.db_table)
+    clave, version, actualizado = (quote_name(opts.get_field(campo).column)
+                                   for campo in ('clave', 'version', 'actualizado'))
+    ahora = connections[using].ops.adapt_datetimefield_value(timezone.now())
+    with connections[using].cursor() as cursor:
+        for inicio in range(0, len(claves), LOTE):
+            lote = claves[inicio:inicio + LOTE]
+            cursor.execute(
+                f'INSERT INTO {tabla} ({clave}, {version}, {actualizado}) '
+                f'VALUES {", ".join(["(%s, 1, %s)"] * len(lote))} '
+                f'ON CONFLICT ({clave}) DO UPDATE SET {version} = {tabla}.{version} + 1, '
+                f'{actualizado} = EXCLUDED.{actualizado}',
+                [valor for c in lote for valor in (c, ahora)],
+            )
+
+
+def leer(claves, using=DEFAULT_DB_ALIAS):
+    """{clave: (versión, fecha de actualización)}. Las claves sin fila (productos cargados en
+    bloque, sin cambios desde entonces) se crean en ese momento: así la fecha distingue sus
+    validadores de los de una base de datos anterior con los mismos ids."""
+    versiones = {fila.clave: (fila.version, fila.actualizado)
+                 for fila in VersionCatalogo.objects.using(using).filter(clave__in=claves)}
+    faltan = [clave for clave in claves if clave not in versiones]
+    if faltan:
+        VersionCatalogo.objects.using(using).bulk_create(
+            [VersionCatalogo(clave=clave) for clave in faltan], ignore_conflicts=True)
+        versiones.update((fila.clave, (fila.version, fila.actualizado))
+                         for fila in VersionCatalogo.objects.using(using).filter(clave__in=faltan))
+    return versiones
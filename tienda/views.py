@@ -1,23 +1,45 @@
+import datetime
+
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin, PermissionRequiredMixin
 from django.contrib.auth.views import LoginView
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from .form import PostProducto, CompraForm, RegistroForm, ClienteForm, DireccionesForm, TarjetasForm
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from .form import PostProducto, CompraForm, RegistroForm, ClienteForm, DireccionesForm, TarjetasForm, \
+    ExportarComprasForm, InformeVentasForm
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
+from django.utils.translation import get_language
+from django.template.loader import render_to_string
 from django.db.models import Count, Sum
 from django.db import transaction
-from .models import Producto, Cliente, Compra, Marca, Direccion, Tarjeta, Comentario
+from .models import Producto, Cliente, Compra, Marca, Direccion, Tarjeta, Comentario, VentasProducto, VentasCliente
+from .catalogo import paginar_catalogo, POR_PAGINA
+from .busqueda import buscar_productos, terminos
+from . import autocompletar, cache_catalogo, cola, facetas
+from .compras import realizar_compra, StockInsuficiente
+from . import exportar, informes, reservas
+from .carrito import Carrito
+from .cola import encolar
+from .replicas import leer_de_replica
+from .validadores import condicional, validadores_api, validadores_catalogo, validadores_producto
+from .valoraciones import aplicar_valoracion
+from .comentarios import pagina_comentarios
+from . import middleware as perfil_consultas
 from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView, ListView, CreateView, UpdateView, DeleteView
 from django.views import View
-from django.urls import reverse_lazy
-import json
+from django.urls import reverse, reverse_lazy
+from urllib.parse import urlencode
 
 
-def cliente_existe(user):
-    return Cliente.objects.filter(user=user).exists()
+def cliente_actual(request):
+    """Cliente de la petición (ver ClienteMiddleware); 404 si el usuario no tiene ficha."""
+    if not request.cliente:
+        raise Http404('El usuario no tiene ficha de cliente')
+    return request.cliente
 
 
 class WelcomeView(TemplateView):
@@ -28,6 +50,15 @@ class ProductosView(ListView):
     model = Producto
     template_name = 'tienda/producto.html'
     context_object_name = 'Productos'
+    paginate_by = POR_PAGINA
+
+    def get_queryset(self):
+        return Producto.objects.select_related('marca')
+
+    def paginate_queryset(self, queryset, page_size):
+        # Misma paginación por cursor que el catálogo: no se carga la tabla entera
+        pagina = paginar_catalogo(queryset, self.request.GET.get('orden'), self.request.GET.get('cursor'), page_size)
+        return None, pagina, pagina.object_list, pagina.siguiente is not None
 
     @method_decorator(login_required(login_url='/tienda/login/'))
     @method_decorator(staff_member_required)
@@ -35,10 +66,42 @@ class ProductosView(ListView):
         return super().dispatch(*args, **kwargs)
 
 
+@method_decorator(leer_de_replica, name='dispatch')
+@method_decorator(condicional(validadores_catalogo), name='dispatch')
 class CompraView(ListView):
     model = Producto
     template_name = 'tienda/compra.html'
     context_object_name = 'Productos'
+    paginate_by = POR_PAGINA
+
+    def get_queryset(self):
+        self.filtros = facetas.leer_filtros(self.request.GET)
+        # La marca viene en la misma consulta para no lanzar una por producto
+        return facetas.aplicar(Producto.objects.select_related('marca'), self.filtros)
+
+    def paginate_queryset(self, queryset, page_size):
+        # Paginación por cursor en vez de OFFSET: las páginas profundas cuestan lo mismo que la primera.
+        # La página y su HTML se cachean con la versión del catálogo en la clave.
+        orden, cursor = self.request.GET.get('orden'), self.request.GET.get('cursor')
+
+        def calcular():
+            pagina = paginar_catalogo(queryset, orden, cursor, page_size)
+            return pagina, render_to_string('tienda/catalogo_productos.html', {'Productos': pagina.object_list})
+
+        clave = cache_catalogo.clave('catalogo', cache_catalogo.version_catalogo(), get_language(), self.filtros,
+                                     orden, cursor, page_size)
+        pagina, self.productos_html = cache_catalogo.obtener('catalogo', clave, calcular)
+        return None, pagina, pagina.object_list, pagina.siguiente is not None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['productos_html'] = self.productos_html
+        # Recuentos por faceta a partir del cubo del catálogo completo, sin consultar por marca
+        context['facetas'] = facetas.facetas(facetas.cubo_catalogo(Producto.objects.all()), self.filtros)
+        context['filtros'] = self.filtros.querystring()
+        orden = self.request.GET.get('orden')
+        context['parametros_base'] = urlencode({'orden': orden}) + '&' if orden else ''
+        return context
 
 
 class Post_EditView(UpdateView):
@@ -75,26 +138,61 @@ class Post_Nuevo_View(CreateView):
         return super().dispatch(*args, **kwargs)
 
 
+@method_decorator(leer_de_replica, name='dispatch')
 class BuscarProductoListView(ListView):
     model = Producto
     template_name = 'tienda/mostrarBusqueda.html'
     context_object_name = 'Productos'
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        busqueda = self.request.GET.get('buscar_post')
-        if busqueda:
-            queryset = queryset.filter(nombre__icontains=busqueda)
-        return queryset
+        # Búsqueda sobre el índice de texto (nombre, modelo y marca) ordenada por relevancia
+        texto = self.request.GET.get('buscar_post')
+        clave = cache_catalogo.clave('busqueda', cache_catalogo.version_catalogo(), terminos(texto))
+        resultados = cache_catalogo.obtener(
+            'busqueda', clave, lambda: list(buscar_productos(texto, Producto.objects.select_related('marca'))))
+        # Los resultados están acotados, así que facetas y filtros se calculan sobre la lista ya cargada
+        self.filtros = facetas.leer_filtros(self.request.GET)
+        self.celdas = facetas.cubo_de(resultados)
+        return facetas.filtrar_lista(resultados, self.filtros)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['busqueda'] = self.request.GET.get('buscar_post')
+        context['facetas'] = facetas.facetas(self.celdas, self.filtros)
+        context['parametros_base'] = urlencode({'buscar_post': context['busqueda'] or ''}) + '&'
+        return context
+
+
+@method_decorator(login_required(login_url='/tienda/login/'), name='dispatch')
+@method_decorator(staff_member_required, name='dispatch')
+class EstadisticasCacheView(View):
+
+    def get(self, request):
+        return JsonResponse(cache_catalogo.estadisticas())
+
+
+@method_decorator(login_required(login_url='/tienda/login/'), name='dispatch')
+@method_decorator(staff_member_required, name='dispatch')
+class EstadoTareasView(View):
+
+    def get(self, request):
+        return JsonResponse(cola.estadisticas())
+
+
+@method_decorator(login_required(login_url='/tienda/login/'), name='dispatch')
+@method_decorator(staff_member_required, name='dispatch')
+class PerfilConsultasView(TemplateView):
+    template_name = 'tienda/perfil_consultas.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['activo'] = settings.TIENDA_PERFILAR_CONSULTAS
+        context['vistas'] = perfil_consultas.peores_vistas()
         return context
 
 
 class Log_In_View(LoginView):
-    template_name = 'tienda/login.html'
+    template_name = 'tienda/Login.html'
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -115,6 +213,7 @@ class Log_outView(View):
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(condicional(validadores_producto), name='dispatch')
 class Checkout(LoginRequiredMixin, View):
     login_url = 'login'
     template_name = 'tienda/checkout.html'
@@ -122,71 +221,195 @@ class Checkout(LoginRequiredMixin, View):
     form_class = CompraForm
     success_url = reverse_lazy('welcome')
 
+    def datos_producto(self, pk):
+        # Producto y primera página de comentarios (el resto se pide a ComentariosProductoView),
+        # cacheados con la versión del producto; la de su marca se comprueba al leer.
+        def calcular():
+            producto = get_object_or_404(Producto.objects.select_related('marca'), pk=pk)
+            comentarios, siguiente = pagina_comentarios(pk)
+            return {'producto': producto, 'comentarios': comentarios, 'siguiente': siguiente, 'producto_id': pk,
+                    'version_marca': cache_catalogo.version_marca(producto.marca_id)}
+
+        def valida(datos):
+            return datos['version_marca'] == cache_catalogo.version_marca(datos['producto'].marca_id)
+
+        clave = cache_catalogo.clave('producto', pk, cache_catalogo.version_producto(pk))
+        return cache_catalogo.obtener('producto', clave, calcular, valida)
+
     def get(self, request, pk):
-        producto = get_object_or_404(Producto, pk=pk)
         form = CompraForm()
-        comentarios = Compra.objects.filter(producto=producto).order_by('-fecha')
-        return render(request, 'tienda/checkout.html', {'form': form, 'producto': producto, 'comentarios': comentarios})
+        return render(request, 'tienda/checkout.html', {'form': form, **self.datos_producto(pk)})
 
     def post(self, request, pk):
         producto = get_object_or_404(Producto, pk=pk)
-        cliente = get_object_or_404(Cliente, user=request.user)
+        cliente = cliente_actual(request)
         form = CompraForm(request.POST)
         if form.is_valid():
-            unidades = form.cleaned_data['unidades']
-            if unidades <= producto.unidades:
-                with transaction.atomic():
-                    producto.unidades -= unidades
-                    producto.save()
-                    compra = Compra()
-                    compra.producto = producto
-                    compra.user = cliente
-                    compra.unidades = unidades
-                    compra.importe = unidades * producto.precio
-                    compra.fecha = timezone.now()
-                    compra.save()
-                    cliente.saldo -= compra.importe
-                    cliente.save()
+            try:
+                realizar_compra(cliente, producto.pk, form.cleaned_data['unidades'])
+            except StockInsuficiente:
+                form.add_error('unidades', 'No quedan unidades suficientes')
+            else:
                 return redirect('welcome')
-        return render(request, 'tienda/checkout.html', {'form': form, 'producto': producto})
+        return render(request, 'tienda/checkout.html', {'form': form, **self.datos_producto(pk)})
+
+
+def producto_json(producto):
+    return {'id': producto.pk, 'nombre': producto.nombre, 'modelo': producto.modelo,
+            'marca': {'id': producto.marca_id, 'nombre': producto.marca.nombre}, 'precio': str(producto.precio),
+            'vip': producto.vip, 'en_stock': producto.unidades > 0, 'valoracion_media': producto.valoracion_media,
+            'num_valoraciones': producto.num_valoraciones}
+
+
+# Catálogo en JSON para apps y sincronización: mismos filtros, orden y cursor que CompraView
+# y los mismos validadores, así que un cliente puede recorrerlo y después revalidar cada
+# página con If-None-Match y sólo descargar las que han cambiado.
+@method_decorator(leer_de_replica, name='dispatch')
+@method_decorator(condicional(validadores_api, publica=True), name='dispatch')
+class CatalogoApiView(View):
+
+    def get(self, request):
+        filtros = facetas.leer_filtros(request.GET)
+        orden, cursor = request.GET.get('orden'), request.GET.get('cursor')
+
+        def calcular():
+            queryset = facetas.aplicar(Producto.objects.select_related('marca'), filtros)
+            pagina = paginar_catalogo(queryset, orden, cursor, POR_PAGINA)
+            return {'productos': [producto_json(producto) for producto in pagina.object_list],
+                    'orden': pagina.orden, 'siguiente': pagina.siguiente}
 
+        clave = cache_catalogo.clave('api', cache_catalogo.version_catalogo(), filtros, orden, cursor, POR_PAGINA)
+        return JsonResponse(cache_catalogo.obtener('api', clave, calcular))
 
+
+# Sugerencias del buscador mientras se escribe (?q=...), desde el índice en memoria de
+# autocompletar.py: no consulta la base de datos salvo para ponerlo al día.
+class AutocompletarView(View):
+
+    def get(self, request):
+        try:
+            limite = min(int(request.GET.get('limite', autocompletar.LIMITE)), autocompletar.LIMITE_MAXIMO)
+        except ValueError:
+            return HttpResponseBadRequest('Límite no válido')
+        sugerencias = autocompletar.sugerir(request.GET.get('q', ''), limite)
+        for sugerencia in sugerencias:
+            sugerencia['url'] = reverse('checkout', args=[sugerencia['id']])
+        return JsonResponse({'sugerencias': sugerencias})
+
+
+# Páginas siguientes de comentarios de un producto: fragmento HTML para la página
+# del producto o JSON con ?formato=json. Paginación por cursor (?antes=<id>).
+@method_decorator(leer_de_replica, name='dispatch')
+class ComentariosProductoView(View):
+
+    def get(self, request, pk):
+        try:
+            antes = int(request.GET['antes']) if 'antes' in request.GET else None
+        except ValueError:
+            return HttpResponseBadRequest('Cursor no válido')
+        comentarios, siguiente = pagina_comentarios(pk, antes)
+        if request.GET.get('formato') == 'json':
+            return JsonResponse({
+                'comentarios': [{'id': c.pk, 'comentario': c.comentario, 'valoracion': c.valoracion}
+                                for c in comentarios],
+                'siguiente': siguiente,
+            })
+        return render(request, 'tienda/comentarios_pagina.html',
+                      {'comentarios': comentarios, 'siguiente': siguiente, 'producto_id': pk})
+
+
+@method_decorator(leer_de_replica, name='dispatch')
 class TopProducto_Views(ListView):
     template_name = 'tienda/informe.html'
     context_object_name = 'topP'
 
     def get(self, request):
-        topP = Producto.objects.annotate(sum_unidades=Sum('compra__unidades'),
-                                         sum_importes=Sum('compra__importe')).order_by('-sum_unidades')[:10]
+        # Se lee de la tabla de agregados: el coste no depende del tamaño del histórico
+        topP = VentasProducto.objects.select_related('producto').order_by('-unidades', 'producto')[:10]
         return render(request, self.template_name, {'topP': topP})
 
 
-# La función realiza una consulta a la base de datos para obtener los 10 mejores clientes.
-# Utilizando Cliente.objects.annotate(gastado=Sum('compra__importe')), se agrega una anotación
-# llamada gastado que calcula la suma de los importes de todas las compras realizadas por cada cliente.
-# Luego, los resultados se ordenan de forma descendente basándose en el campo gastado. Finalmente, se
-# renderiza la plantilla top10mejores.html con los datos de los topClientes.
+# La función obtiene los 10 mejores clientes a partir de la tabla VentasCliente, que guarda
+# el importe gastado por cada cliente y se actualiza en la misma transacción que cada compra
+# (ver agregados.py). Los resultados se ordenan de forma descendente por el importe gastado
+# usando su índice, así que el coste no crece con el histórico de compras.
+@method_decorator(leer_de_replica, name='dispatch')
 class topClientes_View(ListView):
-    model = Cliente
+    model = VentasCliente
     template_name = 'tienda/informe.html'
     context_object_name = 'clientes'
 
     def get_queryset(self):
-        return Cliente.objects.annotate(gastado=Sum('compra__importe')).order_by('-gastado')[:10]
+        return VentasCliente.objects.select_related('cliente__user').order_by('-importe', 'cliente')[:10]
 
 
 # En esta funcion, se obtiene todas las compras realizadas por un usuario mediante el uso de
 # la función filter de la clase Compra. Estas compras se ordenan por fecha en orden descendente.
 # Luego, se renderiza la plantilla tienda/historialCompras.html y se pasa el resultado de la consulta a compras.
 # Esto permitirá que la plantilla acceda a los datos de las compras y los muestre correctamente.
+@method_decorator(leer_de_replica, name='dispatch')
 class historial_View(ListView):
     model = Compra
     template_name = 'tienda/informe.html'
     context_object_name = 'compras'
     ordering = '-fecha'
+    paginate_by = 100
 
     def get_queryset(self):
-        return super().get_queryset().order_by(self.ordering)
+        return super().get_queryset().select_related('producto').order_by(self.ordering)
+
+
+# Ventas entre dos fechas (por defecto, los últimos 90 días) desde VentasPeriodo, sin recorrer
+# Compra: la evolución del total de la tienda o de un producto, marca o cliente (?clave=) y el
+# ranking de la dimensión elegida con su variación frente al periodo anterior. ?formato=json
+# devuelve lo mismo en JSON.
+@method_decorator(staff_member_required, name='dispatch')
+@method_decorator(leer_de_replica, name='dispatch')
+class InformeVentasView(View):
+    template_name = 'tienda/informe_ventas.html'
+    dias_por_defecto = 90
+
+    def get(self, request):
+        form = InformeVentasForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_json(), content_type='application/json')
+        hasta = form.cleaned_data['hasta'] or timezone.localdate()
+        desde = form.cleaned_data['desde'] or hasta - datetime.timedelta(days=self.dias_por_defecto - 1)
+        if desde > hasta:
+            return HttpResponseBadRequest('La fecha inicial es posterior a la final')
+        periodo = form.cleaned_data['periodo'] or informes.periodo_para(desde, hasta)
+        dimension = form.cleaned_data['dimension'] or 'marca'
+        clave = form.cleaned_data['clave']
+        datos = {
+            'desde': desde, 'hasta': hasta, 'periodo': periodo, 'dimension': dimension, 'clave': clave,
+            'serie': informes.serie(dimension, clave, desde, hasta, periodo) if clave else
+            informes.serie('total', 0, desde, hasta, periodo),
+            'ranking': [] if clave else informes.ranking(dimension, desde, hasta, periodo),
+        }
+        if request.GET.get('formato') == 'json':
+            return JsonResponse(datos)
+        return render(request, self.template_name, {'form': form, **datos})
+
+
+# Descarga del histórico completo en CSV o JSONL. La respuesta se genera en streaming
+# sobre un cursor del servidor, así que la memoria no crece con el número de compras.
+@method_decorator(staff_member_required, name='dispatch')
+@method_decorator(leer_de_replica, name='dispatch')
+class ExportarComprasView(View):
+
+    def get(self, request):
+        form = ExportarComprasForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_json(), content_type='application/json')
+        formato = form.cleaned_data['formato'] or 'csv'
+        generar, content_type = exportar.FORMATOS[formato]
+        compras = exportar.filtrar_compras(form.cleaned_data['desde'], form.cleaned_data['hasta'],
+                                           form.cleaned_data['cliente'])
+        # La respuesta se consume después de salir de la vista: se fija ya la base de datos elegida
+        compras = compras.using(compras.db)
+        response = StreamingHttpResponse(generar(compras), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="compras.{formato}"'
+        return response
 
 
 class EditarDireccionView(LoginRequiredMixin, UpdateView):
@@ -240,13 +463,11 @@ class EditarGeneralView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('perfil_cliente')
 
     def get(self, request, *args, **kwargs):
-        cliente, created = Cliente.objects.get_or_create(user=request.user)
-        form = ClienteForm(instance=cliente)
+        form = ClienteForm(instance=request.cliente or Cliente(user=request.user, saldo=0))
         return render(request, self.template_name, {'form': form})
 
     def post(self, request, *args, **kwargs):
-        cliente, created = Cliente.objects.get_or_create(user=request.user)
-        form = ClienteForm(request.POST, instance=cliente)
+        form = ClienteForm(request.POST, instance=request.cliente or Cliente(user=request.user, saldo=0))
         if form.is_valid():
             form.save()
             return redirect('menu')
@@ -265,6 +486,7 @@ class RegistroView(View):
         form = self.form_class()
         return render(request, self.template_name, {'form': form})
 
+    @transaction.atomic
     def post(self, request):
         form = self.form_class(request.POST)
         if form.is_valid():
@@ -273,6 +495,7 @@ class RegistroView(View):
 
             cliente = Cliente(user=user, saldo=0, vip=False)
             cliente.save()
+            encolar('bienvenida', user_id=user.pk)
 
             login(request, user)
             return redirect('welcome')
@@ -284,9 +507,12 @@ class ComentarioCreateView(CreateView):
     fields = ['valoracion', 'comentario']
     template_name = 'tienda/comentario_create.html'
 
+    @transaction.atomic
     def form_valid(self, form):
         form.instance.producto_id = self.kwargs['pk']
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        aplicar_valoracion(self.object.producto_id, nueva=self.object.valoracion)
+        return response
 
     def get_success_url(self):
         return reverse_lazy('checkout', kwargs={'pk': self.kwargs['pk']})
@@ -297,6 +523,13 @@ class ComentarioUpdateView(LoginRequiredMixin, UpdateView, UserPassesTestMixin):
     fields = ['valoracion', 'comentario']
     template_name = 'tienda/comentario_editar.html'
 
+    @transaction.atomic
+    def form_valid(self, form):
+        anterior = form.initial.get('valoracion')
+        response = super().form_valid(form)
+        aplicar_valoracion(self.object.producto_id, anterior=anterior, nueva=self.object.valoracion)
+        return response
+
     def get_success_url(self):
         return reverse_lazy('checkout', kwargs={'pk': self.object.producto_id})
 
@@ -310,19 +543,20 @@ class ComentarioListView(ListView):
 
 class AgregarAlCarrito(View):
     def post(self, request, *args, **kwargs):
-        producto_id = request.POST.get('producto_id')
-        unidades = int(request.POST.get('unidades', 1))
-
-        carrito = request.session.get('carrito', [])
-        if carrito:
-            carrito = json.loads(carrito)
-
-        carrito.append({
-            'producto_id': producto_id,
-            'unidades': unidades
-        })
-
-        request.session['carrito'] = json.dumps(carrito)
+        try:
+            producto_id = int(request.POST.get('producto_id'))
+            unidades = int(request.POST.get('unidades', 1))
+            # Las unidades quedan apartadas mientras están en el carrito (ver reservas.py)
+            reservas.reservar(reservas.titular(request.session), producto_id, unidades)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest('Producto o unidades no válidos')
+        except StockInsuficiente:
+            # Como Checkout.post: el formulario de la ficha muestra el error
+            form = CompraForm({'unidades': unidades})
+            form.is_valid()
+            form.add_error(None, 'No quedan unidades suficientes para añadir al carrito')
+            return render(request, 'tienda/checkout.html', {'form': form, **Checkout().datos_producto(producto_id)})
+        Carrito(request.session).agregar(producto_id, unidades)
         return redirect('checkout', pk=producto_id)
 
 
@@ -331,59 +565,35 @@ class VerCarritoView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        carrito = self.request.session.get('carrito', [])
-        if carrito:
-            carrito = json.loads(carrito)
-            productos = Producto.objects.filter(id__in=[item['producto_id'] for item in carrito])
-            for item in carrito:
-                producto = productos.get(id=item['producto_id'])
-                item['producto'] = producto
-                # Calcular el precio total para cada elemento del carrito
-                item['precio_total'] = item['unidades'] * producto.precio
-        context['carrito'] = carrito
+        # Todos los productos del carrito se cargan en una sola consulta
+        context['carrito'] = Carrito(self.request.session).items()
+        context['reservado_hasta'] = reservas.caducidad(self.request.session)
         return context
 
 
-class CheckoutCarritoView(View):
+class CheckoutCarritoView(LoginRequiredMixin, View):
     template_name = 'tienda/checkout_carrito.html'
 
     def get(self, request, *args, **kwargs):
-        # Obtener el contenido del carrito de la sesión
-        carrito = request.session.get('carrito', [])
-        if carrito:
-            carrito = json.loads(carrito)
-            productos = Producto.objects.filter(id__in=[item['producto_id'] for item in carrito])
-            for item in carrito:
-                producto = productos.get(id=item['producto_id'])
-                item['producto'] = producto
-
-        contexto = {'carrito': carrito}
-        return render(request, 'tienda/checkout_carrito.html', contexto)
+        contexto = {'carrito': Carrito(request.session).items()}
+        return render(request, self.template_name, contexto)
 
     def post(self, request, *args, **kwargs):
-        # Obtener el contenido del carrito de la sesión
-        carrito = request.session.get('carrito', [])
-        if carrito:
-            carrito = json.loads(carrito)
-            # Crear una nueva instancia de Compra
-            compra = Compra.objects.create(
-                user=request.user  # Asignar el usuario actual
-            )
-
-            # Agregar los productos del carrito a la compra
-            for item in carrito:
-                producto = Producto.objects.get(id=item['producto_id'])
-                compra.producto_set.create(
-                    producto=producto,
-                    unidades=item['unidades'],
-                    importe=item['unidades'] * producto.precio,
-                    iva=0.21
-                )
-            # Limpiar el carrito después de completar la compra
-            request.session['carrito'] = json.dumps([])
-
-            return redirect('checkout_carrito.html')
-        else:
-            # Si el formulario no es válido, volver a renderizar la página con los errores
-            contexto = {'carrito': carrito}
-            return render(request, 'tienda/checkout_carrito.html', contexto)
+        carrito = Carrito(request.session)
+        if not carrito:
+            return render(request, self.template_name, {'carrito': []})
+        cliente = cliente_actual(request)
+        try:
+            reservas.confirmar(cliente, reservas.titular(request.session), carrito.por_producto())
+        except StockInsuficiente as error:
+            productos = Producto.objects.in_bulk(error.productos)
+            contexto = {'carrito': carrito.items(),
+                        'error': 'No quedan unidades suficientes de: ' +
+                                 ', '.join(producto.nombre for producto in productos.values())}
+            return render(request, self.template_name, contexto)
+        except ValueError:
+            return render(request, self.template_name,
+                          {'carrito': carrito.items(), 'error': 'El carrito contiene unidades no válidas'})
+        # Limpiar el carrito después de completar la compra
+        carrito.vaciar()
+        return redirect('welcome')
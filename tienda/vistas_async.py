@@ -0,0 +1,166 @@
+import functools
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import InvalidPage, Paginator
+from django.http import Http404
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.utils.translation import get_language
+from django.views import View
+
+from . import cache_catalogo, facetas
+from .busqueda import abuscar_productos, terminos
+from .catalogo import POR_PAGINA, apaginar_catalogo
+from .comentarios import apagina_comentarios
+from .form import CompraForm
+from .models import Compra, Producto, VentasCliente, VentasProducto
+from .replicas import leer_de_replica
+from .validadores import acondicional, validadores_catalogo, validadores_producto
+from .views import Checkout
+
+# Versiones asíncronas de las páginas de sólo lectura (catálogo, búsqueda, ficha de producto e
+# informes) para servir con ASGI: mientras esperan a la base de datos o a la caché no ocupan un
+# hilo del servidor. urls.py las usa en lugar de las de views.py con TIENDA_VISTAS_ASYNC, que
+# config/asgi.py activa por defecto. Devuelven lo mismo que las síncronas y comparten sus
+# entradas de caché. Con Django 4.1 el ORM asíncrono ejecuta cada consulta en un hilo aparte;
+# la ganancia está en que la espera no bloquea al resto de peticiones.
+
+
+async def cargar_usuario(request):
+    """Carga el usuario (y con él la sesión) antes de renderizar: las plantillas lo usan y en
+    el bucle de eventos no se puede consultar la base de datos de forma síncrona."""
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+def alogin_requerido(vista):
+    """login_required para el ``dispatch`` de las vistas asíncronas. Se pone por fuera de
+    acondicional, como login_required en Checkout: sin sesión no hay 304 aunque el ETag coincida."""
+    @functools.wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        if not await cargar_usuario(request):
+            return redirect_to_login(request.get_full_path())
+        return await vista(request, *args, **kwargs)
+    return envoltura
+
+
+@method_decorator(leer_de_replica, name='dispatch')
+@method_decorator(acondicional(validadores_catalogo), name='dispatch')
+class CompraAsyncView(View):
+    template_name = 'tienda/compra.html'
+
+    async def get(self, request):
+        filtros = facetas.leer_filtros(request.GET)
+        orden, cursor = request.GET.get('orden'), request.GET.get('cursor')
+        queryset = facetas.aplicar(Producto.objects.select_related('marca'), filtros)
+
+        async def calcular():
+            pagina = await apaginar_catalogo(queryset, orden, cursor, POR_PAGINA)
+            return pagina, render_to_string('tienda/catalogo_productos.html', {'Productos': pagina.object_list})
+
+        clave = cache_catalogo.clave('catalogo', await cache_catalogo.aversion_catalogo(), get_language(), filtros,
+                                     orden, cursor, POR_PAGINA)
+        pagina, productos_html = await cache_catalogo.aobtener('catalogo', clave, calcular)
+        celdas = await facetas.acubo_catalogo(Producto.objects.all())
+        opciones = await facetas.aopciones_marca()
+        await cargar_usuario(request)
+        return render(request, self.template_name, {
+            'Productos': pagina.object_list,
+            'page_obj': pagina,
+            'productos_html': productos_html,
+            'facetas': facetas.facetas(celdas, filtros, opciones),
+            'filtros': filtros.querystring(),
+            'parametros_base': urlencode({'orden': orden}) + '&' if orden else '',
+        })
+
+
+@method_decorator(leer_de_replica, name='dispatch')
+class BuscarProductoAsyncView(View):
+    template_name = 'tienda/mostrarBusqueda.html'
+
+    async def get(self, request):
+        texto = request.GET.get('buscar_post')
+        clave = cache_catalogo.clave('busqueda', await cache_catalogo.aversion_catalogo(), terminos(texto))
+        resultados = await cache_catalogo.aobtener(
+            'busqueda', clave, lambda: abuscar_productos(texto, Producto.objects.select_related('marca')))
+        filtros = facetas.leer_filtros(request.GET)
+        opciones = await facetas.aopciones_marca()
+        await cargar_usuario(request)
+        return render(request, self.template_name, {
+            'Productos': facetas.filtrar_lista(resultados, filtros),
+            'busqueda': texto,
+            'facetas': facetas.facetas(facetas.cubo_de(resultados), filtros, opciones),
+            'parametros_base': urlencode({'buscar_post': texto or ''}) + '&',
+        })
+
+
+@method_decorator(alogin_requerido, name='dispatch')
+@method_decorator(acondicional(validadores_producto), name='dispatch')
+class ProductoAsyncView(View):
+    """Ficha del producto. La compra (POST) sigue en la vista síncrona Checkout."""
+    template_name = 'tienda/checkout.html'
+
+    async def get(self, request, pk):
+        return render(request, self.template_name, {'form': CompraForm(), **await self.datos_producto(pk)})
+
+    async def post(self, request, pk):
+        return await sync_to_async(Checkout.as_view())(request, pk=pk)
+
+    @staticmethod
+    async def datos_producto(pk):
+        # Mismas entradas de caché que Checkout.datos_producto
+        async def calcular():
+            producto = await Producto.objects.select_related('marca').filter(pk=pk).afirst()
+            if producto is None:
+                raise Http404('No existe el producto')
+            comentarios, siguiente = await apagina_comentarios(pk)
+            return {'producto': producto, 'comentarios': comentarios, 'siguiente': siguiente, 'producto_id': pk,
+                    'version_marca': await cache_catalogo.aversion_marca(producto.marca_id)}
+
+        async def valida(datos):
+            return datos['version_marca'] == await cache_catalogo.aversion_marca(datos['producto'].marca_id)
+
+        clave = cache_catalogo.clave('producto', pk, await cache_catalogo.aversion_producto(pk))
+        return await cache_catalogo.aobtener('producto', clave, calcular, valida)
+
+
+@method_decorator(leer_de_replica, name='dispatch')
+class TopProductosAsyncView(View):
+
+    async def get(self, request):
+        topP = [venta async for venta in
+                VentasProducto.objects.select_related('producto').order_by('-unidades', 'producto')[:10]]
+        await cargar_usuario(request)
+        return render(request, 'tienda/informe.html', {'topP': topP})
+
+
+@method_decorator(leer_de_replica, name='dispatch')
+class TopClientesAsyncView(View):
+
+    async def get(self, request):
+        clientes = [venta async for venta in
+                    VentasCliente.objects.select_related('cliente__user').order_by('-importe', 'cliente')[:10]]
+        await cargar_usuario(request)
+        return render(request, 'tienda/informe.html', {'clientes': clientes})
+
+
+@method_decorator(leer_de_replica, name='dispatch')
+class HistorialAsyncView(View):
+    paginate_by = 100
+
+    async def get(self, request):
+        def pagina():
+            # El Paginator cuenta con COUNT(*) y no tiene versión asíncrona
+            paginador = Paginator(Compra.objects.select_related('producto').order_by('-fecha'), self.paginate_by)
+            try:
+                pagina = paginador.page(request.GET.get('page') or 1)
+            except InvalidPage:
+                raise Http404('Página no válida')
+            pagina.object_list = list(pagina.object_list)
+            return pagina
+
+        page_obj = await sync_to_async(pagina)()
+        await cargar_usuario(request)
+        return render(request, 'tienda/informe.html', {'compras': page_obj.object_list, 'page_obj': page_obj})